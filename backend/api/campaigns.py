@@ -29,6 +29,7 @@ class CampaignCreate(BaseModel):
     context_messages_count: int = 3
     system_instruction: str
     example_replies: Optional[dict] = None
+    settings: Optional[dict] = None
     active: bool = False
 
 
@@ -43,6 +44,7 @@ class CampaignUpdate(BaseModel):
     context_messages_count: Optional[int] = None
     system_instruction: Optional[str] = None
     example_replies: Optional[dict] = None
+    settings: Optional[dict] = None
     active: Optional[bool] = None
 
 
@@ -100,6 +102,7 @@ async def create_campaign(campaign_data: CampaignCreate, db: Session = Depends(g
         context_messages_count=campaign_data.context_messages_count,
         system_instruction=campaign_data.system_instruction,
         example_replies=campaign_data.example_replies,
+        settings=campaign_data.settings,
         active=campaign_data.active
     )
     
@@ -195,7 +198,7 @@ async def refresh_campaigns_cache():
     """Принудительное обновление кэша кампаний"""
     if telegram_agent:
         telegram_agent.force_campaigns_refresh()
-        return {"message": "Кэш кампаний будет обновлен при следующем запросе"}
+        return {"message": "Обновление кэша кампаний запущено"}
     else:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -8,6 +8,8 @@ import json
 from database.models.base import get_db
 from database.models.campaign import Campaign
 from database.models.log import ActivityLog
+from backend.core.campaign_snapshot import CampaignSnapshot
+from backend.core.entity_cache import entity_cache, entity_title, peer_key
 
 router = APIRouter()
 
@@ -69,7 +71,7 @@ async def get_chat_messages(
             raise HTTPException(status_code=503, detail="Telegram агент не подключен")
         
         # Получаем сообщения через Telegram API
-        chat_entity = await telegram_agent.client.get_entity(chat_id)
+        chat_entity = await entity_cache.get_entity(telegram_agent.client, chat_id)
         
         messages = []
         # Если before_message_id не указан, не передаем max_id
@@ -173,11 +175,10 @@ async def send_message_to_chat(
         if not text:
             raise HTTPException(status_code=400, detail="Текст сообщения не может быть пустым")
         
-        # Отправляем сообщение
-        sent_message = await telegram_agent.client.send_message(
-            chat_id,
-            text,
-            reply_to=reply_to
+        # Отправляем сообщение через очередь аккаунта (с учетом FloodWait)
+        sent_message = await telegram_agent.send_scheduler.send(
+            peer_key(chat_id),
+            lambda: telegram_agent.client.send_message(chat_id, text, reply_to=reply_to)
         )
         
         # Логируем отправку
@@ -210,7 +211,7 @@ async def get_chat_info(chat_id: str):
         if not telegram_agent or not (telegram_agent.is_connected() if hasattr(telegram_agent, 'is_connected') and callable(telegram_agent.is_connected) else telegram_agent.is_connected):
             raise HTTPException(status_code=503, detail="Telegram агент не подключен")
         
-        chat_entity = await telegram_agent.client.get_entity(chat_id)
+        chat_entity = await entity_cache.get_entity(telegram_agent.client, chat_id)
         
         info = {
             "id": str(chat_entity.id),
@@ -286,10 +287,10 @@ async def trigger_manual_response(
         
         target_message = message[0]
         
-        # Запускаем обработку в фоне
+        # Запускаем обработку в фоне (снимок не зависит от сессии запроса)
         background_tasks.add_task(
             process_manual_trigger,
-            campaign,
+            CampaignSnapshot.from_campaign(campaign),
             target_message
         )
         
@@ -318,11 +319,8 @@ async def log_manual_message(
         chat_title = "Unknown"
         if telegram_agent and (telegram_agent.is_connected() if hasattr(telegram_agent, 'is_connected') and callable(telegram_agent.is_connected) else telegram_agent.is_connected):
             try:
-                entity = await telegram_agent.client.get_entity(chat_id)
-                if hasattr(entity, 'title'):
-                    chat_title = entity.title
-                elif hasattr(entity, 'username'):
-                    chat_title = f"@{entity.username}"
+                entity = await entity_cache.get_entity(telegram_agent.client, chat_id)
+                chat_title = entity_title(entity)
             except:
                 pass
         
@@ -337,7 +335,8 @@ async def log_manual_message(
             original_message=text,
             agent_response=f"Manual action: {action}",
             status="sent",
-            processing_time_ms=0
+            processing_time_ms=0,
+            source="manual"
         )
         
         db.add(log_entry)
@@ -347,10 +346,10 @@ async def log_manual_message(
         print(f"Ошибка логирования ручного действия: {e}")
 
 
-async def process_manual_trigger(campaign: Campaign, message):
+async def process_manual_trigger(campaign: CampaignSnapshot, message):
     """Обработка принудительного триггера"""
     try:
         if telegram_agent:
-            await telegram_agent.process_campaign_trigger(campaign, message)
+            await telegram_agent.process_campaign_trigger(campaign, message, source="manual")
     except Exception as e:
         print(f"Ошибка принудительной обработки: {e}")
\ No newline at end of file
@@ -1,15 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from typing import List, Optional
+from sqlalchemy import case, desc, func
+from typing import Dict, Iterable, List, Optional, Sequence
 from datetime import datetime, timedelta
 
 from database.models.base import get_db
 from database.models.log import ActivityLog
 from database.models.campaign import Campaign
+from backend.core.stage_timings import stage_percentiles
 
 router = APIRouter()
 
+# Сколько последних триггеров кампании учитывается в перцентилях этапов
+STAGE_STATS_SAMPLE = 1000
+
+# Статусы логов в статистике (всегда присутствуют в ответе, даже с нулем)
+STATUSES = ["sent", "failed", "pending", "rate_limited", "coalesced"]
+
+# Перцентили времени обработки
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+def _supports_percentiles(db: Session) -> bool:
+    """Есть ли в БД агрегат percentile_cont (PostgreSQL; в SQLite его нет)"""
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _status_counts(rows: Iterable[Sequence]) -> Dict[str, int]:
+    """Счетчики по статусам из строк (статус, количество, ...) с нулями для отсутствующих"""
+    counts = {status_val: 0 for status_val in STATUSES}
+    for row in rows:
+        if row[0] is not None:
+            counts[row[0]] = counts.get(row[0], 0) + row[1]
+    return counts
+
 
 @router.get("/", response_model=List[dict])
 async def get_activity_logs(
@@ -68,36 +92,51 @@ async def get_campaign_stats(campaign_id: int, db: Session = Depends(get_db)):
             detail="Кампания не найдена"
         )
     
-    # Общее количество логов
-    total_logs = db.query(ActivityLog).filter(ActivityLog.campaign_id == campaign_id).count()
+    # Статусы и время обработки - одним проходом по логам кампании
+    rows = db.query(
+        ActivityLog.status,
+        func.count(ActivityLog.id),
+        func.sum(ActivityLog.processing_time_ms),
+        func.count(ActivityLog.processing_time_ms),
+    ).filter(
+        ActivityLog.campaign_id == campaign_id
+    ).group_by(ActivityLog.status).all()
     
-    # Статистика по статусам
-    status_stats = {}
-    for status_val in ["sent", "failed", "pending"]:
-        count = db.query(ActivityLog).filter(
-            ActivityLog.campaign_id == campaign_id,
-            ActivityLog.status == status_val
-        ).count()
-        status_stats[status_val] = count
+    status_stats = _status_counts(rows)
+    total_logs = sum(row[1] for row in rows)
     
-    # Статистика за последние 24 часа
+    # Записи за 24 часа - отдельным запросом по индексу времени
     cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    recent_logs = db.query(ActivityLog).filter(
+    recent_logs = db.query(func.count(ActivityLog.id)).filter(
         ActivityLog.campaign_id == campaign_id,
         ActivityLog.timestamp >= cutoff_time
-    ).count()
+    ).scalar()
     
     # Среднее время обработки
-    avg_processing_time = db.query(ActivityLog.processing_time_ms).filter(
+    time_sum = sum(row[2] or 0 for row in rows)
+    time_count = sum(row[3] for row in rows)
+    avg_time = time_sum / time_count if time_count else None
+    
+    # Перцентили времени только отправленных ответов (percentile_cont есть только в PostgreSQL)
+    processing_percentiles = None
+    if _supports_percentiles(db):
+        values = db.query(*[
+            func.percentile_cont(quantile).within_group(ActivityLog.processing_time_ms)
+            for quantile in PERCENTILES
+        ]).filter(
+            ActivityLog.campaign_id == campaign_id,
+            ActivityLog.status == "sent"
+        ).one()
+        processing_percentiles = {
+            f"p{round(quantile * 100)}": round(value) if value is not None else None
+            for quantile, value in zip(PERCENTILES, values)
+        }
+    
+    # Перцентили этапов обработки по последним триггерам с замерами
+    stage_rows = db.query(ActivityLog.stage_timings).filter(
         ActivityLog.campaign_id == campaign_id,
-        ActivityLog.processing_time_ms.isnot(None)
-    ).all()
-    
-    avg_time = None
-    if avg_processing_time:
-        times = [t[0] for t in avg_processing_time if t[0] is not None]
-        if times:
-            avg_time = sum(times) / len(times)
+        ActivityLog.stage_timings.isnot(None)
+    ).order_by(desc(ActivityLog.id)).limit(STAGE_STATS_SAMPLE).all()
     
     return {
         "campaign_id": campaign_id,
@@ -106,6 +145,8 @@ async def get_campaign_stats(campaign_id: int, db: Session = Depends(get_db)):
         "status_breakdown": status_stats,
         "responses_24h": recent_logs,
         "avg_processing_time_ms": round(avg_time) if avg_time else None,
+        "processing_time_percentiles_ms": processing_percentiles,
+        "stage_timings_ms": stage_percentiles(row[0] for row in stage_rows),
         "success_rate": round((status_stats.get("sent", 0) / max(total_logs, 1)) * 100, 2)
     }
 
@@ -136,27 +177,26 @@ async def clear_campaign_logs(campaign_id: int, db: Session = Depends(get_db)):
 @router.get("/stats/overview")
 async def get_system_overview(db: Session = Depends(get_db)):
     """Общая статистика системы"""
-    # Общее количество кампаний
-    total_campaigns = db.query(Campaign).count()
-    active_campaigns = db.query(Campaign).filter(Campaign.active == True).count()
+    # Общее количество кампаний и активных - одним запросом
+    total_campaigns, active_campaigns = db.query(
+        func.count(Campaign.id),
+        func.count(case((Campaign.active == True, 1)))
+    ).one()
     
-    # Общее количество ответов
-    total_responses = db.query(ActivityLog).count()
+    # Все ответы
+    total_responses = db.query(func.count(ActivityLog.id)).scalar()
     
-    # Ответы за последние 24 часа
+    # Ответы за 24 часа по статусам - только записи из индекса времени
     cutoff_time = datetime.utcnow() - timedelta(hours=24)
-    responses_24h = db.query(ActivityLog).filter(
+    rows = db.query(
+        ActivityLog.status,
+        func.count(ActivityLog.id)
+    ).filter(
         ActivityLog.timestamp >= cutoff_time
-    ).count()
+    ).group_by(ActivityLog.status).all()
     
-    # Статистика по статусам за 24 часа
-    status_stats_24h = {}
-    for status_val in ["sent", "failed", "pending"]:
-        count = db.query(ActivityLog).filter(
-            ActivityLog.timestamp >= cutoff_time,
-            ActivityLog.status == status_val
-        ).count()
-        status_stats_24h[status_val] = count
+    status_stats_24h = _status_counts(rows)
+    responses_24h = sum(row[1] for row in rows)
     
     return {
         "campaigns": {
@@ -172,4 +212,4 @@ async def get_system_overview(db: Session = Depends(get_db)):
         "success_rate_24h": round(
             (status_stats_24h.get("sent", 0) / max(responses_24h, 1)) * 100, 2
         )
-    }
\ No newline at end of file
+    }
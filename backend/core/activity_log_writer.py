@@ -0,0 +1,226 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from database.models.base import SessionLocal
+from database.models.log import ActivityLog
+from backend.core.metrics import log_buffer_size, log_write_latency
+
+
+class ActivityLogWriter:
+    """
+    Фоновая пакетная запись логов активности.
+
+    - write() только кладет строку в буфер и не блокирует event loop;
+    - буфер сбрасывается в БД пакетом (bulk insert в отдельном потоке), когда
+      набралось batch_size записей или прошло flush_interval секунд;
+    - буфер ограничен max_buffer записями: сверх лимита строки сразу уходят
+      в файл на диске;
+    - если БД недоступна, пакет дописывается в файл (JSON Lines) и повторно
+      загружается в БД, когда запись снова проходит;
+    - повтор отправленного ответа на тот же триггер (уникальный ключ chat_id,
+      message_id, campaign_id для source = 'auto' и status = 'sent') не
+      роняет пакет: пакет записывается построчно, повторы отбрасываются с
+      сообщением в логе;
+    - stop() сбрасывает все, что осталось в буфере.
+    """
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_buffer: Optional[int] = None,
+        spill_path: Optional[str] = None
+    ):
+        self.batch_size = batch_size or int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "50"))
+        self.flush_interval = flush_interval or float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "2"))
+        self.max_buffer = max_buffer or int(os.getenv("ACTIVITY_LOG_BUFFER_SIZE", "5000"))
+        self.spill_path = spill_path or os.getenv("ACTIVITY_LOG_SPILL_PATH", "./activity_log_spill.jsonl")
+        self.replay_interval = 30.0
+
+        self._buffer: Deque[Dict] = deque()
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_replay = 0.0
+        self._stats = {
+            "written": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "duplicates": 0,
+        }
+        log_buffer_size.set_function(lambda: len(self._buffer))
+
+    def start(self):
+        """Запуск фоновой задачи сброса буфера"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="activity-log-writer")
+
+    def write(self, **row):
+        """Постановка записи лога в буфер (поля ActivityLog)"""
+        row.setdefault("timestamp", datetime.now(timezone.utc))
+
+        if len(self._buffer) >= self.max_buffer:
+            # Буфер переполнен (БД не успевает) - не растим память, пишем на диск
+            self._spill([row])
+            return
+
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_requested.set()
+        self.start()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка записи логов активности: {e}")
+
+    async def flush(self):
+        """Запись всего буфера в БД пакетами"""
+        async with self._flush_lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    with log_write_latency.time():
+                        duplicates = await asyncio.to_thread(self._insert, batch)
+                    self._stats["written"] += len(batch) - duplicates
+                    self._stats["batches"] += 1
+                except Exception as e:
+                    # БД недоступна - не держим остаток буфера в памяти
+                    rows = batch + list(self._buffer)
+                    self._buffer.clear()
+                    self._stats["failed_batches"] += 1
+                    print(f"⚠️ БД недоступна для логов ({e}), {len(rows)} записей сохранено на диск")
+                    await asyncio.to_thread(self._spill, rows)
+                    return
+
+            # БД отвечает - догружаем ранее сохраненные на диск записи
+            if time.monotonic() - self._last_replay >= self.replay_interval:
+                self._last_replay = time.monotonic()
+                replayed = await asyncio.to_thread(self._replay_spill)
+                self._stats["replayed"] += replayed
+
+    def _insert(self, rows: List[Dict]) -> int:
+        """Запись пакета (возвращает число отброшенных повторов)"""
+        db = SessionLocal()
+        try:
+            db.bulk_insert_mappings(ActivityLog, rows)
+            db.commit()
+            return 0
+        except IntegrityError:
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        # В пакете есть повтор уже записанного триггера - пишем построчно
+        duplicates = 0
+        db = SessionLocal()
+        try:
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        db.bulk_insert_mappings(ActivityLog, [row])
+                except IntegrityError:
+                    duplicates += 1
+                    print(
+                        f"⚠️ Повтор записи лога отброшен: чат {row.get('chat_id')}, "
+                        f"сообщение {row.get('message_id')}, кампания {row.get('campaign_id')}, "
+                        f"статус {row.get('status')}"
+                    )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self._stats["duplicates"] += duplicates
+        return duplicates
+
+    def _spill(self, rows: List[Dict]):
+        """Дозапись строк в файл на диске"""
+        if not rows:
+            return
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n")
+            self._stats["spilled"] += len(rows)
+        except OSError as e:
+            print(f"❌ Потеряно {len(rows)} записей лога: не удалось записать {self.spill_path}: {e}")
+
+    def _replay_spill(self) -> int:
+        """Загрузка сохраненных на диск записей в БД (выполняется в потоке)"""
+        if not os.path.exists(self.spill_path):
+            return 0
+
+        # Забираем файл целиком, чтобы новые сбросы писались в свежий файл
+        replay_path = f"{self.spill_path}.replay"
+        if not os.path.exists(replay_path):
+            os.replace(self.spill_path, replay_path)
+
+        with open(replay_path, encoding="utf-8") as replay_file:
+            rows = [_parse_row(line) for line in replay_file if line.strip()]
+
+        for start in range(0, len(rows), self.batch_size):
+            try:
+                self._insert(rows[start:start + self.batch_size])
+            except Exception as e:
+                print(f"⚠️ Повторная загрузка логов прервана: {e}")
+                self._spill(rows[start:])
+                os.remove(replay_path)
+                return start
+
+        os.remove(replay_path)
+        if rows:
+            print(f"✅ Загружено {len(rows)} сохраненных на диск записей лога")
+        return len(rows)
+
+    async def stop(self):
+        """Остановка с записью оставшегося буфера"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние буфера для статуса агента"""
+        return {
+            "buffered": len(self._buffer),
+            "batch_size": self.batch_size,
+            "max_buffer": self.max_buffer,
+            **self._stats,
+        }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_row(line: str) -> Dict:
+    row = json.loads(line)
+    if row.get("timestamp"):
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
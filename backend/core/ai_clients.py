@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Dict, Hashable, List, Optional
+
+import httpx
+
+from backend.core.metrics import llm_latency
+from backend.core.prompt_cache import prompt_cache_stats
+
+logger = logging.getLogger(__name__)
+
+# Начала текстов, которые клиенты возвращают вместо ответа при ошибке
+ERROR_RESPONSE_PREFIXES = (
+    "Ошибка Claude:",
+    "Ошибка OpenAI:",
+    "Claude недоступен",
+    "OpenAI недоступен",
+)
+
+# Общие пулы HTTP соединений по провайдерам (keep-alive между запросами)
+_http_clients: Dict[str, object] = {}
+
+
+def get_http_client(sdk):
+    """
+    Общий асинхронный HTTP клиент провайдера с настраиваемым пулом соединений.
+
+    Клиент создается через DefaultAsyncHttpxClient самого SDK, чтобы сохранить
+    его настройки по умолчанию (редиректы, заголовки).
+    """
+    client = _http_clients.get(sdk.__name__)
+    if client is None or client.is_closed:
+        client = sdk.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "50")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+            ),
+        )
+        _http_clients[sdk.__name__] = client
+    return client
+
+
+async def close_http_client():
+    """Закрытие общих пулов соединений (при остановке агента)"""
+    clients = list(_http_clients.values())
+    _http_clients.clear()
+    for client in clients:
+        if not client.is_closed:
+            await client.aclose()
+
+
+def get_timeout(sdk):
+    """
+    Таймаут запросов провайдера. Передается клиенту SDK, а не HTTP клиенту:
+    SDK задает таймаут каждому запросу и перекрывает таймаут HTTP клиента.
+    """
+    return sdk.Timeout(float(os.getenv("LLM_TIMEOUT", "120")), connect=10.0)
+
+
+def is_error_response(response: Optional[str]) -> bool:
+    """Текст ошибки клиента вместо сгенерированного ответа"""
+    return not response or response.startswith(ERROR_RESPONSE_PREFIXES)
+
+
+async def _buffered_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Фрагменты потока, прочитанные фоновой задачей.
+
+    Поток читается без ожидания потребителя, поэтому семафор провайдера и
+    замер llm_latency не удерживаются, пока потребитель правит сообщение
+    в Telegram между фрагментами.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def pump():
+        try:
+            async for chunk in chunks:
+                queue.put_nowait(chunk)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(finished)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Потребитель прервал поток - запрос к провайдеру отменяется
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+def _claude_request(prompt: str, system: Optional[str], kwargs: Dict) -> Dict:
+    """Параметры запроса Claude: статичный системный блок помечается для кэширования"""
+    request = {
+        "model": kwargs.get("model") or "claude-3-sonnet-20240229",
+        "max_tokens": kwargs.get("max_tokens", 1000),
+        "messages": [{"role": "user", "content": prompt}],
+    }
+    if system:
+        request["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+    return request
+
+
+def _openai_messages(prompt: str, system: Optional[str]) -> List[Dict]:
+    """Сообщения OpenAI: системный блок первым, чтобы префикс кэшировался автоматически"""
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+class SimpleClaudeClient:
+    """Простой асинхронный Claude клиент"""
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(int(os.getenv("CLAUDE_MAX_CONCURRENCY", "8")))
+        try:
+            import anthropic
+            self.api_key = os.getenv("ANTHROPIC_API_KEY")
+            if self.api_key:
+                # ANTHROPIC_BASE_URL позволяет направить запросы на локальный тестовый сервер
+                self.client = anthropic.AsyncAnthropic(
+                    api_key=self.api_key,
+                    http_client=get_http_client(anthropic),
+                    timeout=get_timeout(anthropic),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+                )
+                logger.info("Claude клиент инициализирован")
+            else:
+                self.client = None
+        except ImportError:
+            self.client = None
+
+    def _record_usage(self, usage, cache_key: Optional[Hashable]):
+        if usage is not None:
+            prompt_cache_stats.record(
+                cache_key,
+                "claude",
+                input_tokens=getattr(usage, "input_tokens", None),
+                cached_tokens=getattr(usage, "cache_read_input_tokens", None),
+                cache_write_tokens=getattr(usage, "cache_creation_input_tokens", None),
+            )
+
+    async def generate_response(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        cache_key: Optional[Hashable] = None,
+        **kwargs
+    ) -> str:
+        if not self.client:
+            return "Claude недоступен - проверьте ANTHROPIC_API_KEY и установку anthropic"
+        try:
+            request = _claude_request(prompt, system, kwargs)
+            async with self.semaphore:
+                with llm_latency.time(provider="claude", model=request["model"]):
+                    response = await self.client.messages.create(**request)
+            self._record_usage(response.usage, cache_key)
+            return response.content[0].text
+        except Exception as e:
+            return f"Ошибка Claude: {e}"
+
+    async def stream_response(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        cache_key: Optional[Hashable] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Потоковая генерация: фрагменты текста по мере поступления"""
+        if not self.client:
+            raise RuntimeError("Claude недоступен - проверьте ANTHROPIC_API_KEY и установку anthropic")
+        request = _claude_request(prompt, system, kwargs)
+
+        async def chunks():
+            async with self.semaphore:
+                with llm_latency.time(provider="claude", model=request["model"]):
+                    async with self.client.messages.stream(**request) as stream:
+                        async for text in stream.text_stream:
+                            yield text
+                        final_message = await stream.get_final_message()
+            self._record_usage(final_message.usage, cache_key)
+
+        async for text in _buffered_stream(chunks()):
+            yield text
+
+
+class SimpleOpenAIClient:
+    """Простой асинхронный OpenAI клиент"""
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")))
+        try:
+            import openai
+            self.api_key = os.getenv("OPENAI_API_KEY")
+            if self.api_key:
+                # OPENAI_BASE_URL позволяет направить запросы на локальный тестовый сервер
+                self.client = openai.AsyncOpenAI(
+                    api_key=self.api_key,
+                    http_client=get_http_client(openai),
+                    timeout=get_timeout(openai),
+                    max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+                )
+                logger.info("OpenAI клиент инициализирован")
+            else:
+                self.client = None
+        except ImportError:
+            self.client = None
+
+    def test_connection(self) -> bool:
+        """Проверка готовности клиента (без запроса к API)"""
+        return self.client is not None
+
+    def _record_usage(self, usage, cache_key: Optional[Hashable]):
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            prompt_cache_stats.record(
+                cache_key,
+                "openai",
+                input_tokens=getattr(usage, "prompt_tokens", None),
+                cached_tokens=getattr(details, "cached_tokens", None),
+            )
+
+    async def generate_response(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        cache_key: Optional[Hashable] = None,
+        **kwargs
+    ) -> str:
+        if not self.client:
+            return "OpenAI недоступен - проверьте OPENAI_API_KEY и установку openai"
+        try:
+            model = kwargs.get("model") or "gpt-4"
+            async with self.semaphore:
+                with llm_latency.time(provider="openai", model=model):
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        max_tokens=kwargs.get("max_tokens", 1000),
+                        messages=_openai_messages(prompt, system)
+                    )
+            self._record_usage(response.usage, cache_key)
+            return response.choices[0].message.content
+        except Exception as e:
+            return f"Ошибка OpenAI: {e}"
+
+    async def stream_response(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        cache_key: Optional[Hashable] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Потоковая генерация: фрагменты текста по мере поступления"""
+        if not self.client:
+            raise RuntimeError("OpenAI недоступен - проверьте OPENAI_API_KEY и установку openai")
+        model = kwargs.get("model") or "gpt-4"
+
+        async def chunks():
+            async with self.semaphore:
+                with llm_latency.time(provider="openai", model=model):
+                    stream = await self.client.chat.completions.create(
+                        model=model,
+                        max_tokens=kwargs.get("max_tokens", 1000),
+                        messages=_openai_messages(prompt, system),
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            yield chunk.choices[0].delta.content
+                        if getattr(chunk, "usage", None) is not None:
+                            self._record_usage(chunk.usage, cache_key)
+
+        async for text in _buffered_stream(chunks()):
+            yield text
@@ -0,0 +1,25 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models.campaign import Campaign
+from backend.core.campaign_snapshot import CampaignSnapshot
+
+
+def get_campaigns_version(db: Session) -> Tuple[int, Optional[str]]:
+    """
+    Версия набора кампаний в БД: количество строк и максимальный updated_at.
+
+    Любое создание, изменение, переключение или удаление кампании меняет
+    хотя бы одну из величин, поэтому агент перестраивает индексы только
+    при реальных изменениях.
+    """
+    count, last_updated = db.query(func.count(Campaign.id), func.max(Campaign.updated_at)).one()
+    return count or 0, str(last_updated) if last_updated else None
+
+
+def load_active_campaigns(db: Session) -> List[CampaignSnapshot]:
+    """Загрузка активных кампаний в виде неизменяемых снимков (пока сессия открыта)"""
+    campaigns = db.query(Campaign).filter(Campaign.active == True).all()
+    return [CampaignSnapshot.from_campaign(campaign) for campaign in campaigns]
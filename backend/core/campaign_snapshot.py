@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
+
+from backend.core.chat_index import split_chats
+from backend.core.keyword_matcher import normalize_keywords
+
+
+def format_example_replies(example_replies) -> str:
+    """Текстовое представление примеров ответов для промпта"""
+    return str(example_replies) if example_replies else 'Нет примеров'
+
+
+@dataclass(frozen=True, slots=True)
+class CampaignSnapshot:
+    """
+    Неизменяемый снимок активной кампании для горячего пути.
+
+    Строится один раз при обновлении кэша кампаний, пока открыта сессия БД,
+    поэтому сопоставление сообщений и сборка промптов не обращаются к ORM
+    (нет инструментированных атрибутов и ленивых загрузок).
+    """
+    id: int
+    name: str
+    telegram_chats: Tuple[str, ...]
+    keywords: Tuple[str, ...]
+    telegram_account: str
+    ai_provider: str
+    claude_agent_id: Optional[str]
+    openai_model: str
+    context_messages_count: int
+    system_instruction: str
+    example_replies: Mapping
+    settings: Mapping
+    # Статичный системный блок промпта (кэшируется на стороне провайдера)
+    system_prompt: str
+
+    @classmethod
+    def from_campaign(cls, campaign) -> "CampaignSnapshot":
+        """Создание снимка из ORM-объекта Campaign"""
+        system_instruction = campaign.system_instruction or ""
+        example_replies = dict(campaign.example_replies or {})
+        return cls(
+            id=campaign.id,
+            name=campaign.name,
+            telegram_chats=tuple(split_chats(campaign.telegram_chats)),
+            keywords=tuple(normalize_keywords(campaign.keywords)),
+            telegram_account=campaign.telegram_account,
+            ai_provider=campaign.ai_provider or "claude",
+            claude_agent_id=campaign.claude_agent_id,
+            openai_model=campaign.openai_model or "gpt-4",
+            context_messages_count=campaign.context_messages_count or 0,
+            system_instruction=system_instruction,
+            example_replies=MappingProxyType(example_replies),
+            settings=MappingProxyType(dict(getattr(campaign, "settings", None) or {})),
+            system_prompt=(
+                f"Системная инструкция: {system_instruction}\n\n"
+                f"Примеры ответов: {format_example_replies(example_replies)}\n\n"
+                "Сгенерируй подходящий ответ на основе контекста и системной инструкции."
+            ),
+        )
+
+    def build_user_prompt(self, context_text: str, trigger_text: Optional[str]) -> str:
+        """Переменный блок промпта: контекст и сообщение-триггер"""
+        return f"Контекст предыдущих сообщений:\n{context_text}\n\nСообщение-триггер: {trigger_text}"
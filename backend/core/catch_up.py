@@ -0,0 +1,201 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from telethon import TelegramClient, events
+from telethon.tl.types import Message
+
+from database.models.base import SessionLocal
+from database.models.chat_cursor import ChatCursor
+
+
+class ReconnectAwareClient(TelegramClient):
+    """
+    TelegramClient с уведомлением об автоматическом переподключении.
+
+    Telethon после переподключения не запрашивает пропущенные обновления -
+    подписчики on_reconnect догружают их сами. Подписчики вызываются до
+    запроса, возобновляющего поток обновлений, чтобы успеть запомнить
+    позиции чатов на момент разрыва.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._reconnect_callbacks: List[Callable[[], None]] = []
+        super().__init__(*args, **kwargs)
+
+    def on_reconnect(self, callback: Callable[[], None]):
+        """Регистрация функции, вызываемой при каждом переподключении"""
+        if callback not in self._reconnect_callbacks:
+            self._reconnect_callbacks.append(callback)
+
+    async def _handle_auto_reconnect(self):
+        for callback in self._reconnect_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Ошибка обработчика переподключения: {e}")
+        await super()._handle_auto_reconnect()
+
+
+def message_event(client, message: Message) -> events.NewMessage.Event:
+    """Событие NewMessage для сообщения из истории (для обычного обработчика)"""
+    event = events.NewMessage.Event(message)
+    event._set_client(client)
+    return event
+
+
+class ChatCursors:
+    """
+    Позиции обработки отслеживаемых чатов: ID последнего обработанного
+    сообщения на чат.
+
+    advance() только обновляет словарь в памяти; измененные позиции
+    сохраняются в БД (chat_cursors) фоновой задачей раз в flush_interval
+    секунд и при остановке, поэтому позиции переживают перезапуск агента.
+    """
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        self.flush_interval = flush_interval or float(os.getenv("CHAT_CURSOR_FLUSH_INTERVAL", "5"))
+        self._cursors: Dict[int, int] = {}
+        self._dirty: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """Загрузка сохраненных позиций из БД"""
+        cursors = await asyncio.to_thread(self._load)
+        for chat_id, message_id in cursors.items():
+            if message_id > self._cursors.get(chat_id, 0):
+                self._cursors[chat_id] = message_id
+
+    @staticmethod
+    def _load() -> Dict[int, int]:
+        db = SessionLocal()
+        try:
+            return {cursor.chat_id: cursor.last_message_id for cursor in db.query(ChatCursor).all()}
+        finally:
+            db.close()
+
+    def start(self):
+        """Запуск фонового сохранения позиций"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="chat-cursors")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ Не удалось сохранить позиции чатов: {e}")
+
+    def advance(self, chat_id: int, message_id: int):
+        """Сдвиг позиции чата (только вперед)"""
+        if message_id > self._cursors.get(chat_id, 0):
+            self._cursors[chat_id] = message_id
+            self._dirty[chat_id] = message_id
+
+    def get(self, chat_id: int) -> Optional[int]:
+        return self._cursors.get(chat_id)
+
+    def snapshot(self) -> Dict[int, int]:
+        """Копия позиций (граница догрузки на момент разрыва соединения)"""
+        return dict(self._cursors)
+
+    async def flush(self):
+        """Сохранение измененных позиций в БД"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self._save, dirty)
+        except Exception:
+            # Позиции сохранятся при следующем сбросе (если не сдвинулись дальше)
+            for chat_id, message_id in dirty.items():
+                self._dirty.setdefault(chat_id, message_id)
+            raise
+
+    @staticmethod
+    def _save(cursors: Dict[int, int]):
+        db = SessionLocal()
+        try:
+            for chat_id, message_id in cursors.items():
+                cursor = db.get(ChatCursor, chat_id)
+                if cursor is None:
+                    db.add(ChatCursor(chat_id=chat_id, last_message_id=message_id))
+                elif message_id > cursor.last_message_id:
+                    cursor.last_message_id = message_id
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def stop(self):
+        """Остановка с сохранением позиций"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "chats": len(self._cursors),
+            "unsaved": len(self._dirty),
+        }
+
+
+async def catch_up(
+    positions: Dict[int, int],
+    client_for: Callable[[int], object],
+    handler: Callable[[object], Awaitable],
+    concurrency: Optional[int] = None,
+    limit: Optional[int] = None,
+    max_age: Optional[float] = None
+) -> int:
+    """
+    Догрузка сообщений, пропущенных чатами за время отключения.
+
+    Для каждого чата из positions (позиции на момент разрыва) запрашиваются
+    только сообщения новее нее (iter_messages(min_id=...)): не больше limit
+    последних и не
+    старше max_age секунд. Чаты догружаются параллельно (не больше
+    concurrency одновременно), сообщения чата передаются обработчику событием
+    NewMessage по порядку; уже обработанные сообщения отсекает сам обработчик.
+    Возвращает число догруженных сообщений.
+    """
+    concurrency = concurrency or int(os.getenv("CATCH_UP_CONCURRENCY", "5"))
+    limit = limit or int(os.getenv("CATCH_UP_LIMIT", "100"))
+    max_age = max_age or float(os.getenv("CATCH_UP_MAX_AGE", "600"))
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def catch_up_chat(chat_id: int, min_id: int) -> int:
+        async with slots:
+            client = client_for(chat_id)
+            missed = []
+            try:
+                async for message in client.iter_messages(chat_id, min_id=min_id, limit=limit):
+                    if message.date < cutoff:
+                        break
+                    # Собственные сообщения не приходят событиями - пропускаем и здесь
+                    if not message.out:
+                        missed.append(message)
+            except Exception as e:
+                print(f"⚠️ Не удалось догрузить сообщения чата {chat_id}: {e}")
+                return 0
+
+        # Сообщения приходят от новых к старым - обрабатываем в хронологическом порядке
+        for message in reversed(missed):
+            try:
+                await handler(message_event(client, message))
+            except Exception as e:
+                print(f"❌ Ошибка обработки догруженного сообщения {chat_id}/{message.id}: {e}")
+        return len(missed)
+
+    results = await asyncio.gather(*(catch_up_chat(chat_id, min_id) for chat_id, min_id in positions.items()))
+    return sum(results)
@@ -0,0 +1,112 @@
+from typing import AbstractSet, Dict, FrozenSet, Iterable, List, Optional, Set, Union
+
+from telethon.utils import resolve_id
+
+EMPTY: FrozenSet[int] = frozenset()
+
+
+def split_chats(telegram_chats: Union[List, str, None]) -> List[str]:
+    """Список чатов кампании (JSON список или старый формат через запятую)"""
+    if not telegram_chats:
+        return []
+    if isinstance(telegram_chats, str):
+        telegram_chats = telegram_chats.split(',')
+    return [str(chat).strip() for chat in telegram_chats if str(chat).strip()]
+
+
+def normalize_chat_id(chat_id) -> Optional[int]:
+    """
+    Приведение ID чата к «голому» виду Telegram.
+
+    Поддерживает как немаркированные ID (1234567890), так и маркированные
+    ID каналов/групп (-1001234567890, -123456789).
+    """
+    if chat_id is None or isinstance(chat_id, bool):
+        return None
+    if isinstance(chat_id, int):
+        value = chat_id
+    else:
+        text = str(chat_id).strip()
+        if not text.lstrip('-').isdigit():
+            return None
+        value = int(text)
+    # -100XXXXXXXXXX / -XXXXXXXXX - маркированные ID каналов и групп
+    return resolve_id(value)[0]
+
+
+def normalize_username(username) -> Optional[str]:
+    """Нормализация username чата: без @, ссылки t.me и регистра"""
+    if not username:
+        return None
+    text = str(username).strip().lower()
+    for prefix in ("https://", "http://"):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    for prefix in ("t.me/", "telegram.me/"):
+        if text.startswith(prefix):
+            text = text[len(prefix):]
+    text = text.lstrip('@').strip('/')
+    if not text or text.lstrip('-').isdigit():
+        return None
+    return text
+
+
+class ChatIndex:
+    """
+    Инвертированный индекс «чат → кампании».
+
+    Строится при обновлении кэша кампаний: ключи - числовые ID чатов и
+    нормализованные username, значения - множества ID кампаний. Сообщения из
+    неотслеживаемых чатов отклоняются одним поиском в словаре.
+    """
+
+    def __init__(self, campaigns: Iterable = (), discussion_groups: Optional[Dict[str, int]] = None):
+        self._by_id: Dict[int, Set[int]] = {}
+        self._by_username: Dict[str, Set[int]] = {}
+
+        for campaign in campaigns:
+            for chat in split_chats(campaign.telegram_chats):
+                self.add(chat, campaign.id)
+
+        # Группы обсуждений каналов отслеживаются теми же кампаниями, что и каналы
+        for channel, group_id in (discussion_groups or {}).items():
+            self.add_alias(group_id, self.lookup(chat_id=channel, username=channel))
+
+    def add(self, chat, campaign_id: int):
+        """Добавление чата (ID или username) для кампании"""
+        chat_id = normalize_chat_id(chat)
+        if chat_id is not None:
+            self._by_id.setdefault(chat_id, set()).add(campaign_id)
+            return
+        username = normalize_username(chat)
+        if username:
+            self._by_username.setdefault(username, set()).add(campaign_id)
+
+    def add_alias(self, chat_id, campaign_ids: Iterable[int]):
+        """Привязка дополнительного ID чата (например, группы обсуждений) к кампаниям"""
+        chat_id = normalize_chat_id(chat_id)
+        campaign_ids = set(campaign_ids)
+        if chat_id is None or not campaign_ids:
+            return
+        self._by_id.setdefault(chat_id, set()).update(campaign_ids)
+
+    def lookup(self, chat_id=None, username=None) -> AbstractSet[int]:
+        """ID кампаний, отслеживающих чат (по ID и/или username); результат только для чтения"""
+        by_id = self._by_id.get(normalize_chat_id(chat_id)) if chat_id is not None else None
+        by_username = self._by_username.get(normalize_username(username)) if username else None
+        if by_id and by_username:
+            return by_id | by_username
+        return by_id or by_username or EMPTY
+
+    @property
+    def chat_ids(self) -> FrozenSet[int]:
+        """Все отслеживаемые числовые ID чатов"""
+        return frozenset(self._by_id)
+
+    @property
+    def usernames(self) -> FrozenSet[str]:
+        """Все отслеживаемые username чатов"""
+        return frozenset(self._by_username)
+
+    def __len__(self) -> int:
+        return len(self._by_id) + len(self._by_username)
@@ -0,0 +1,255 @@
+import os
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+from telethon import TelegramClient
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+from database.models.company import CompanySettings
+from backend.core.chat_index import ChatIndex
+from backend.core.entity_cache import entity_cache
+from backend.core.send_scheduler import SendScheduler
+
+
+def normalize_account(value) -> Optional[str]:
+    """Ключ аккаунта: название или телефон без регистра, пробелов и «+»"""
+    if value is None:
+        return None
+    text = str(value).strip().lower().replace(" ", "").lstrip("+")
+    return text or None
+
+
+def load_company_accounts(db: Session) -> List[Dict]:
+    """Telegram аккаунты из настроек компании"""
+    settings = db.query(CompanySettings).first()
+    return list(settings.telegram_accounts or []) if settings else []
+
+
+class AccountClient:
+    """Клиент одного Telegram аккаунта с собственной очередью отправки"""
+
+    def __init__(self, name: str, client, phone: Optional[str] = None):
+        self.name = name
+        self.client = client
+        self.phone = phone
+        self.send_scheduler = SendScheduler(phone or name)
+        self.started = False
+        # Маркированные ID чатов, в которых состоит аккаунт (из списка диалогов)
+        self.chat_ids: Set[int] = set()
+        self.owned_chats = 0
+
+
+class ClientPool:
+    """
+    Пул Telegram клиентов: по одному на аккаунт.
+
+    - первый аккаунт (из TELEGRAM_*) основной: через него идут запросы API
+      и ответы кампаний с неизвестным аккаунтом;
+    - ответы кампании отправляются через аккаунт из campaign.telegram_account
+      (по названию или телефону) с его собственной очередью отправки, поэтому
+      лимиты FloodWait одного аккаунта не задерживают остальные;
+    - каждый чат обрабатывает один аккаунт-владелец: чаты распределяются
+      между аккаунтами, которые в них состоят, поровну; события остальных
+      аккаунтов по этому чату отбрасываются.
+
+    client_factory позволяет подменить TelegramClient (например, локальным
+    фейковым клиентом), session_prefix - разделить сессии процессов.
+    """
+
+    def __init__(self, client_factory: Callable = TelegramClient, session_prefix: str = "telegram_agent"):
+        self.client_factory = client_factory
+        self.session_prefix = session_prefix
+        self.accounts: Dict[str, AccountClient] = {}
+        self._aliases: Dict[str, str] = {}
+        self._chat_owners: Dict[int, str] = {}
+
+    def add_account(
+        self,
+        name: str,
+        api_id: int,
+        api_hash: str,
+        phone: Optional[str] = None,
+        session: Optional[str] = None,
+        aliases: Iterable[str] = ()
+    ) -> AccountClient:
+        """Регистрация аккаунта (клиент подключается в start)"""
+        session = session or f"{self.session_prefix}_{normalize_account(phone or name)}"
+        client = self.client_factory(session, api_id, api_hash)
+        account = self.accounts[name] = AccountClient(name, client, phone)
+        for alias in (name, phone, *aliases):
+            key = normalize_account(alias)
+            if key:
+                self._aliases.setdefault(key, name)
+        return account
+
+    def add_company_accounts(self, company_accounts: List[Dict]):
+        """
+        Дополнительные аккаунты из настроек компании (активные и с api_id/api_hash).
+
+        Запись с телефоном уже добавленного аккаунта становится его алиасом.
+        """
+        for config in company_accounts:
+            name = config.get("name")
+            phone = config.get("phone")
+            existing = self._aliases.get(normalize_account(phone)) or self._aliases.get(normalize_account(name))
+            if existing:
+                key = normalize_account(name)
+                if key:
+                    self._aliases.setdefault(key, existing)
+                continue
+            if not config.get("is_active") or not config.get("api_id") or not config.get("api_hash"):
+                continue
+            self.add_account(name or phone, int(config["api_id"]), config["api_hash"], phone=phone)
+
+    @property
+    def primary(self) -> AccountClient:
+        return next(iter(self.accounts.values()))
+
+    @property
+    def started_accounts(self) -> List[AccountClient]:
+        return [account for account in self.accounts.values() if account.started]
+
+    async def start(self, handlers: List[Tuple[Callable, object]]) -> int:
+        """
+        Подключение аккаунтов и регистрация обработчиков событий.
+
+        Основной аккаунт авторизуется как раньше (client.start), остальные
+        подключаются только с готовой сессией - неавторизованные пропускаются.
+        """
+        for account in self.accounts.values():
+            if account is self.primary:
+                await account.client.start(phone=account.phone)
+            else:
+                try:
+                    await account.client.connect()
+                    if not await account.client.is_user_authorized():
+                        print(f"⚠️ Аккаунт {account.name} не авторизован - пропущен")
+                        await account.client.disconnect()
+                        continue
+                except Exception as e:
+                    print(f"⚠️ Аккаунт {account.name} недоступен: {e}")
+                    continue
+            account.started = True
+            for callback, event in handlers:
+                account.client.add_event_handler(callback, event)
+            print(f"✅ Подключен к Telegram как {account.phone or account.name}")
+        return len(self.started_accounts)
+
+    async def stop(self):
+        for account in self.accounts.values():
+            if account.client.is_connected():
+                await account.client.disconnect()
+            account.started = False
+
+    def is_connected(self) -> bool:
+        return bool(self.accounts) and self.primary.client.is_connected()
+
+    def account_for_campaign(self, campaign) -> AccountClient:
+        """Аккаунт для ответов кампании (основной, если аккаунт не найден или не подключен)"""
+        name = self._aliases.get(normalize_account(getattr(campaign, "telegram_account", None)))
+        account = self.accounts.get(name) if name else None
+        return account if account is not None and account.started else self.primary
+
+    def account_for_client(self, client) -> AccountClient:
+        for account in self.accounts.values():
+            if account.client is client:
+                return account
+        return self.primary
+
+    def account_for_message(self, message) -> AccountClient:
+        """Аккаунт, получивший (или отправивший) сообщение"""
+        return self.account_for_client(getattr(message, "client", None))
+
+    def client_for_chat(self, chat_id: Hashable):
+        """Клиент аккаунта-владельца чата (основной, если чат не распределен)"""
+        account = self.accounts.get(self._chat_owners.get(chat_id))
+        return account.client if account is not None and account.started else self.primary.client
+
+    def can_reply(self, account: AccountClient, message) -> bool:
+        """
+        Можно ли ответить на сообщение reply_to из этого аккаунта.
+
+        ID сообщений общие только в каналах и супергруппах, в личных чатах и
+        обычных группах они свои у каждого аккаунта.
+        """
+        return getattr(message, "client", None) is account.client or isinstance(message.peer_id, PeerChannel)
+
+    async def assign_chats(self, chat_index: Optional[ChatIndex] = None, dialogs_limit: Optional[int] = None) -> int:
+        """
+        Распределение отслеживаемых чатов между аккаунтами по спискам диалогов.
+
+        Учитываются только диалоги из chat_index (чаты активных кампаний; без
+        индекса - все диалоги). Чат достается аккаунту с наименьшим числом
+        чатов среди тех, что в нем состоят. Сущности основного аккаунта
+        попадают в общий кэш сущностей.
+        """
+        for account in self.started_accounts:
+            account.chat_ids = set()
+            async for dialog in account.client.iter_dialogs(limit=dialogs_limit):
+                chat_id = get_peer_id(dialog.entity)
+                if chat_index is not None and not chat_index.lookup(chat_id, getattr(dialog.entity, "username", None)):
+                    continue
+                if account is self.primary:
+                    entity_cache.put(dialog.entity)
+                account.chat_ids.add(chat_id)
+
+        owners: Dict[int, str] = {}
+        owned: Dict[str, int] = {account.name: 0 for account in self.started_accounts}
+        for chat_id in sorted(set().union(*(account.chat_ids for account in self.started_accounts))):
+            members = [account.name for account in self.started_accounts if chat_id in account.chat_ids]
+            owner = min(members, key=lambda name: owned[name])
+            owners[chat_id] = owner
+            owned[owner] += 1
+
+        self._chat_owners = owners
+        for account in self.accounts.values():
+            account.owned_chats = owned.get(account.name, 0)
+        return len(owners)
+
+    def owns_chat(self, client, chat_id: Hashable) -> bool:
+        """
+        Обрабатывает ли аккаунт клиента события чата.
+
+        Чат, которого не было в диалогах при распределении, закрепляется за
+        первым аккаунтом, получившим из него событие.
+        """
+        if len(self.accounts) == 1:
+            return True
+        account = self.account_for_client(client)
+        owner = self._chat_owners.get(chat_id)
+        if owner is None:
+            self._chat_owners[chat_id] = account.name
+            account.owned_chats += 1
+            return True
+        return owner == account.name
+
+    def stats(self) -> Dict:
+        """Подключенные аккаунты, распределение чатов и очереди отправки"""
+        return {
+            account.name: {
+                "connected": account.started and account.client.is_connected(),
+                "owned_chats": account.owned_chats,
+                "send_scheduler": account.send_scheduler.stats(),
+            }
+            for account in self.accounts.values()
+        }
+
+
+def create_client_pool(client_factory: Callable = TelegramClient) -> ClientPool:
+    """
+    Пул с основным аккаунтом из TELEGRAM_* (аккаунты компании добавляются при запуске).
+
+    TELEGRAM_SESSION_NAME - имя файловой сессии; TELEGRAM_SESSION занята строкой
+    StringSession агента App Platform.
+    """
+    session = os.getenv("TELEGRAM_SESSION_NAME", "telegram_agent")
+    pool = ClientPool(client_factory, session_prefix=session)
+    pool.add_account(
+        os.getenv("TELEGRAM_ACCOUNT_NAME") or os.getenv("TELEGRAM_PHONE") or "default",
+        int(os.getenv("TELEGRAM_API_ID")),
+        os.getenv("TELEGRAM_API_HASH"),
+        phone=os.getenv("TELEGRAM_PHONE"),
+        session=session
+    )
+    return pool
@@ -0,0 +1,86 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+FlushHandler = Callable[[Hashable, List[Any]], Awaitable[Any]]
+
+
+def coalesce_window(campaign) -> float:
+    """Окно объединения триггеров кампании (settings.coalesce_window или COALESCE_WINDOW)"""
+    window = (getattr(campaign, "settings", None) or {}).get("coalesce_window")
+    if window is None:
+        window = os.getenv("COALESCE_WINDOW", "0")
+    try:
+        return max(0.0, float(window))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TriggerCoalescer:
+    """
+    Объединение всплесков триггеров одного чата и кампании.
+
+    Первый триггер открывает окно на window секунд; все триггеры с тем же
+    ключом, пришедшие за это время, передаются обработчику одним списком
+    (последний - тот, на который нужно ответить). При window <= 0 триггер
+    передается обработчику сразу.
+    """
+
+    def __init__(self, name: str = "trigger-coalescer"):
+        self.name = name
+        self._pending: Dict[Hashable, List[Any]] = {}
+        self._timers: Dict[Hashable, asyncio.Task] = {}
+        self._handlers: Dict[Hashable, FlushHandler] = {}
+        self._stats = {
+            "batches": 0,
+            "merged": 0,
+        }
+
+    async def add(self, key: Hashable, window: float, item: Any, flush: FlushHandler):
+        """Добавление триггера в окно ключа (или немедленная передача обработчику)"""
+        if window <= 0:
+            await flush(key, [item])
+            return
+
+        items = self._pending.get(key)
+        if items is not None:
+            items.append(item)
+            self._stats["merged"] += 1
+            return
+
+        self._pending[key] = [item]
+        self._handlers[key] = flush
+        self._timers[key] = asyncio.create_task(self._flush_later(key, window), name=f"{self.name}-{key}")
+
+    async def _flush_later(self, key: Hashable, window: float):
+        await asyncio.sleep(window)
+        self._timers.pop(key, None)
+        await self._flush(key)
+
+    async def _flush(self, key: Hashable):
+        items = self._pending.pop(key, None)
+        flush = self._handlers.pop(key, None)
+        if not items or flush is None:
+            return
+        self._stats["batches"] += 1
+        try:
+            await flush(key, items)
+        except Exception as e:
+            print(f"❌ {self.name}: ошибка обработки объединенных триггеров {key}: {e}")
+
+    async def stop(self):
+        """Немедленная передача всех открытых окон обработчику"""
+        timers = list(self._timers.values())
+        self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+        await asyncio.gather(*timers, return_exceptions=True)
+        for key in list(self._pending):
+            await self._flush(key)
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        """Открытые окна и число объединенных триггеров"""
+        return {
+            "open_windows": len(self._pending),
+            **self._stats,
+        }
@@ -0,0 +1,132 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from telethon.utils import get_peer_id
+
+from backend.core.chat_index import normalize_username
+
+
+def peer_key(peer) -> Optional[Hashable]:
+    """
+    Ключ кэша для чата: маркированный ID или «@username».
+
+    Принимает ID (числом или строкой), username, Peer и сами сущности Telegram.
+    """
+    if peer is None or isinstance(peer, bool):
+        return None
+    if isinstance(peer, int):
+        return peer
+    if isinstance(peer, str):
+        text = peer.strip()
+        if text.lstrip('-').isdigit():
+            return int(text)
+        username = normalize_username(text)
+        return f"@{username}" if username else None
+    try:
+        return get_peer_id(peer)
+    except TypeError:
+        return None
+
+
+def entity_title(entity, default: str = "Unknown") -> str:
+    """Отображаемое название чата для логов"""
+    if entity is None:
+        return default
+    if getattr(entity, 'title', None):
+        return entity.title
+    if getattr(entity, 'username', None):
+        return f"@{entity.username}"
+    if getattr(entity, 'first_name', None):
+        return entity.first_name
+    return default
+
+
+class EntityCache:
+    """
+    Общий LRU+TTL кэш сущностей Telegram (чаты, каналы, пользователи).
+
+    Заполняется из событий (event.get_chat()) и списка диалогов, поэтому
+    названия чатов для логов и API не требуют отдельного запроса get_entity.
+    Сущности содержат access_hash конкретного аккаунта, поэтому при пуле
+    аккаунтов кэш хранит только сущности основного аккаунта.
+    """
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_size = max_size or int(os.getenv("ENTITY_CACHE_SIZE", "5000"))
+        self.ttl = ttl or float(os.getenv("ENTITY_CACHE_TTL", "3600"))
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, entity):
+        """Сохранение сущности под ее ID и username"""
+        key = peer_key(entity)
+        if key is None:
+            return
+        expires_at = time.monotonic() + self.ttl
+        keys = [key]
+        username = normalize_username(getattr(entity, 'username', None))
+        if username:
+            keys.append(f"@{username}")
+        for cache_key in keys:
+            self._entries[cache_key] = (expires_at, entity)
+            self._entries.move_to_end(cache_key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, peer) -> Optional[Any]:
+        """Сущность из кэша (или None), без обращения к Telegram"""
+        key = peer_key(peer)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, entity = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entity
+
+    async def get_entity(self, client, peer, store: bool = True):
+        """
+        Сущность из кэша, при промахе - через client.get_entity.
+
+        store=False - полученная сущность не сохраняется: access_hash у каждого
+        аккаунта свой, в кэш попадают только сущности основного аккаунта.
+        """
+        entity = self.get(peer)
+        if entity is None:
+            key = peer_key(peer)
+            # Числовые ID из API приходят строкой - Telethon ждет число
+            entity = await client.get_entity(key if isinstance(key, int) else peer)
+            if store:
+                self.put(entity)
+        return entity
+
+    async def populate_from_dialogs(self, client, limit: Optional[int] = None) -> int:
+        """Заполнение кэша из списка диалогов аккаунта"""
+        count = 0
+        async for dialog in client.iter_dialogs(limit=limit):
+            self.put(dialog.entity)
+            count += 1
+        return count
+
+    def stats(self) -> Dict:
+        """Размер и доля попаданий кэша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+# Глобальный экземпляр: общий для агентов и API
+entity_cache = EntityCache()
@@ -0,0 +1,56 @@
+import logging
+import os
+from typing import Dict
+
+
+class LogFields:
+    """Поля структурированной записи; форматируются, только если запись выводится"""
+
+    __slots__ = ("fields",)
+
+    max_value_length = 80
+
+    def __init__(self, fields: Dict):
+        self.fields = fields
+
+    def __str__(self) -> str:
+        parts = []
+        for key, value in self.fields.items():
+            if isinstance(value, str):
+                if len(value) > self.max_value_length:
+                    value = value[:self.max_value_length] + "…"
+                parts.append(f"{key}={value!r}")
+            else:
+                parts.append(f"{key}={value}")
+        return " ".join(parts)
+
+
+class HotPathLogger:
+    """
+    Логирование на горячем пути обработки сообщений.
+
+    Уровень проверяется до сборки записи, поля форматируются лениво, а
+    sampled() пропускает в лог только каждую N-ю запись события, поэтому при
+    выключенном debug вызов стоит одну проверку уровня.
+    """
+
+    def __init__(self, name: str, sample_rate: float = None):
+        self.logger = logging.getLogger(name)
+        if sample_rate is None:
+            sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+        self.sample_every = max(1, round(1 / sample_rate)) if sample_rate > 0 else 0
+        self._counters: Dict[str, int] = {}
+
+    def debug(self, event: str, **fields):
+        """Debug запись события со структурированными полями"""
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%s %s", event, LogFields(fields))
+
+    def sampled(self, event: str, **fields):
+        """Debug запись для каждого N-го вызова события (N = 1 / LOG_SAMPLE_RATE)"""
+        if not self.sample_every or not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        count = self._counters.get(event, 0) + 1
+        self._counters[event] = count
+        if count % self.sample_every == 0:
+            self.logger.debug("%s %s", event, LogFields({**fields, "sampled": f"1/{self.sample_every}"}))
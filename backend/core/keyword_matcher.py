@@ -0,0 +1,103 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+
+def normalize_keywords(keywords: Union[List[str], str, None]) -> List[str]:
+    """Нормализация ключевых слов кампании (список JSON или старый формат через запятую)"""
+    if not keywords:
+        return []
+    if isinstance(keywords, str):
+        keywords = keywords.split(',')
+    normalized = []
+    for keyword in keywords:
+        keyword = str(keyword).strip().lower()
+        if keyword and keyword not in normalized:
+            normalized.append(keyword)
+    return normalized
+
+
+class KeywordMatcher:
+    """
+    Автомат Ахо-Корасик по ключевым словам всех активных кампаний.
+
+    Строится один раз при обновлении кэша кампаний и за один проход по тексту
+    сообщения возвращает все сработавшие кампании и первое найденное ключевое слово.
+    """
+
+    def __init__(self, campaigns: Iterable = ()):
+        # Переходы, суффиксные ссылки и выходы для каждого состояния автомата
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[Tuple[int, str], ...]] = [()]
+        self.keywords_count = 0
+
+        pending_output: List[List[Tuple[int, str]]] = [[]]
+        for campaign in campaigns:
+            for keyword in normalize_keywords(campaign.keywords):
+                state = 0
+                for char in keyword:
+                    next_state = self._goto[state].get(char)
+                    if next_state is None:
+                        next_state = len(self._goto)
+                        self._goto[state][char] = next_state
+                        self._goto.append({})
+                        self._fail.append(0)
+                        pending_output.append([])
+                    state = next_state
+                pending_output[state].append((campaign.id, keyword))
+                self.keywords_count += 1
+
+        self._build_failure_links(pending_output)
+
+    def _build_failure_links(self, pending_output: List[List[Tuple[int, str]]]):
+        """Построение суффиксных ссылок обходом в ширину"""
+        queue = deque()
+        for next_state in self._goto[0].values():
+            queue.append(next_state)
+
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # Выходы суффиксной ссылки уже собраны (BFS идет по уровням)
+                pending_output[next_state].extend(pending_output[self._fail[next_state]])
+
+        self._output = [tuple(output) for output in pending_output]
+
+    def __bool__(self) -> bool:
+        return self.keywords_count > 0
+
+    def match(self, text: Optional[str], campaign_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+        """
+        Поиск ключевых слов в тексте за один проход.
+
+        Возвращает словарь {campaign_id: ключевое слово}, где для каждой кампании
+        указано первое сработавшее в тексте ключевое слово. Если передан
+        campaign_ids, учитываются только эти кампании.
+        """
+        if not text or not self.keywords_count:
+            return {}
+
+        allowed = set(campaign_ids) if campaign_ids is not None else None
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        matches: Dict[int, str] = {}
+
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for campaign_id, keyword in output[state]:
+                if campaign_id in matches:
+                    continue
+                if allowed is not None and campaign_id not in allowed:
+                    continue
+                matches[campaign_id] = keyword
+
+        return matches
@@ -0,0 +1,125 @@
+import os
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Dict, Hashable, List, Optional
+
+
+def message_record(message) -> Dict:
+    """Запись сообщения в формате контекста промпта"""
+    return {
+        "id": message.id,
+        "text": message.text or "",
+        "date": message.date.isoformat(),
+        "from_user": str(message.from_id) if message.from_id else "unknown"
+    }
+
+
+class MessageBuffer:
+    """
+    Кольцевые буферы последних сообщений отслеживаемых чатов.
+
+    Агент и так получает каждое новое сообщение, поэтому контекст триггера
+    берется из памяти. Буфер чата непрерывен: в нем нет пропусков между
+    самым старым и самым новым сообщением. Если в буфере меньше нужного
+    числа предыдущих сообщений (холодный старт, сброс после переподключения),
+    get_context() возвращает None и контекст запрашивается у Telegram.
+
+    Триггер ждет обработки в окне объединения и в очереди пула воркеров, а
+    новые сообщения чата тем временем продолжают приходить, поэтому буфер
+    хранит контекст с запасом slack сообщений (MESSAGE_BUFFER_SLACK).
+    """
+
+    def __init__(self, capacity: int = 0, slack: Optional[int] = None):
+        self.capacity = capacity
+        self.slack = slack if slack is not None else int(os.getenv("MESSAGE_BUFFER_SLACK", "50"))
+        self._chats: Dict[Hashable, Deque[Dict]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def resize(self, context_size: int):
+        """Новый размер буферов: наибольший context_messages_count кампаний + триггер + запас"""
+        capacity = context_size + 1 + self.slack if context_size > 0 else 0
+        if capacity == self.capacity:
+            return
+        self.capacity = capacity
+        self._chats = {
+            chat_key: deque(records, maxlen=capacity)
+            for chat_key, records in self._chats.items()
+        } if capacity > 0 else {}
+
+    def add(self, chat_key: Hashable, message):
+        """Добавление нового сообщения чата (или обновление уже сохраненного)"""
+        if self.capacity <= 0:
+            return
+        record = message_record(message)
+        records = self._chats.get(chat_key)
+        if records is None:
+            self._chats[chat_key] = deque([record], maxlen=self.capacity)
+            return
+        if not records or record["id"] > records[-1]["id"]:
+            records.append(record)
+            return
+        self.update(chat_key, message)
+
+    def update(self, chat_key: Hashable, message):
+        """Обновление текста отредактированного сообщения, если оно в буфере"""
+        records = self._chats.get(chat_key)
+        if not records or message.id < records[0]["id"]:
+            return
+        for index in range(len(records) - 1, -1, -1):
+            if records[index]["id"] == message.id:
+                records[index] = message_record(message)
+                return
+
+    def seed(self, chat_key: Hashable, messages: List):
+        """
+        Заполнение буфера сообщениями, полученными из Telegram.
+
+        messages - все сообщения чата до некоторого ID подряд (как их отдает
+        iter_messages), поэтому вместе с уже буферизованными более новыми
+        сообщениями они образуют непрерывную историю.
+        """
+        if self.capacity <= 0:
+            return
+        records = {record["id"]: record for record in map(message_record, messages)}
+        for record in self._chats.get(chat_key, ()):
+            records[record["id"]] = record
+        ordered = [records[message_id] for message_id in sorted(records)]
+        self._chats[chat_key] = deque(ordered, maxlen=self.capacity)
+
+    def get_context(self, chat_key: Hashable, message_id: int, count: int) -> Optional[List[Dict]]:
+        """
+        count сообщений перед message_id (от новых к старым) или None, если
+        буфер не покрывает нужный диапазон.
+
+        Позиция триггера ищется по ID, поэтому более новые сообщения чата,
+        пришедшие пока триггер ждал обработки, не мешают. Диапазон покрыт, если
+        в буфере есть count сообщений до message_id и сообщение с ID не меньше
+        message_id (буфер непрерывен вплоть до триггера).
+        """
+        records = self._chats.get(chat_key)
+        if records:
+            position = bisect_left(records, message_id, key=lambda record: record["id"])
+            if position >= count and position < len(records):
+                self.hits += 1
+                return [records[index] for index in range(position - 1, position - count - 1, -1)]
+        self.misses += 1
+        return None
+
+    def clear(self, chat_key: Optional[Hashable] = None):
+        """Сброс буфера чата (или всех) при возможном пропуске сообщений"""
+        if chat_key is None:
+            self._chats.clear()
+        else:
+            self._chats.pop(chat_key, None)
+
+    def stats(self) -> Dict:
+        """Заполненность буферов и доля контекстов из памяти"""
+        total = self.hits + self.misses
+        return {
+            "capacity": self.capacity,
+            "chats": len(self._chats),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
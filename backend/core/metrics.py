@@ -0,0 +1,236 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Content-Type текстового формата Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Границы гистограмм по умолчанию (секунды): от быстрых запросов к БД до долгой генерации
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Метрика с набором меток: значения хранятся по кортежу значений меток"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict) -> LabelKey:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self) -> Iterator[Tuple[str, LabelKey, float, Tuple[Tuple[str, str], ...]]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for suffix, key, value, extra in self._samples():
+            names = self.labelnames + tuple(name for name, _ in extra)
+            values = key + tuple(label for _, label in extra)
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Счетчик без меток выдается с нуля, до первого события
+        self._values: Dict[LabelKey, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "", key, value, ()
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Глубины очередей задаются функцией (set_function):
+    значение читается только при выдаче метрик, горячий путь не трогается.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self._functions: Dict[LabelKey, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """Значение меток вычисляется функцией при выдаче метрик (новая функция заменяет старую)"""
+        self._functions[self._key(labels)] = function
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "", key, value, ()
+        for key, function in list(self._functions.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            yield "", key, value, ()
+
+
+class _HistogramValues:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами (в выдаче - накопительные бакеты)"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, _HistogramValues] = {}
+        if not self.labelnames:
+            self._values[()] = _HistogramValues(len(self.bounds) + 1)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        values = self._values.get(key)
+        if values is None:
+            values = self._values[key] = _HistogramValues(len(self.bounds) + 1)
+        # Наблюдение попадает в первый бакет с границей >= value (последний - +Inf)
+        values.buckets[bisect_left(self.bounds, value)] += 1
+        values.sum += value
+        values.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока (в том числе завершившегося исключением)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        for key, values in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), values.buckets):
+                cumulative += count
+                yield "_bucket", key, cumulative, (("le", _format_value(float(bound))),)
+            yield "_sum", key, values.sum, ()
+            yield "_count", key, values.count, ()
+
+
+class MetricsRegistry:
+    """
+    Реестр метрик агента в текстовом формате Prometheus (без prometheus_client).
+
+    Обновление метрики - операция со словарем в event loop без блокировок;
+    текст собирается только при запросе /metrics.
+    """
+
+    def __init__(self, prefix: str = "telegram_agent"):
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(f"{self.prefix}_{name}", documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Optional[Sequence[float]] = None
+    ) -> Histogram:
+        return self._register(Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets or DEFAULT_BUCKETS))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр: компоненты агента пишут, эндпоинт /metrics читает
+metrics = MetricsRegistry()
+
+# Горячий путь обработки сообщений
+messages_received = metrics.counter("messages_received_total", "Входящие сообщения, полученные агентом")
+messages_rejected = metrics.counter("messages_rejected_total", "Сообщения, отклоненные фильтром чатов")
+keyword_matches_total = metrics.counter("keyword_matches_total", "Срабатывания ключевых слов кампаний", ("campaign",))
+
+# Генерация ответов
+llm_latency = metrics.histogram(
+    "llm_request_seconds",
+    "Длительность запроса к AI провайдеру (для потоковых - до последнего фрагмента)",
+    ("provider", "model")
+)
+
+# Отправка в Telegram
+send_latency = metrics.histogram(
+    "send_seconds",
+    "Длительность отправки сообщения с учетом ожидания в очереди аккаунта",
+    ("account",)
+)
+flood_waits = metrics.counter("flood_waits_total", "FloodWait и SlowModeWait при отправке", ("account",))
+
+# Запись логов активности
+log_write_latency = metrics.histogram("log_write_seconds", "Длительность записи пакета логов активности в БД")
+
+# Глубина очередей (значения читаются функциями при выдаче метрик)
+pipeline_pending = metrics.gauge("trigger_pipeline_pending", "Триггеры в очереди и в обработке пула воркеров", ("pipeline",))
+send_queue_depth = metrics.gauge("send_queue_depth", "Сообщения в очереди отправки аккаунта", ("account",))
+log_buffer_size = metrics.gauge("log_buffer_size", "Записи в буфере логов активности")
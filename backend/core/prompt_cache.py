@@ -0,0 +1,56 @@
+from typing import Dict, Hashable, Optional
+
+
+class PromptCacheStats:
+    """
+    Счетчики попаданий в кэш префикса промпта на стороне провайдера.
+
+    Считаются по кампаниям: попадание - провайдер прочитал статичный системный
+    блок из кэша, промах - системный блок был обработан (и, возможно, записан
+    в кэш) заново.
+    """
+
+    def __init__(self):
+        self._stats: Dict[Hashable, Dict[str, int]] = {}
+
+    def record(
+        self,
+        cache_key: Optional[Hashable],
+        provider: str,
+        input_tokens: Optional[int],
+        cached_tokens: Optional[int],
+        cache_write_tokens: Optional[int] = None
+    ):
+        """Учет использования токенов одного запроса"""
+        if cache_key is None:
+            return
+        stats = self._stats.setdefault(cache_key, {
+            "hits": 0,
+            "misses": 0,
+            "input_tokens": 0,
+            "cached_tokens": 0,
+            "cache_write_tokens": 0,
+        })
+        stats["provider"] = provider
+        if cached_tokens:
+            stats["hits"] += 1
+        else:
+            stats["misses"] += 1
+        stats["input_tokens"] += input_tokens or 0
+        stats["cached_tokens"] += cached_tokens or 0
+        stats["cache_write_tokens"] += cache_write_tokens or 0
+
+    def get(self, cache_key: Hashable) -> Dict:
+        """Статистика кампании с долей попаданий"""
+        stats = dict(self._stats.get(cache_key, {"hits": 0, "misses": 0}))
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else None
+        return stats
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Статистика по всем кампаниям (для статуса агента)"""
+        return {str(cache_key): self.get(cache_key) for cache_key in self._stats}
+
+
+# Глобальный экземпляр: клиенты провайдеров пишут, статус агента читает
+prompt_cache_stats = PromptCacheStats()
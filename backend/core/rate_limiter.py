@@ -0,0 +1,148 @@
+import logging
+import os
+import time
+from typing import Dict, Hashable, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Области ограничения в порядке проверки
+SCOPES = ("chat", "campaign", "account")
+
+
+def parse_limit(limit) -> Optional[Tuple[float, float]]:
+    """
+    Разбор лимита «N/секунды» (например, "3/60" - три ответа в минуту).
+
+    Возвращает (емкость, скорость пополнения в секунду) или None, если
+    лимит отключен ("", "0", None).
+    """
+    if not limit:
+        return None
+    count, _, period = str(limit).partition("/")
+    count = float(count)
+    period = float(period or 1)
+    if count <= 0 or period <= 0:
+        return None
+    return count, count / period
+
+
+class TokenBucket:
+    """Корзина токенов: capacity ответов подряд, затем rate ответов в секунду"""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        # now может быть раньше создания корзины (время берется до ее создания)
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+        return self.tokens
+
+
+class ReplyRateLimiter:
+    """
+    Ограничение частоты ответов корзинами токенов.
+
+    Корзины ведутся на кампанию, на чат в рамках кампании и на Telegram
+    аккаунт, через который отправляется ответ. Лимиты по умолчанию задаются
+    переменными RATE_LIMIT_* (без них лимит отключен), кампания
+    может переопределить их в settings["rate_limits"]:
+    {"campaign": "10/60", "chat": "1/30"}. Токены списываются со всех
+    корзин только если ответ разрешен всеми.
+    """
+
+    def __init__(self, defaults: Optional[Mapping[str, str]] = None):
+        if defaults is None:
+            # По умолчанию лимиты отключены: включаются переменными RATE_LIMIT_*
+            defaults = {
+                "campaign": os.getenv("RATE_LIMIT_CAMPAIGN", ""),
+                "chat": os.getenv("RATE_LIMIT_CHAT", ""),
+                "account": os.getenv("RATE_LIMIT_ACCOUNT", ""),
+            }
+        self.defaults = {}
+        for scope, limit in defaults.items():
+            try:
+                self.defaults[scope] = parse_limit(limit)
+            except ValueError:
+                logger.warning(f"Некорректный лимит {scope}={limit!r} - лимит отключен")
+                self.defaults[scope] = None
+        self._buckets: Dict[Tuple[str, Hashable], TokenBucket] = {}
+        self._checks = 0
+        self.allowed = 0
+        self.suppressed: Dict[str, int] = {scope: 0 for scope in SCOPES}
+
+    def _limits(self, campaign) -> Dict[str, Optional[Tuple[float, float]]]:
+        limits = dict(self.defaults)
+        overrides = (getattr(campaign, "settings", None) or {}).get("rate_limits") or {}
+        for scope in ("campaign", "chat"):
+            if scope in overrides:
+                try:
+                    limits[scope] = parse_limit(overrides[scope])
+                except ValueError:
+                    # Некорректный лимит в настройках - остается лимит по умолчанию
+                    pass
+        return limits
+
+    def _bucket(self, scope: str, key: Hashable, limit: Tuple[float, float]) -> TokenBucket:
+        bucket = self._buckets.get((scope, key))
+        if bucket is None or (bucket.capacity, bucket.rate) != limit:
+            # Новая корзина или изменившийся лимит кампании
+            bucket = self._buckets[(scope, key)] = TokenBucket(*limit)
+        return bucket
+
+    def acquire(self, campaign, chat_id: Hashable, account: Hashable = "default") -> Optional[str]:
+        """
+        Попытка получить разрешение на ответ.
+
+        account - аккаунт, который фактически отправит ответ (после разрешения
+        campaign.telegram_account пулом клиентов).
+
+        Возвращает None, если ответ разрешен (токены списаны), иначе -
+        область лимита, который превышен ("chat", "campaign" или "account").
+        """
+        now = time.monotonic()
+        self._checks += 1
+        if self._checks % 1000 == 0:
+            self._prune(now)
+
+        limits = self._limits(campaign)
+        keys = {
+            "chat": (campaign.id, chat_id),
+            "campaign": campaign.id,
+            "account": account,
+        }
+
+        buckets: List[TokenBucket] = []
+        for scope in SCOPES:
+            limit = limits.get(scope)
+            if limit is None:
+                continue
+            bucket = self._bucket(scope, keys[scope], limit)
+            if bucket.refill(now) < 1:
+                self.suppressed[scope] += 1
+                return scope
+            buckets.append(bucket)
+
+        for bucket in buckets:
+            bucket.tokens -= 1
+        self.allowed += 1
+        return None
+
+    def _prune(self, now: float):
+        """Удаление полностью восстановившихся корзин (они равны новым)"""
+        for key in [key for key, bucket in self._buckets.items() if bucket.refill(now) >= bucket.capacity]:
+            del self._buckets[key]
+
+    def stats(self) -> Dict:
+        """Разрешенные и подавленные ответы по областям лимитов"""
+        return {
+            "allowed": self.allowed,
+            "suppressed": dict(self.suppressed),
+            "buckets": len(self._buckets),
+        }
@@ -0,0 +1,41 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class RecentKeys:
+    """
+    LRU недавно обработанных ключей триггеров (чат, сообщение, кампания).
+
+    Проверяется до генерации ответа: повтор того же сообщения (правка,
+    пересекающиеся обработчики, повтор обновлений после переподключения)
+    стоит одного поиска в словаре. Старые ключи вытесняются; повтор после
+    вытеснения отсекает уникальный ключ в activity_logs.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size or int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+        self.duplicates = 0
+
+    def add(self, key: Hashable) -> bool:
+        """Отметка ключа обработанным (False - ключ уже встречался)"""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.duplicates += 1
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def stats(self) -> Dict:
+        """Размер и число отброшенных повторов"""
+        return {
+            "size": len(self._keys),
+            "max_size": self.max_size,
+            "duplicates": self.duplicates,
+        }
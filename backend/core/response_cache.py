@@ -0,0 +1,175 @@
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """Текст вопроса без регистра, пунктуации, эмодзи и лишних пробелов"""
+    if not text:
+        return ""
+    text = text.lower().replace("ё", "е")
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def shingles(text: str, size: int = 3) -> FrozenSet[str]:
+    """Символьные n-граммы нормализованного текста"""
+    if len(text) <= size:
+        return frozenset([text])
+    return frozenset(text[index:index + size] for index in range(len(text) - size + 1))
+
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def context_hash(texts: Iterable[str]) -> str:
+    """Хэш контекста (предыдущих сообщений, чата), к которому привязан ответ"""
+    digest = hashlib.sha1()
+    for text in texts:
+        digest.update(normalize_text(text).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("response", "shingles", "expires_at", "latency")
+
+    def __init__(self, response: str, text_shingles: FrozenSet[str], expires_at: float, latency: float):
+        self.response = response
+        self.shingles = text_shingles
+        self.expires_at = expires_at
+        self.latency = latency
+
+
+class ResponseCache:
+    """
+    Кэш ответов на повторяющиеся вопросы.
+
+    Ключ - кампания, нормализованный текст триггера и хэш контекста. Кэш
+    включается для кампании в settings["response_cache"]: true или словарь
+    {"similarity": 0.8, "ttl": 600, "use_context": true}. При заданном
+    similarity промах по точному ключу ищет самый похожий вопрос той же
+    кампании и контекста по сходству Жаккара символьных триграмм.
+    """
+
+    # Сколько последних вопросов кампании сравнивается при поиске похожего
+    max_scan = 200
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None):
+        self.max_size = max_size or int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+        self.ttl = ttl or float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._scopes: Dict[Tuple, "OrderedDict[str, None]"] = {}
+        self._stats = {
+            "hits": 0,
+            "similar_hits": 0,
+            "misses": 0,
+            "stored": 0,
+        }
+        self.saved_latency = 0.0
+
+    @staticmethod
+    def _settings(campaign) -> Optional[Dict]:
+        settings = (getattr(campaign, "settings", None) or {}).get("response_cache")
+        if not settings:
+            return None
+        return settings if isinstance(settings, dict) else {}
+
+    def lookup(self, campaign, text: Optional[str], context: str = "") -> Optional[str]:
+        """Сохраненный ответ на такой же (или похожий) вопрос, None - промах или кэш выключен"""
+        settings = self._settings(campaign)
+        if settings is None:
+            return None
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        scope = (campaign.id, context if settings.get("use_context", True) else "")
+        now = time.monotonic()
+
+        entry = self._get((*scope, normalized), now)
+        similar = False
+        if entry is None and settings.get("similarity"):
+            entry = self._find_similar(scope, normalized, float(settings["similarity"]), now)
+            similar = entry is not None
+
+        if entry is None:
+            self._stats["misses"] += 1
+            return None
+        self._stats["similar_hits" if similar else "hits"] += 1
+        self.saved_latency += entry.latency
+        return entry.response
+
+    def store(self, campaign, text: Optional[str], context: str, response: str, latency: float):
+        """Сохранение ответа (только для кампаний с включенным кэшем)"""
+        settings = self._settings(campaign)
+        normalized = normalize_text(text)
+        if settings is None or not normalized or not response:
+            return
+        scope = (campaign.id, context if settings.get("use_context", True) else "")
+        key = (*scope, normalized)
+        ttl = float(settings.get("ttl") or self.ttl)
+
+        self._entries[key] = _Entry(response, shingles(normalized), time.monotonic() + ttl, latency)
+        self._entries.move_to_end(key)
+        scope_keys = self._scopes.setdefault(scope, OrderedDict())
+        scope_keys[normalized] = None
+        scope_keys.move_to_end(normalized)
+        self._stats["stored"] += 1
+
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def _get(self, key: Tuple, now: float) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < now:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _find_similar(self, scope: Tuple, normalized: str, threshold: float, now: float) -> Optional[_Entry]:
+        scope_keys = self._scopes.get(scope)
+        if not scope_keys:
+            return None
+        text_shingles = shingles(normalized)
+        best_key, best_score = None, threshold
+        for index, candidate in enumerate(reversed(scope_keys)):
+            if index >= self.max_scan:
+                break
+            entry = self._entries[(*scope, candidate)]
+            score = jaccard(text_shingles, entry.shingles)
+            if score >= best_score and entry.expires_at >= now:
+                best_key, best_score = candidate, score
+        return self._get((*scope, best_key), now) if best_key is not None else None
+
+    def _drop(self, key: Tuple):
+        del self._entries[key]
+        scope = key[:2]
+        scope_keys = self._scopes.get(scope)
+        if scope_keys is not None:
+            scope_keys.pop(key[2], None)
+            if not scope_keys:
+                del self._scopes[scope]
+
+    def stats(self) -> Dict:
+        """Доля попаданий и сэкономленное время генерации"""
+        hits = self._stats["hits"] + self._stats["similar_hits"]
+        total = hits + self._stats["misses"]
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            **self._stats,
+            "hit_rate": round(hits / total, 3) if total else None,
+            "saved_latency_ms": int(self.saved_latency * 1000),
+        }
@@ -0,0 +1,176 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from telethon.errors import FloodWaitError, ServerError, SlowModeWaitError, TimedOutError
+
+from backend.core.metrics import flood_waits, send_latency, send_queue_depth
+
+T = TypeVar("T")
+
+# Временные ошибки, после которых отправку стоит повторить
+TRANSIENT_ERRORS = (ServerError, TimedOutError, ConnectionError, asyncio.TimeoutError)
+
+
+class SendScheduler:
+    """
+    Очередь исходящих сообщений одного Telegram аккаунта.
+
+    - сообщения в один чат отправляются по очереди и не чаще chat_interval
+      секунд, все сообщения аккаунта - не чаще global_interval секунд;
+    - FloodWaitError останавливает отправку всего аккаунта до истечения
+      e.seconds, SlowModeWaitError - отправку в чат; затем отправка
+      повторяется, поэтому всплеск ответов превращается в задержку, а не в
+      потерянные ответы;
+    - временные ошибки сервера и сети повторяются с экспоненциальной
+      задержкой и случайным разбросом.
+    """
+
+    def __init__(
+        self,
+        name: str = "default",
+        chat_interval: Optional[float] = None,
+        global_interval: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        max_flood_wait: Optional[float] = None
+    ):
+        self.name = name
+        self.chat_interval = (
+            chat_interval if chat_interval is not None else float(os.getenv("SEND_CHAT_INTERVAL", "3"))
+        )
+        self.global_interval = (
+            global_interval if global_interval is not None else float(os.getenv("SEND_GLOBAL_INTERVAL", "0.05"))
+        )
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("SEND_MAX_RETRIES", "5"))
+        self.max_flood_wait = (
+            max_flood_wait if max_flood_wait is not None else float(os.getenv("SEND_MAX_FLOOD_WAIT", "600"))
+        )
+
+        self._flood_until = 0.0
+        self._global_next_at = 0.0
+        self._chat_next_at: Dict[Hashable, float] = {}
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Hashable, int] = {}
+
+        self._queued = 0
+        self._stats = {
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "flood_waits": 0,
+        }
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        send_queue_depth.set_function(lambda: self._queued, account=self.name)
+
+    async def send(self, chat_key: Hashable, send: Callable[[], Awaitable[T]], pace: bool = True) -> T:
+        """
+        Отправка через очередь аккаунта: ждет своей очереди, лимитов и
+        flood-wait, возвращает результат send().
+
+        pace=False - без интервала между сообщениями чата (правки уже
+        отправленного сообщения), flood-wait и повторы соблюдаются.
+        """
+        queued_at = time.monotonic()
+        self._queued += 1
+        self._chat_waiters[chat_key] = self._chat_waiters.get(chat_key, 0) + 1
+        lock = self._chat_locks.setdefault(chat_key, asyncio.Lock())
+        try:
+            async with lock:
+                result = await self._send_with_retries(chat_key, send, pace, queued_at)
+            send_latency.observe(time.monotonic() - queued_at, account=self.name)
+            return result
+        finally:
+            self._queued -= 1
+            self._chat_waiters[chat_key] -= 1
+            if not self._chat_waiters[chat_key]:
+                del self._chat_waiters[chat_key]
+                del self._chat_locks[chat_key]
+
+    async def _send_with_retries(
+        self,
+        chat_key: Hashable,
+        send: Callable[[], Awaitable[T]],
+        pace: bool,
+        queued_at: float
+    ) -> T:
+        attempt = 0
+        while True:
+            await self._wait_turn(chat_key, pace)
+            if attempt == 0:
+                wait = time.monotonic() - queued_at
+                self._total_wait += wait
+                self._max_wait = max(self._max_wait, wait)
+
+            try:
+                result = await send()
+            except FloodWaitError as e:
+                self._stats["flood_waits"] += 1
+                flood_waits.inc(account=self.name)
+                attempt += 1
+                if e.seconds > self.max_flood_wait or attempt > self.max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                # Flood-wait распространяется на весь аккаунт
+                self._flood_until = max(self._flood_until, time.monotonic() + e.seconds)
+                print(f"⏳ {self.name}: FloodWait {e.seconds} с, отправка отложена")
+                continue
+            except SlowModeWaitError as e:
+                self._stats["flood_waits"] += 1
+                flood_waits.inc(account=self.name)
+                attempt += 1
+                if e.seconds > self.max_flood_wait or attempt > self.max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                self._chat_next_at[chat_key] = time.monotonic() + e.seconds
+                continue
+            except TRANSIENT_ERRORS:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._stats["failed"] += 1
+                    raise
+                self._stats["retries"] += 1
+                await asyncio.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            except Exception:
+                self._stats["failed"] += 1
+                raise
+
+            self._stats["sent"] += 1
+            if pace:
+                self._chat_next_at[chat_key] = time.monotonic() + self.chat_interval
+            return result
+
+    async def _wait_turn(self, chat_key: Hashable, pace: bool):
+        """Ожидание окончания flood-wait, интервала чата и общего интервала аккаунта"""
+        while True:
+            now = time.monotonic()
+            ready_at = max(self._flood_until, self._chat_next_at.get(chat_key, 0.0) if pace else 0.0)
+            if ready_at <= now:
+                break
+            await asyncio.sleep(ready_at - now)
+
+        # Слот в общем потоке аккаунта резервируется без ожидания между чтением и записью
+        now = time.monotonic()
+        slot = max(now, self._global_next_at)
+        self._global_next_at = slot + self.global_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+        if len(self._chat_next_at) > 10000:
+            self._chat_next_at = {key: at for key, at in self._chat_next_at.items() if at > now}
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, ожидание и flood-wait для статуса агента"""
+        started = self._stats["sent"] + self._stats["failed"]
+        return {
+            "account": self.name,
+            "queue_depth": self._queued,
+            "chats_waiting": len(self._chat_waiters),
+            "flood_wait_remaining": round(max(0.0, self._flood_until - time.monotonic()), 1),
+            "avg_wait_ms": int(self._total_wait / started * 1000) if started else 0,
+            "max_wait_ms": int(self._max_wait * 1000),
+            **self._stats,
+        }
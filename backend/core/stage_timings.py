@@ -0,0 +1,113 @@
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence
+
+# Этапы обработки триггера в порядке выполнения
+STAGES = ("match", "context", "prompt", "llm_ttft", "llm_total", "send", "log")
+
+
+class StageTimings:
+    """
+    Длительности этапов обработки одного триггера.
+
+    Замер этапа, который выполняется несколько раз (отправка и правки
+    потокового ответа), суммируется. to_dict() - компактный словарь
+    «этап → миллисекунды» для ActivityLog.stage_timings; этапы, до которых
+    обработка не дошла (ответ из кэша, ошибка), в нем отсутствуют.
+    """
+
+    __slots__ = ("_seconds",)
+
+    def __init__(self, match: Optional[float] = None):
+        self._seconds: Dict[str, float] = {}
+        if match is not None:
+            self._seconds["match"] = match
+
+    def add(self, stage: str, seconds: float):
+        self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Замер блока как этапа stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    @contextmanager
+    def measure_llm(self):
+        """Замер запроса LLM без потока: первый токен приходит вместе с полным ответом"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add("llm_ttft", elapsed)
+            self.add("llm_total", elapsed)
+
+    def timed(self, stage: str, function: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """Обертка корутинной функции, каждый вызов которой замеряется как этап stage"""
+        async def wrapper(*args, **kwargs):
+            with self.measure(stage):
+                return await function(*args, **kwargs)
+        return wrapper
+
+    async def stream(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """
+        Поток фрагментов LLM с замером llm_ttft (до первого фрагмента) и
+        llm_total (только ожидание фрагментов, без отправки и правок между ними).
+        """
+        started = time.perf_counter()
+        waited = 0.0
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                chunk_started = time.perf_counter()
+                try:
+                    chunk = await iterator.__anext__()
+                finally:
+                    waited += time.perf_counter() - chunk_started
+                if "llm_ttft" not in self._seconds:
+                    self._seconds["llm_ttft"] = time.perf_counter() - started
+                yield chunk
+        except StopAsyncIteration:
+            pass
+        finally:
+            self.add("llm_total", waited)
+
+    def to_dict(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 1) for stage, seconds in self._seconds.items()}
+
+
+def percentile(sorted_values: Sequence[float], quantile: float) -> Optional[float]:
+    """Перцентиль с линейной интерполяцией (как percentile_cont) по отсортированным значениям"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * quantile
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def stage_percentiles(rows: Iterable[Optional[Dict]], quantiles: Sequence[float] = (0.5, 0.95, 0.99)) -> Dict[str, Dict]:
+    """p50/p95/p99 (мс) и число замеров по каждому этапу из словарей stage_timings"""
+    values: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    for timings in rows:
+        for stage, milliseconds in (timings or {}).items():
+            if milliseconds is not None:
+                values.setdefault(stage, []).append(float(milliseconds))
+
+    result = {}
+    for stage, stage_values in values.items():
+        stage_values.sort()
+        result[stage] = {
+            "count": len(stage_values),
+            **{
+                f"p{round(quantile * 100)}": (
+                    round(percentile(stage_values, quantile), 1) if stage_values else None
+                )
+                for quantile in quantiles
+            },
+        }
+    return result
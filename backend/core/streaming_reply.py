@@ -0,0 +1,100 @@
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+# Граница законченного предложения или абзаца
+SENTENCE_BOUNDARY = re.compile(r'[.!?…](?:["»)\]]*)(?=\s)|\n\s*\n')
+
+
+class StreamInterruptedError(Exception):
+    """
+    Поток ответа прервался после отправки его начала.
+
+    delivered - текст, который остался в чате (последняя удачная правка).
+    """
+
+    def __init__(self, delivered: str, error: Exception):
+        super().__init__(f"Поток ответа прерван: {error}")
+        self.delivered = delivered
+
+
+def complete_prefix(text: str) -> str:
+    """Часть текста до последней законченной фразы (или пустая строка)"""
+    end = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        end = match.end()
+    return text[:end].rstrip()
+
+
+async def stream_reply(
+    chunks: AsyncIterator[str],
+    send: Callable[[str], Awaitable[Any]],
+    edit: Callable[[Any, str], Awaitable[Any]],
+    edit_interval: Optional[float] = None
+) -> str:
+    """
+    Отправка ответа по мере генерации.
+
+    Сообщение отправляется, как только в потоке появилась первая законченная
+    фраза, затем редактируется на месте не чаще edit_interval секунд и
+    финально - полным текстом. Возвращает полный сгенерированный текст.
+
+    Если send вернул None, ответ считается недоставленным (исключение). Если
+    поток или правка прервались после отправки, в сообщении остаются
+    законченные фразы, а наружу выходит StreamInterruptedError с этим текстом.
+    """
+    if edit_interval is None:
+        edit_interval = float(os.getenv("STREAMING_EDIT_INTERVAL", "1.5"))
+
+    text = ""
+    sent = False
+    sent_message = None
+    shown_text = ""
+    last_edit = 0.0
+
+    try:
+        async for chunk in chunks:
+            text += chunk
+            visible = complete_prefix(text)
+            if not visible or visible == shown_text:
+                continue
+
+            if not sent:
+                sent_message = await send(visible)
+                if sent_message is None:
+                    raise RuntimeError("ответ не доставлен в чат")
+                sent = True
+                shown_text = visible
+                last_edit = time.monotonic()
+            elif time.monotonic() - last_edit >= edit_interval:
+                try:
+                    await edit(sent_message, visible)
+                    shown_text = visible
+                except Exception as e:
+                    print(f"⚠️ Ошибка промежуточного редактирования ответа: {e}")
+                last_edit = time.monotonic()
+
+        final_text = text.strip()
+        if not final_text:
+            return text
+
+        if not sent:
+            if await send(final_text) is None:
+                raise RuntimeError("ответ не доставлен в чат")
+        elif final_text != shown_text:
+            await edit(sent_message, final_text)
+    except Exception as e:
+        if not sent:
+            raise
+        # В чате уже есть начало ответа: дописываем законченные фразы и сообщаем, что доставлено
+        visible = complete_prefix(text)
+        if visible and visible != shown_text:
+            try:
+                await edit(sent_message, visible)
+                shown_text = visible
+            except Exception as edit_error:
+                print(f"⚠️ Ошибка редактирования прерванного ответа: {edit_error}")
+        raise StreamInterruptedError(shown_text, e) from e
+
+    return text
@@ -1,77 +1,39 @@
 import asyncio
 import os
+import socket
 import time
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 
-from telethon import TelegramClient, events
+from telethon import events
 from telethon.tl.types import Message, User, Chat, Channel
+from telethon.utils import get_peer_id
 from sqlalchemy.orm import Session
 
 from database.models.base import SessionLocal
 from database.models.campaign import Campaign
-from database.models.log import ActivityLog
+from backend.core.keyword_matcher import KeywordMatcher
+from backend.core.ai_clients import SimpleClaudeClient, SimpleOpenAIClient, close_http_client, is_error_response
+from backend.core.chat_index import ChatIndex, normalize_chat_id, normalize_username, split_chats
+from backend.core.campaign_cache import get_campaigns_version, load_active_campaigns
+from backend.core.campaign_snapshot import CampaignSnapshot
+from backend.core.trigger_pipeline import TriggerPipeline
+from backend.core.trigger_queue import TriggerQueue, trigger_max_age, worker_partitions
+from backend.core.activity_log_writer import ActivityLogWriter
+from backend.core.streaming_reply import StreamInterruptedError, stream_reply
+from backend.core.prompt_cache import prompt_cache_stats
+from backend.core.entity_cache import entity_cache, entity_title
+from backend.core.message_buffer import MessageBuffer, message_record
+from backend.core.rate_limiter import ReplyRateLimiter
+from backend.core.client_pool import create_client_pool, load_company_accounts
+from backend.core.response_cache import ResponseCache, context_hash
+from backend.core.coalescer import TriggerCoalescer, coalesce_window
+from backend.core.recent_keys import RecentKeys
+from backend.core.catch_up import ChatCursors, ReconnectAwareClient, catch_up
+from backend.core.metrics import keyword_matches_total, messages_received, messages_rejected
+from backend.core.stage_timings import StageTimings
 
-# Встроенные AI клиенты (заменяют utils.*)
-class SimpleClaudeClient:
-    """Простой Claude клиент"""
-    def __init__(self):
-        try:
-            import anthropic
-            self.api_key = os.getenv("ANTHROPIC_API_KEY")
-            if self.api_key:
-                self.client = anthropic.Anthropic(api_key=self.api_key)
-                print("Claude клиент инициализирован")
-            else:
-                self.client = None
-        except ImportError:
-            self.client = None
-            
-    async def generate_response(self, prompt: str, **kwargs) -> str:
-        if not self.client:
-            return "Claude недоступен - проверьте ANTHROPIC_API_KEY и установку anthropic"
-        try:
-            import asyncio
-            response = await asyncio.to_thread(
-                self.client.messages.create,
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.content[0].text
-        except Exception as e:
-            return f"Ошибка Claude: {e}"
-
-class SimpleOpenAIClient:
-    """Простой OpenAI клиент"""
-    def __init__(self):
-        try:
-            import openai
-            self.api_key = os.getenv("OPENAI_API_KEY")
-            if self.api_key:
-                self.client = openai.OpenAI(api_key=self.api_key)
-                print("OpenAI клиент инициализирован")
-            else:
-                self.client = None
-        except ImportError:
-            self.client = None
-            
-    async def generate_response(self, prompt: str, **kwargs) -> str:
-        if not self.client:
-            return "OpenAI недоступен - проверьте OPENAI_API_KEY и установку openai"
-        try:
-            import asyncio
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
-                model="gpt-4",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Ошибка OpenAI: {e}"
-
-# Алиасы для совместимости
+# Алиасы для совместимости (асинхронные AI клиенты - в backend.core.ai_clients)
 ClaudeClient = SimpleClaudeClient
 OpenAIClient = SimpleOpenAIClient
 ZepMemoryManager = None  # Заглушка
@@ -82,13 +44,17 @@ class TelegramAgent:
     Основной класс Telegram-агента для мониторинга чатов и генерации ответов
     """
     
-    def __init__(self):
+    def __init__(self, mode: Optional[str] = None):
+        # Режим процесса: all - прием и обработка, ingest - только прием, worker - только обработка
+        self.mode = mode or os.getenv("AGENT_MODE", "all")
+        
         self.api_id = int(os.getenv("TELEGRAM_API_ID"))
         self.api_hash = os.getenv("TELEGRAM_API_HASH")
         self.phone = os.getenv("TELEGRAM_PHONE")
         
-        # Инициализация клиентов
-        self.client = TelegramClient("telegram_agent", self.api_id, self.api_hash)
+        # Пул Telegram клиентов: основной аккаунт из TELEGRAM_* и аккаунты компании
+        self.client_pool = create_client_pool(ReconnectAwareClient)
+        self.client = self.client_pool.primary.client
         
         # AI клиенты - инициализируем с обработкой ошибок
         try:
@@ -108,25 +74,121 @@ class TelegramAgent:
         # Memory manager временно отключен
         self.memory_manager = None
         
+        # Потоковая генерация: ответ отправляется после первой фразы и дописывается правками
+        self.streaming_responses = os.getenv("STREAMING_RESPONSES", "False").lower() == "true"
+        
         # Кэш активных кампаний
-        self.active_campaigns: List[Campaign] = []
+        self.active_campaigns: List[CampaignSnapshot] = []
         self.last_cache_update = 0
-        self.cache_ttl = 10  # 10 секунд для быстрого отклика на изменения
-        self.force_refresh = False  # Флаг принудительного обновления
+        self.cache_ttl = 10  # Интервал фоновой проверки версии кампаний в БД (секунды)
+        self.campaigns_version = None  # Версия кампаний, по которой построены индексы
+        self._campaigns_refresh_lock = asyncio.Lock()
+        self._campaigns_watch_task: Optional[asyncio.Task] = None
+        self._campaigns_refresh_task: Optional[asyncio.Task] = None
+        
+        # Автомат ключевых слов и индекс «чат → кампании» активных кампаний
+        self.keyword_matcher = KeywordMatcher()
+        self.chat_index = ChatIndex()
+        self.campaigns_by_id: Dict[int, CampaignSnapshot] = {}
+        
+        # Пул воркеров для параллельной обработки сработавших кампаний
+        self.trigger_pipeline = TriggerPipeline(
+            self.process_trigger_job if self.mode == "worker" else self.process_campaign_trigger
+        )
+        
+        # Очередь триггеров в БД: между процессами приема и воркерами, в режиме all -
+        # журнал триггеров для досылки после перезапуска (DURABLE_TRIGGERS)
+        self.trigger_queue = TriggerQueue()
+        self.durable_triggers = self.mode != "all" or os.getenv("DURABLE_TRIGGERS", "True").lower() == "true"
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.worker_partitions = worker_partitions(
+            self.trigger_queue.partitions,
+            int(os.getenv("WORKER_INDEX", "0")),
+            int(os.getenv("WORKER_COUNT", "1"))
+        )
+        self._trigger_queue_task: Optional[asyncio.Task] = None
+        
+        # Фоновая пакетная запись логов активности
+        self.activity_log_writer = ActivityLogWriter()
+        
+        # Лимиты частоты ответов на кампанию, чат и аккаунт
+        self.rate_limiter = ReplyRateLimiter()
+        
+        # Очередь исходящих сообщений основного аккаунта с учетом FloodWait
+        self.send_scheduler = self.client_pool.primary.send_scheduler
+        
+        # Кэш ответов на повторяющиеся вопросы (включается в настройках кампании)
+        self.response_cache = ResponseCache()
+        
+        # Объединение всплесков триггеров в чате (окно задается в настройках кампании)
+        self.trigger_coalescer = TriggerCoalescer()
+        
+        # Недавно обработанные триггеры: повторы отбрасываются до генерации ответа
+        self.recent_triggers = RecentKeys()
+        
+        # Последние сообщения отслеживаемых чатов для контекста без запросов к Telegram
+        self.message_buffer = MessageBuffer()
+        
+        # Позиции обработки чатов для догрузки сообщений, пропущенных за время отключения
+        self.chat_cursors = ChatCursors()
+        self._catch_up_lock = asyncio.Lock()
         
         print("🤖 Telegram Agent инициализирован")
     
     async def initialize(self):
         """Инициализация соединения с Telegram"""
         try:
-            await self.client.start(phone=self.phone)
-            print(f"✅ Подключен к Telegram как {self.phone}")
+            # Дополнительные аккаунты из настроек компании
+            db = SessionLocal()
+            try:
+                self.client_pool.add_company_accounts(load_company_accounts(db))
+            except Exception as e:
+                print(f"⚠️ Не удалось загрузить аккаунты компании: {e}")
+            finally:
+                db.close()
+            
+            # Позиции чатов до перезапуска - граница догрузки пропущенных сообщений
+            catch_up_positions = {}
+            if self.mode != "worker":
+                try:
+                    await self.chat_cursors.load()
+                    catch_up_positions = self.chat_cursors.snapshot()
+                except Exception as e:
+                    print(f"⚠️ Не удалось загрузить позиции чатов: {e}")
+                self.chat_cursors.start()
             
-            # Регистрация обработчиков событий
-            self.client.add_event_handler(self.handle_new_message, events.NewMessage)
+            # Запуск воркеров, подключение аккаунтов и регистрация обработчиков событий
+            self.trigger_pipeline.start()
+            self.activity_log_writer.start()
+            await self.client_pool.start([] if self.mode == "worker" else [
+                (self.handle_new_message, events.NewMessage),
+                (self.handle_edited_message, events.MessageEdited),
+            ])
+            if self.mode != "worker":
+                for account in self.client_pool.started_accounts:
+                    account.client.on_reconnect(self._on_reconnect)
             
             # Загрузка активных кампаний
-            await self.refresh_campaigns_cache()
+            await self.refresh_campaigns_cache(force=True)
+            
+            # Досылка триггеров, не обработанных до перезапуска
+            if self.mode == "all" and self.durable_triggers:
+                asyncio.create_task(self._recover_triggers(await self.trigger_queue.last_id()))
+            elif self.mode == "all":
+                # Без журнала в очереди только резервы ключей триггеров
+                asyncio.create_task(self._purge_trigger_queue())
+            
+            # Фоновая проверка изменений, сделанных в обход API
+            self._campaigns_watch_task = asyncio.create_task(self._watch_campaigns_version())
+            
+            # Воркер забирает триггеры своих разделов очереди
+            if self.mode == "worker":
+                self._trigger_queue_task = asyncio.create_task(self._consume_trigger_queue())
+                print(f"👷 Воркер {self.worker_id}: разделы очереди {self.worker_partitions}")
+            
+            # Распределение чатов между аккаунтами (с прогревом кэша сущностей),
+            # затем догрузка сообщений, пропущенных за время остановки
+            asyncio.create_task(self._sync_chats(catch_up_positions))
             
             return True
             
@@ -136,114 +198,497 @@ class TelegramAgent:
     
     async def disconnect(self):
         """Отключение от Telegram"""
-        if self.client.is_connected():
-            await self.client.disconnect()
+        if self._campaigns_watch_task:
+            self._campaigns_watch_task.cancel()
+            self._campaigns_watch_task = None
+        
+        if self._trigger_queue_task:
+            self._trigger_queue_task.cancel()
+            self._trigger_queue_task = None
+        
+        # Дожидаемся уже принятых триггеров, пока клиент подключен
+        await self.trigger_coalescer.stop()
+        await self.trigger_pipeline.stop()
+        
+        # Записываем оставшиеся логи активности и позиции чатов
+        await self.activity_log_writer.stop()
+        await self.chat_cursors.stop()
+        
+        # После отключения буферы могут пропустить сообщения
+        self.message_buffer.clear()
+        
+        # Закрываем общий пул HTTP соединений AI провайдеров
+        await close_http_client()
+        
+        if self.client_pool.is_connected():
+            await self.client_pool.stop()
             print("👋 Отключен от Telegram")
     
     def is_connected(self) -> bool:
         """Проверка соединения с Telegram"""
-        return self.client.is_connected()
+        return self.client_pool.is_connected()
     
-    async def refresh_campaigns_cache(self, force: bool = False):
-        """Обновление кэша активных кампаний"""
-        current_time = time.time()
-        
-        # Проверка TTL кэша или принудительного обновления
-        if not force and not self.force_refresh and current_time - self.last_cache_update < self.cache_ttl:
-            return
-        
+    def get_prompt_cache_stats(self) -> Dict:
+        """Попадания в кэш префикса промпта по кампаниям"""
+        return prompt_cache_stats.to_dict()
+    
+    def get_message_buffer_stats(self) -> Dict:
+        """Заполненность буферов контекста и доля контекстов из памяти"""
+        return self.message_buffer.stats()
+    
+    def get_recent_triggers_stats(self) -> Dict:
+        """Отброшенные повторы триггеров"""
+        return self.recent_triggers.stats()
+    
+    def get_coalescer_stats(self) -> Dict:
+        """Открытые окна и число объединенных триггеров"""
+        return self.trigger_coalescer.stats()
+    
+    def get_response_cache_stats(self) -> Dict:
+        """Доля ответов из кэша и сэкономленное время генерации"""
+        return self.response_cache.stats()
+    
+    def get_send_scheduler_stats(self) -> Dict:
+        """Глубина очереди отправки, ожидание и FloodWait"""
+        return self.send_scheduler.stats()
+    
+    def get_catch_up_stats(self) -> Dict:
+        """Сохраненные позиции чатов для догрузки после переподключения"""
+        return self.chat_cursors.stats()
+    
+    def get_trigger_queue_stats(self) -> Dict:
+        """Публикации и обработка очереди триггеров (режимы ingest и worker)"""
+        return {"mode": self.mode, "durable": self.durable_triggers, **self.trigger_queue.stats()}
+    
+    def get_client_pool_stats(self) -> Dict:
+        """Аккаунты пула, распределение чатов и их очереди отправки"""
+        return self.client_pool.stats()
+    
+    def get_rate_limiter_stats(self) -> Dict:
+        """Разрешенные и подавленные лимитами ответы"""
+        return self.rate_limiter.stats()
+    
+    def get_entity_cache_stats(self) -> Dict:
+        """Размер и доля попаданий кэша сущностей чатов"""
+        return entity_cache.stats()
+    
+    async def _assign_chats(self):
+        """Распределение отслеживаемых чатов между аккаунтами и заполнение кэша сущностей из диалогов"""
         try:
-            db = SessionLocal()
-            campaigns = db.query(Campaign).filter(Campaign.active == True).all()
-            self.active_campaigns = campaigns
-            self.last_cache_update = current_time
-            self.force_refresh = False  # Сбрасываем флаг
-            
-            print(f"🔄 Кэш кампаний обновлен: {len(campaigns)} активных кампаний")
-            
+            count = await self.client_pool.assign_chats(
+                self.chat_index,
+                dialogs_limit=int(os.getenv("ENTITY_CACHE_DIALOGS", "500"))
+            )
+            print(f"📇 Отслеживаемые чаты распределены между аккаунтами: {count}")
         except Exception as e:
-            print(f"❌ Ошибка обновления кэша кампаний: {e}")
-        finally:
-            db.close()
+            print(f"⚠️ Не удалось распределить чаты из диалогов: {e}")
+    
+    async def _sync_chats(self, catch_up_positions: Dict[int, int]):
+        """Распределение чатов между аккаунтами, затем догрузка пропущенных сообщений"""
+        await self._assign_chats()
+        if catch_up_positions:
+            await self._catch_up_missed(catch_up_positions)
+    
+    def _on_reconnect(self):
+        """Переподключение аккаунта: позиции чатов на момент разрыва и догрузка пропуска"""
+        # Буферы контекста могли пропустить сообщения
+        self.message_buffer.clear()
+        asyncio.create_task(self._catch_up_missed(self.chat_cursors.snapshot()))
+    
+    async def _catch_up_missed(self, positions: Dict[int, int]):
+        """Догрузка сообщений отслеживаемых чатов новее позиций через обычный обработчик"""
+        if self._catch_up_lock.locked():
+            # Догрузка уже идет (переподключились несколько аккаунтов сразу)
+            return
+        async with self._catch_up_lock:
+            try:
+                positions = {
+                    chat_id: message_id
+                    for chat_id, message_id in positions.items()
+                    if self.chat_index.lookup(chat_id)
+                }
+                count = await catch_up(positions, self.client_pool.client_for_chat, self.handle_new_message)
+                if count:
+                    print(f"📥 Догружено пропущенных сообщений: {count} (чатов: {len(positions)})")
+            except Exception as e:
+                print(f"❌ Ошибка догрузки пропущенных сообщений: {e}")
+    
+    async def refresh_campaigns_cache(self, force: bool = False):
+        """Перестроение кэша активных кампаний, если их версия в БД изменилась"""
+        async with self._campaigns_refresh_lock:
+            db = None
+            try:
+                db = SessionLocal()
+                version = get_campaigns_version(db)
+                
+                # Индексы перестраиваются только при реальных изменениях
+                if not force and version == self.campaigns_version:
+                    return
+                
+                campaigns = load_active_campaigns(db)
+                self.active_campaigns = campaigns
+                self.keyword_matcher = KeywordMatcher(campaigns)
+                self.chat_index = ChatIndex(campaigns)
+                self.campaigns_by_id = {campaign.id: campaign for campaign in campaigns}
+                self.message_buffer.resize(
+                    max((campaign.context_messages_count for campaign in campaigns), default=0)
+                )
+                self.campaigns_version = version
+                self.last_cache_update = time.time()
+                
+                print(f"🔄 Кэш кампаний обновлен: {len(campaigns)} активных кампаний, "
+                      f"{self.keyword_matcher.keywords_count} ключевых слов")
+                
+            except Exception as e:
+                print(f"❌ Ошибка обновления кэша кампаний: {e}")
+            finally:
+                if db is not None:
+                    db.close()
+    
+    async def _watch_campaigns_version(self):
+        """Фоновая проверка версии кампаний (изменения, сделанные в обход API)"""
+        while True:
+            await asyncio.sleep(self.cache_ttl)
+            await self.refresh_campaigns_cache()
     
     def force_campaigns_refresh(self):
-        """Установка флага принудительного обновления кэша"""
-        self.force_refresh = True
-        print("🔄 Запланировано принудительное обновление кэша кампаний")
+        """Немедленное обновление кэша после изменения кампаний через API"""
+        try:
+            loop = asyncio.get_running_loop()
+            self._campaigns_refresh_task = loop.create_task(self.refresh_campaigns_cache(force=True))
+            print("🔄 Запущено обновление кэша кампаний")
+        except RuntimeError:
+            # Нет запущенного event loop - обновится при следующей фоновой проверке
+            self.campaigns_version = None
+            print("🔄 Запланировано принудительное обновление кэша кампаний")
     
     async def handle_new_message(self, event):
         """Обработчик новых сообщений"""
         try:
             message: Message = event.message
             
-            # Обновление кэша при необходимости
-            await self.refresh_campaigns_cache()
+            # Чат обрабатывает только аккаунт-владелец (остальные получают те же события)
+            if not self.client_pool.owns_chat(event.client, event.chat_id):
+                return
+            messages_received.inc()
             
-            # Поиск подходящих кампаний
-            matching_campaigns = await self.find_matching_campaigns(message)
+            # Сущность чата из события сохраняется для логов и API (только основного
+            # аккаунта: access_hash сущности действителен лишь для получившего ее аккаунта)
+            chat = getattr(event, 'chat', None)
+            if chat is not None and event.client is self.client:
+                entity_cache.put(chat)
             
-            # Обработка каждой подходящей кампании
-            for campaign in matching_campaigns:
-                await self.process_campaign_trigger(campaign, message)
+            # Сообщения отслеживаемых чатов копятся в буфере контекста и сдвигают позицию чата
+            if self.chat_index.lookup(self._peer_chat_id(message), getattr(chat, 'username', None)):
+                self.message_buffer.add(event.chat_id, message)
+                self.chat_cursors.advance(event.chat_id, message.id)
+            
+            # Поиск подходящих кампаний (event.chat берется из кэша Telethon без запроса)
+            match_started = time.perf_counter()
+            matching_campaigns = await self.find_matching_campaigns(message, chat)
+            match_time = time.perf_counter() - match_started
+            
+            # Всплески триггеров чата объединяются в окне кампании (если оно задано)
+            for campaign, keyword in matching_campaigns:
+                keyword_matches_total.inc(campaign=campaign.id)
+                
+                # Повтор того же сообщения (повтор обновлений после переподключения) - без генерации
+                if not self.recent_triggers.add((event.chat_id, message.id, campaign.id)):
+                    continue
+                
+                await self.trigger_coalescer.add(
+                    (event.chat_id, campaign.id),
+                    coalesce_window(campaign),
+                    (campaign, message, keyword, StageTimings(match=match_time)),
+                    self._dispatch_trigger
+                )
                 
         except Exception as e:
             print(f"❌ Ошибка обработки сообщения: {e}")
     
-    async def find_matching_campaigns(self, message: Message) -> List[Campaign]:
-        """Поиск кампаний, которые должны отреагировать на сообщение"""
-        matching_campaigns = []
+    async def _dispatch_trigger(self, trigger_key: Tuple, triggers: List[Tuple[CampaignSnapshot, Message, str, StageTimings]]):
+        """Постановка триггера (последнего из объединенных) в пул воркеров"""
+        campaign, message, keyword, timings = triggers[-1]
         
-        # Получение ID чата
-        chat_id = str(message.peer_id.channel_id if hasattr(message.peer_id, 'channel_id') 
-                     else message.peer_id.chat_id if hasattr(message.peer_id, 'chat_id')
-                     else message.peer_id.user_id)
+        # Более ранние триггеры всплеска получают общий ответ на последний
+        for _, merged_message, merged_keyword, _ in triggers[:-1]:
+            await self.log_activity(
+                campaign,
+                merged_message,
+                [],
+                "",
+                "coalesced",
+                error_message=f"Объединено с сообщением {message.id}",
+                trigger_keyword=merged_keyword
+            )
+        
+        # Лимиты частоты ответов проверяются до генерации (без затрат токенов)
+        limited_scope = self.rate_limiter.acquire(
+            campaign, trigger_key[0], self.client_pool.account_for_campaign(campaign).name
+        )
+        if limited_scope:
+            await self.log_activity(
+                campaign,
+                message,
+                [],
+                "",
+                "rate_limited",
+                error_message=f"Превышен лимит ответов ({limited_scope})",
+                trigger_keyword=keyword
+            )
+            return
         
-        # Текст сообщения
-        message_text = message.text.lower() if message.text else ""
+        # Ключ триггера резервируется в БД до генерации ответа (с журналом - в очереди)
+        job_id = None
+        try:
+            job_id = await self.trigger_queue.publish(
+                trigger_key[0],
+                message.id,
+                campaign.id,
+                account=self.client_pool.account_for_message(message).name,
+                trigger_keyword=keyword,
+                coalesced_message_ids=[merged_message.id for _, merged_message, _, _ in triggers[:-1]],
+                status="queued" if self.durable_triggers else "reserved"
+            )
+        except Exception as e:
+            if self.mode == "ingest":
+                raise
+            print(f"⚠️ Триггер не записан в очередь, обработка без журнала: {e}")
+        else:
+            # Повтор уже обработанного триггера (досылка, перезапуск) не генерирует ответ
+            if job_id is None:
+                print(f"♻️ Повтор триггера пропущен: сообщение {message.id}, кампания '{campaign.name}'")
+                return
+            # Процесс приема только публикует
+            if self.mode == "ingest":
+                return
         
-        for campaign in self.active_campaigns:
-            # Проверка чатов
-            if not self.is_chat_monitored(chat_id, campaign.telegram_chats):
-                continue
-            
-            # Проверка ключевых слов
-            if not self.contains_keywords(message_text, campaign.keywords):
-                continue
+        # Постановка в пул воркеров: порядок сохраняется внутри чата и кампании
+        await self.trigger_pipeline.submit(
+            trigger_key,
+            campaign,
+            message,
+            trigger_keyword=keyword,
+            coalesced_messages=[merged_message for _, merged_message, _, _ in triggers[:-1]],
+            job_id=job_id,
+            timings=timings
+        )
+    
+    async def _purge_trigger_queue(self):
+        """Удаление завершенных триггеров и старых резервов ключей"""
+        try:
+            await self.trigger_queue.purge()
+        except Exception as e:
+            print(f"⚠️ Не удалось удалить завершенные триггеры: {e}")
+    
+    async def _consume_trigger_queue(self):
+        """Аренда триггеров своих разделов очереди по мере освобождения пула (режим worker)"""
+        poll_interval = float(os.getenv("TRIGGER_POLL_INTERVAL", "1"))
+        await self._purge_trigger_queue()
+        while True:
+            try:
+                capacity = min(
+                    self.trigger_pipeline.max_pending - self.trigger_pipeline.pending,
+                    self.trigger_pipeline.concurrency * 2
+                )
+                jobs = await self.trigger_queue.claim(self.worker_id, self.worker_partitions, capacity)
+                for job in jobs:
+                    await self.trigger_pipeline.submit((job["chat_id"], job["campaign_id"]), job)
+                if jobs:
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка чтения очереди триггеров: {e}")
+            await asyncio.sleep(poll_interval)
+    
+    async def _load_trigger_job(self, job: Dict) -> Optional[Tuple[CampaignSnapshot, Message, List[Message]]]:
+        """
+        Кампания и сообщения триггера из очереди.
+        
+        Устаревший (старше предела кампании), повторный или неактуальный
+        триггер снимается с очереди - возвращается None.
+        """
+        campaign = self.campaigns_by_id.get(job["campaign_id"])
+        trigger_key = (job["chat_id"], job["message_id"], job["campaign_id"])
+        if campaign is None or trigger_key in self.recent_triggers:
+            await self.trigger_queue.complete(job["id"])
+            return None
+        if job["age"] > trigger_max_age(campaign):
+            await self.trigger_queue.complete(job["id"], status="expired")
+            return None
+        
+        # Сообщения читаются аккаунтом, получившим их (ID сообщений могут различаться)
+        account = self.client_pool.accounts.get(job["account"]) or self.client_pool.primary
+        messages = await account.client.get_messages(
+            job["chat_id"],
+            ids=[*job["coalesced_message_ids"], job["message_id"]]
+        )
+        if messages[-1] is None:
+            # Сообщение удалено
+            await self.trigger_queue.complete(job["id"])
+            return None
+        
+        self.recent_triggers.add(trigger_key)
+        return campaign, messages[-1], [message for message in messages[:-1] if message is not None]
+    
+    async def process_trigger_job(self, job: Dict):
+        """Обработка триггера из очереди: загрузка сообщений и обычная обработка кампании"""
+        # Ошибка загрузки оставляет триггер в аренде - он вернется в очередь
+        loaded = await self._load_trigger_job(job)
+        if loaded is None:
+            return
+        campaign, trigger_message, coalesced_messages = loaded
+        await self.process_campaign_trigger(
+            campaign,
+            trigger_message,
+            trigger_keyword=job["trigger_keyword"],
+            coalesced_messages=coalesced_messages,
+            job_id=job["id"]
+        )
+    
+    async def _recover_triggers(self, max_id: int):
+        """Досылка записанных до перезапуска триггеров (режим all); устаревшие снимаются"""
+        recovered = 0
+        try:
+            while True:
+                jobs = await self.trigger_queue.claim(
+                    self.worker_id,
+                    range(self.trigger_queue.partitions),
+                    self.trigger_pipeline.concurrency * 2,
+                    max_id=max_id
+                )
+                if not jobs:
+                    break
+                for job in jobs:
+                    try:
+                        loaded = await self._load_trigger_job(job)
+                    except Exception as e:
+                        print(f"⚠️ Триггер {job['id']} не восстановлен: {e}")
+                        continue
+                    if loaded is None:
+                        continue
+                    campaign, trigger_message, coalesced_messages = loaded
+                    await self.trigger_pipeline.submit(
+                        (job["chat_id"], job["campaign_id"]),
+                        campaign,
+                        trigger_message,
+                        trigger_keyword=job["trigger_keyword"],
+                        coalesced_messages=coalesced_messages,
+                        job_id=job["id"]
+                    )
+                    recovered += 1
             
-            matching_campaigns.append(campaign)
+            purged = await self.trigger_queue.purge()
+            if recovered or purged:
+                print(f"♻️ Восстановлено триггеров после перезапуска: {recovered}, удалено завершенных: {purged}")
+        except Exception as e:
+            print(f"❌ Ошибка восстановления триггеров: {e}")
+    
+    async def handle_edited_message(self, event):
+        """Обновление отредактированного сообщения в буфере контекста"""
+        if self.client_pool.owns_chat(event.client, event.chat_id):
+            self.message_buffer.update(event.chat_id, event.message)
+    
+    @staticmethod
+    def _peer_chat_id(message: Message) -> int:
+        """ID чата сообщения без маркировки"""
+        return (message.peer_id.channel_id if hasattr(message.peer_id, 'channel_id') 
+                else message.peer_id.chat_id if hasattr(message.peer_id, 'chat_id')
+                else message.peer_id.user_id)
+    
+    async def find_matching_campaigns(self, message: Message, chat=None) -> List[Tuple[CampaignSnapshot, str]]:
+        """Поиск кампаний, которые должны отреагировать на сообщение (кампания, ключевое слово)"""
+        # Неотслеживаемые чаты отклоняются одним поиском в индексе
+        campaign_ids = self.chat_index.lookup(self._peer_chat_id(message), getattr(chat, 'username', None))
+        if not campaign_ids:
+            messages_rejected.inc()
+            return []
+        
+        # Один проход автомата по тексту вместо перебора кампаний и ключевых слов
+        matched = self.keyword_matcher.match(message.text, campaign_ids=campaign_ids)
         
-        return matching_campaigns
+        return [
+            (self.campaigns_by_id[campaign_id], keyword)
+            for campaign_id, keyword in matched.items()
+            if campaign_id in self.campaigns_by_id
+        ]
     
     def is_chat_monitored(self, chat_id: str, monitored_chats: List[str]) -> bool:
         """Проверка, отслеживается ли чат в кампании"""
-        return chat_id in monitored_chats or any(
-            chat.startswith('@') and chat[1:] in chat_id for chat in monitored_chats
-        )
+        numeric_id = normalize_chat_id(chat_id)
+        username = normalize_username(chat_id) if numeric_id is None else None
+        for chat in split_chats(monitored_chats):
+            if numeric_id is not None and normalize_chat_id(chat) == numeric_id:
+                return True
+            if username and normalize_username(chat) == username:
+                return True
+        return False
     
     def contains_keywords(self, text: str, keywords: List[str]) -> bool:
         """Проверка наличия ключевых слов в тексте"""
-        return any(keyword.lower() in text for keyword in keywords)
+        text = text.lower()
+        return any(keyword.strip().lower() in text for keyword in keywords)
     
-    async def process_campaign_trigger(self, campaign: Campaign, trigger_message: Message):
-        """Обработка триггера кампании"""
+    async def process_campaign_trigger(
+        self,
+        campaign: CampaignSnapshot,
+        trigger_message: Message,
+        trigger_keyword: Optional[str] = None,
+        coalesced_messages: Optional[List[Message]] = None,
+        job_id: Optional[int] = None,
+        timings: Optional[StageTimings] = None,
+        source: str = "auto"
+    ):
+        """
+        Обработка триггера кампании.
+
+        source - происхождение триггера: "auto" (ключевое слово) или "manual"
+        (принудительный запуск из API, пишется в лог отдельной записью).
+        """
         start_time = time.time()
+        # Триггеры из очереди (режим worker, досылка) приходят без замера поиска
+        timings = timings or StageTimings()
         
         try:
             # Получение контекста предыдущих сообщений
-            context_messages = await self.get_context_messages(
-                trigger_message,
-                campaign.context_messages_count
-            )
+            with timings.measure("context"):
+                context_messages = await self.get_context_messages(
+                    trigger_message,
+                    campaign.context_messages_count
+                )
             
-            # Генерация ответа через Claude
-            response = await self.generate_response(
-                campaign,
-                trigger_message,
-                context_messages
-            )
+            # Объединенные с этим триггеры всплеска всегда попадают в контекст
+            if coalesced_messages:
+                known_ids = {message["id"] for message in context_messages}
+                context_messages = sorted(
+                    context_messages + [
+                        message_record(message) for message in coalesced_messages if message.id not in known_ids
+                    ],
+                    key=lambda message: message["id"],
+                    reverse=True
+                )
             
-            # Отправка ответа
-            await self.send_response(trigger_message, response)
+            if self.streaming_responses:
+                # Потоковая генерация с ранней отправкой и правками на месте
+                response = await self.stream_response(
+                    campaign,
+                    trigger_message,
+                    context_messages,
+                    timings
+                )
+            else:
+                # Генерация ответа через AI провайдер
+                response = await self.generate_response(
+                    campaign,
+                    trigger_message,
+                    context_messages,
+                    timings
+                )
+                
+                # Отправка ответа
+                with timings.measure("send"):
+                    await self.send_response(trigger_message, response, campaign)
             
             # Логирование успешного ответа
             processing_time = int((time.time() - start_time) * 1000)
@@ -253,83 +698,140 @@ class TelegramAgent:
                 context_messages,
                 response,
                 "sent",
-                processing_time=processing_time
+                processing_time=processing_time,
+                trigger_keyword=trigger_keyword,
+                timings=timings,
+                source=source
             )
             
             print(f"✅ Ответ отправлен для кампании '{campaign.name}'")
+            job_status = "done"
             
         except Exception as e:
-            # Логирование ошибки
+            # Логирование ошибки (с частью ответа, если она уже в чате)
             processing_time = int((time.time() - start_time) * 1000)
             await self.log_activity(
                 campaign,
                 trigger_message,
                 [],
-                "",
+                e.delivered if isinstance(e, StreamInterruptedError) else "",
                 "failed",
                 error_message=str(e),
-                processing_time=processing_time
+                processing_time=processing_time,
+                trigger_keyword=trigger_keyword,
+                timings=timings,
+                source=source
             )
             
             print(f"❌ Ошибка обработки кампании '{campaign.name}': {e}")
+            # Повтор продублировал бы уже отправленную часть ответа
+            job_status = "done" if isinstance(e, StreamInterruptedError) and e.delivered else "failed"
+        
+        # Триггер обработан - снимаем с очереди; неудачную попытку можно повторить
+        if job_id is not None:
+            await self.trigger_queue.complete(job_id, job_status)
     
     async def get_context_messages(self, trigger_message: Message, count: int) -> List[Dict]:
-        """Получение контекста предыдущих сообщений"""
+        """Получение контекста предыдущих сообщений (из буфера, при промахе - из Telegram)"""
+        if count <= 0:
+            return []
+        
+        chat_key = get_peer_id(trigger_message.peer_id)
+        context = self.message_buffer.get_context(chat_key, trigger_message.id, count)
+        if context is not None:
+            return context
+        
         try:
-            # Получение предыдущих сообщений
+            # Холодный старт или пропуск в буфере - запрос предыдущих сообщений
             messages = []
-            async for message in self.client.iter_messages(
+            client = self.client_pool.account_for_message(trigger_message).client
+            async for message in client.iter_messages(
                 trigger_message.peer_id,
                 limit=count + 1,
                 max_id=trigger_message.id
             ):
                 if message.id != trigger_message.id:
-                    messages.append({
-                        "id": message.id,
-                        "text": message.text or "",
-                        "date": message.date.isoformat(),
-                        "from_user": str(message.from_id) if message.from_id else "unknown"
-                    })
+                    messages.append(message)
             
-            return messages[:count]  # Обрезаем до нужного количества
+            # Полученная история вместе с триггером делает буфер чата непрерывным
+            self.message_buffer.seed(chat_key, [*messages, trigger_message])
+            
+            return [message_record(message) for message in messages[:count]]  # Обрезаем до нужного количества
             
         except Exception as e:
             print(f"❌ Ошибка получения контекста: {e}")
             return []
     
-    async def generate_response(
+    def _select_ai_provider(self, campaign: CampaignSnapshot) -> str:
+        """Выбор AI провайдера кампании с fallback на доступный"""
+        ai_provider = campaign.ai_provider
+        
+        if ai_provider == "openai" and self.openai_client:
+            return "openai"
+        if ai_provider == "claude" and self.claude_client:
+            return "claude"
+        
+        # Fallback на доступный провайдер
+        if self.openai_client:
+            print(f"⚠️ Fallback на OpenAI (Claude недоступен)")
+            return "openai"
+        if self.claude_client:
+            print(f"⚠️ Fallback на Claude (OpenAI недоступен)")
+            return "claude"
+        raise Exception("Ни один AI провайдер не доступен")
+    
+    def _build_prompt(
         self,
-        campaign: Campaign,
+        campaign: CampaignSnapshot,
         trigger_message: Message,
         context_messages: List[Dict]
     ) -> str:
-        """Генерация ответа через выбранный AI провайдер"""
-        
-        # Определяем AI провайдера
-        ai_provider = getattr(campaign, 'ai_provider', 'claude')
-        
-        try:
-            if ai_provider == "openai" and self.openai_client:
-                response = await self._generate_with_openai(campaign, trigger_message, context_messages)
-            elif ai_provider == "claude" and self.claude_client:
-                response = await self._generate_with_claude(campaign, trigger_message, context_messages)
-            else:
-                # Fallback на доступный провайдер
-                if self.openai_client:
-                    print(f"⚠️ Fallback на OpenAI (Claude недоступен)")
-                    response = await self._generate_with_openai(campaign, trigger_message, context_messages)
-                elif self.claude_client:
-                    print(f"⚠️ Fallback на Claude (OpenAI недоступен)")
-                    response = await self._generate_with_claude(campaign, trigger_message, context_messages)
-                else:
-                    raise Exception("Ни один AI провайдер не доступен")
-            
-            # Сохранение в память Zep
+        """Переменный блок промпта (статичный системный блок хранится в снимке кампании)"""
+        context_text = "\n".join([f"[{msg['date']}] {msg['text']}" for msg in context_messages])
+        return campaign.build_user_prompt(context_text, trigger_message.text)
+    
+    @staticmethod
+    def _context_key(context_messages: List[Dict]) -> str:
+        """Хэш контекста для кэша ответов"""
+        return context_hash(message["text"] for message in context_messages)
+    
+    async def _remember_interaction(self, campaign: CampaignSnapshot, trigger_message: Message, response: str):
+        """Сохранение в память Zep (если менеджер памяти подключен)"""
+        if self.memory_manager:
             await self.memory_manager.add_interaction(
                 session_id=f"campaign_{campaign.id}_chat_{trigger_message.peer_id}",
                 message=trigger_message.text,
                 response=response
             )
+    
+    async def generate_response(
+        self,
+        campaign: CampaignSnapshot,
+        trigger_message: Message,
+        context_messages: List[Dict],
+        timings: Optional[StageTimings] = None
+    ) -> str:
+        """Генерация ответа через выбранный AI провайдер"""
+        try:
+            # Повторяющийся вопрос - ответ из кэша без обращения к AI (если кэш включен для кампании)
+            context_key = self._context_key(context_messages)
+            cached_response = self.response_cache.lookup(campaign, trigger_message.text, context_key)
+            if cached_response is not None:
+                return cached_response
+            
+            timings = timings or StageTimings()
+            started = time.monotonic()
+            if self._select_ai_provider(campaign) == "openai":
+                response = await self._generate_with_openai(campaign, trigger_message, context_messages, timings)
+            else:
+                response = await self._generate_with_claude(campaign, trigger_message, context_messages, timings)
+            
+            if not is_error_response(response):
+                self.response_cache.store(
+                    campaign, trigger_message.text, context_key, response, time.monotonic() - started
+                )
+            
+            await self._remember_interaction(campaign, trigger_message, response)
             
             return response
             
@@ -337,109 +839,170 @@ class TelegramAgent:
             print(f"❌ Ошибка генерации ответа: {e}")
             return "Извините, произошла ошибка при генерации ответа."
     
-    async def _generate_with_claude(
+    async def stream_response(
         self,
-        campaign: Campaign,
+        campaign: CampaignSnapshot,
         trigger_message: Message,
-        context_messages: List[Dict]
+        context_messages: List[Dict],
+        timings: Optional[StageTimings] = None
     ) -> str:
-        """Генерация ответа через Claude"""
+        """Потоковая генерация: отправка после первой фразы и правки сообщения на месте"""
+        timings = timings or StageTimings()
+        context_key = self._context_key(context_messages)
+        cached_response = self.response_cache.lookup(campaign, trigger_message.text, context_key)
+        if cached_response is not None:
+            with timings.measure("send"):
+                await self.send_response(trigger_message, cached_response, campaign)
+            return cached_response
         
-        # Формирование промпта для Claude
-        context_text = "\n".join([f"[{msg['date']}] {msg['text']}" for msg in context_messages])
-        
-        prompt = f"""
-Системная инструкция: {campaign.system_instruction}
-
-Контекст предыдущих сообщений:
-{context_text}
-
-Сообщение-триггер: {trigger_message.text}
-
-Примеры ответов: {campaign.example_replies if campaign.example_replies else 'Нет примеров'}
-
-Сгенерируй подходящий ответ на основе контекста и системной инструкции.
-"""
+        started = time.monotonic()
+        with timings.measure("prompt"):
+            prompt = self._build_prompt(campaign, trigger_message, context_messages)
+        if self._select_ai_provider(campaign) == "openai":
+            chunks = self.openai_client.stream_response(
+                prompt,
+                system=campaign.system_prompt,
+                cache_key=campaign.id,
+                model=campaign.openai_model
+            )
+        else:
+            chunks = self.claude_client.stream_response(
+                prompt,
+                system=campaign.system_prompt,
+                cache_key=campaign.id
+            )
         
-        return await self.claude_client.generate_response(
-            prompt,
-            campaign.claude_agent_id
+        # Отправка и правки идут между фрагментами: ожидание LLM и Telegram замеряются раздельно
+        response = await stream_reply(
+            timings.stream(chunks),
+            send=timings.timed("send", lambda text: self.send_response(trigger_message, text, campaign)),
+            edit=timings.timed("send", self._edit_response)
         )
+        
+        if not is_error_response(response):
+            self.response_cache.store(
+                campaign, trigger_message.text, context_key, response, time.monotonic() - started
+            )
+        
+        await self._remember_interaction(campaign, trigger_message, response)
+        
+        return response
+    
+    async def _generate_with_claude(
+        self,
+        campaign: CampaignSnapshot,
+        trigger_message: Message,
+        context_messages: List[Dict],
+        timings: StageTimings
+    ) -> str:
+        """Генерация ответа через Claude"""
+        with timings.measure("prompt"):
+            prompt = self._build_prompt(campaign, trigger_message, context_messages)
+        
+        with timings.measure_llm():
+            return await self.claude_client.generate_response(
+                prompt,
+                system=campaign.system_prompt,
+                cache_key=campaign.id
+            )
     
     async def _generate_with_openai(
         self,
-        campaign: Campaign,
+        campaign: CampaignSnapshot,
         trigger_message: Message,
-        context_messages: List[Dict]
+        context_messages: List[Dict],
+        timings: StageTimings
     ) -> str:
         """Генерация ответа через OpenAI"""
-        
-        # Используем специальный метод форматирования для OpenAI
-        prompt = self.openai_client.format_telegram_context(
-            system_instruction=campaign.system_instruction,
-            context_messages=context_messages,
-            trigger_message=trigger_message.text,
-            example_replies=campaign.example_replies
-        )
+        with timings.measure("prompt"):
+            prompt = self._build_prompt(campaign, trigger_message, context_messages)
         
         # Получаем модель OpenAI из кампании
-        openai_model = getattr(campaign, 'openai_model', 'gpt-4')
-        
-        return await self.openai_client.generate_response(
-            prompt,
-            model=openai_model
-        )
+        with timings.measure_llm():
+            return await self.openai_client.generate_response(
+                prompt,
+                system=campaign.system_prompt,
+                cache_key=campaign.id,
+                model=campaign.openai_model
+            )
     
-    async def send_response(self, original_message: Message, response: str):
-        """Отправка ответа в чат"""
+    async def send_response(
+        self,
+        original_message: Message,
+        response: str,
+        campaign: Optional[CampaignSnapshot] = None
+    ) -> Message:
+        """Отправка ответа в чат через аккаунт кампании (возвращает отправленное сообщение)"""
         try:
-            await self.client.send_message(
-                original_message.peer_id,
-                response,
-                reply_to=original_message.id
+            account = self.client_pool.account_for_campaign(campaign) if campaign else self.client_pool.primary
+            reply_to = original_message.id if self.client_pool.can_reply(account, original_message) else None
+            sent_message = await account.send_scheduler.send(
+                get_peer_id(original_message.peer_id),
+                lambda: account.client.send_message(
+                    original_message.peer_id,
+                    response,
+                    reply_to=reply_to
+                )
             )
+            # Собственные ответы не приходят событием - добавляем в контекст сами
+            self.message_buffer.add(get_peer_id(original_message.peer_id), sent_message)
+            return sent_message
         except Exception as e:
             print(f"❌ Ошибка отправки ответа: {e}")
             raise
     
+    async def _edit_response(self, sent_message: Message, text: str) -> Message:
+        """Правка отправленного ответа (с обновлением буфера контекста)"""
+        account = self.client_pool.account_for_message(sent_message)
+        edited_message = await account.send_scheduler.send(
+            get_peer_id(sent_message.peer_id),
+            lambda: account.client.edit_message(sent_message, text),
+            pace=False
+        )
+        self.message_buffer.update(get_peer_id(sent_message.peer_id), edited_message)
+        return edited_message
+    
     async def log_activity(
         self,
-        campaign: Campaign,
+        campaign: CampaignSnapshot,
         trigger_message: Message,
         context_messages: List[Dict],
         response: str,
         status: str,
         error_message: Optional[str] = None,
-        processing_time: Optional[int] = None
+        processing_time: Optional[int] = None,
+        trigger_keyword: Optional[str] = None,
+        timings: Optional[StageTimings] = None,
+        source: str = "auto"
     ):
-        """Логирование активности агента"""
+        """Логирование активности агента (запись в БД выполняет фоновый writer)"""
+        log_started = time.perf_counter()
         try:
-            db = SessionLocal()
-            
-            # Получение информации о чате
+            # Название чата из общего кэша сущностей (запрос к Telegram только при промахе);
+            # peer_id разрешается клиентом аккаунта, получившего сообщение
             chat_title = "Unknown"
             try:
-                entity = await self.client.get_entity(trigger_message.peer_id)
-                if hasattr(entity, 'title'):
-                    chat_title = entity.title
-                elif hasattr(entity, 'username'):
-                    chat_title = f"@{entity.username}"
-            except:
+                client = self.client_pool.account_for_message(trigger_message).client
+                entity = await entity_cache.get_entity(
+                    client, trigger_message.peer_id, store=client is self.client
+                )
+                chat_title = entity_title(entity)
+            except Exception:
                 pass
             
-            # Определение ключевого слова
-            trigger_keyword = "unknown"
-            if trigger_message.text:
-                message_text = trigger_message.text.lower()
-                for keyword in campaign.keywords:
-                    if keyword.lower() in message_text:
-                        trigger_keyword = keyword
-                        break
-            
-            # Создание записи лога
-            log_entry = ActivityLog(
+            # Определение ключевого слова (если не передано из автомата)
+            if not trigger_keyword:
+                matches = self.keyword_matcher.match(trigger_message.text, campaign_ids=[campaign.id])
+                trigger_keyword = matches.get(campaign.id, "unknown")
+            
+            # Этап log - подготовка записи на горячем пути (запись в БД - метрика log_write_seconds)
+            if timings is not None:
+                timings.add("log", time.perf_counter() - log_started)
+            
+            # Постановка записи лога в очередь на пакетную запись
+            self.activity_log_writer.write(
                 campaign_id=campaign.id,
-                chat_id=str(trigger_message.peer_id),
+                chat_id=str(get_peer_id(trigger_message.peer_id)),
                 chat_title=chat_title,
                 message_id=trigger_message.id,
                 trigger_keyword=trigger_keyword,
@@ -448,13 +1011,10 @@ class TelegramAgent:
                 agent_response=response,
                 status=status,
                 error_message=error_message,
-                processing_time_ms=processing_time
+                processing_time_ms=processing_time,
+                stage_timings=timings.to_dict() if timings is not None else None,
+                source=source
             )
             
-            db.add(log_entry)
-            db.commit()
-            
         except Exception as e:
-            print(f"❌ Ошибка логирования: {e}")
-        finally:
-            db.close()
\ No newline at end of file
+            print(f"❌ Ошибка логирования: {e}")
\ No newline at end of file
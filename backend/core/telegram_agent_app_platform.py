@@ -3,86 +3,49 @@ import os
 import time
 import base64
 import logging
-from typing import List, Dict, Optional
+from typing import List, Dict, FrozenSet, Optional, Tuple
 from datetime import datetime
 
 from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError
 from telethon.sessions import StringSession
 from telethon.tl.types import Message, User, Chat, Channel
 from telethon.tl.functions.channels import GetFullChannelRequest, JoinChannelRequest
+from telethon.utils import get_peer_id
 from sqlalchemy.orm import Session
 
 from database.models.base import SessionLocal
 from database.models.campaign import Campaign
-from database.models.log import ActivityLog
+from backend.core.keyword_matcher import KeywordMatcher
+from backend.core.ai_clients import SimpleClaudeClient, SimpleOpenAIClient, close_http_client, is_error_response
+from backend.core.chat_index import ChatIndex, normalize_chat_id, normalize_username
+from backend.core.campaign_cache import get_campaigns_version, load_active_campaigns
+from backend.core.campaign_snapshot import CampaignSnapshot
+from backend.core.trigger_pipeline import TriggerPipeline
+from backend.core.trigger_queue import TriggerQueue
+from backend.core.activity_log_writer import ActivityLogWriter
+from backend.core.streaming_reply import StreamInterruptedError, stream_reply
+from backend.core.prompt_cache import prompt_cache_stats
+from backend.core.entity_cache import entity_cache
+from backend.core.hot_path_log import HotPathLogger
+from backend.core.rate_limiter import ReplyRateLimiter
+from backend.core.send_scheduler import SendScheduler
+from backend.core.response_cache import ResponseCache, context_hash
+from backend.core.coalescer import TriggerCoalescer, coalesce_window
+from backend.core.recent_keys import RecentKeys
+from backend.core.catch_up import ChatCursors, ReconnectAwareClient, catch_up
+from backend.core.metrics import keyword_matches_total, messages_received, messages_rejected
+from backend.core.stage_timings import StageTimings
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
+hot_log = HotPathLogger(__name__)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# Встроенные AI клиенты (заменяют utils.*)
-class SimpleClaudeClient:
-    """Простой Claude клиент"""
-    def __init__(self):
-        try:
-            import anthropic
-            self.api_key = os.getenv("ANTHROPIC_API_KEY")
-            if self.api_key:
-                self.client = anthropic.Anthropic(api_key=self.api_key)
-                logger.info("Claude клиент инициализирован")
-            else:
-                self.client = None
-        except ImportError:
-            self.client = None
-            
-    async def generate_response(self, prompt: str, **kwargs) -> str:
-        if not self.client:
-            return "Claude недоступен - проверьте ANTHROPIC_API_KEY и установку anthropic"
-        try:
-            import asyncio
-            response = await asyncio.to_thread(
-                self.client.messages.create,
-                model="claude-3-sonnet-20240229",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.content[0].text
-        except Exception as e:
-            return f"Ошибка Claude: {e}"
-
-class SimpleOpenAIClient:
-    """Простой OpenAI клиент"""
-    def __init__(self):
-        try:
-            import openai
-            self.api_key = os.getenv("OPENAI_API_KEY")
-            if self.api_key:
-                self.client = openai.OpenAI(api_key=self.api_key)
-                logger.info("OpenAI клиент инициализирован")
-            else:
-                self.client = None
-        except ImportError:
-            self.client = None
-            
-    async def generate_response(self, prompt: str, **kwargs) -> str:
-        if not self.client:
-            return "OpenAI недоступен - проверьте OPENAI_API_KEY и установку openai"
-        try:
-            import asyncio
-            response = await asyncio.to_thread(
-                self.client.chat.completions.create,
-                model="gpt-4",
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"Ошибка OpenAI: {e}"
-
-# Проверка доступности AI провайдеров
+# Проверка доступности AI провайдеров (асинхронные клиенты - в backend.core.ai_clients)
 try:
     ClaudeClient = SimpleClaudeClient
     CLAUDE_AVAILABLE = True
@@ -120,11 +83,11 @@ class TelegramAgentAppPlatform:
         # Инициализация клиента с StringSession
         if self.session_string:
             session = StringSession(self.session_string)
-            self.client = TelegramClient(session, self.api_id, self.api_hash)
+            self.client = ReconnectAwareClient(session, self.api_id, self.api_hash)
             logger.info("TelegramClient инициализован с StringSession")
         else:
             # Fallback к файловой сессии для локальной разработки
-            self.client = TelegramClient("telegram_agent", self.api_id, self.api_hash)
+            self.client = ReconnectAwareClient("telegram_agent", self.api_id, self.api_hash)
             logger.warning("Используется файловая сессия (локальная разработка)")
         
         # AI клиенты - инициализируем с обработкой ошибок
@@ -147,6 +110,9 @@ class TelegramAgentAppPlatform:
             logger.error(f"OpenAI Client недоступен: {type(e).__name__}: {str(e)}")
             self.openai_client = None
         
+        # Потоковая генерация: ответ отправляется после первой фразы и дописывается правками
+        self.streaming_responses = os.getenv("STREAMING_RESPONSES", "False").lower() == "true"
+        
         # Инициализация менеджера памяти (опционально)
         if ZEP_AVAILABLE:
             self.memory_manager = ZepMemoryManager()
@@ -156,13 +122,55 @@ class TelegramAgentAppPlatform:
             logger.warning("Работаем без менеджера памяти")
         
         # Кэш активных кампаний
-        self.active_campaigns: List[Campaign] = []
+        self.active_campaigns: List[CampaignSnapshot] = []
         self.last_campaign_update = 0
+        # Интервал фоновой проверки версии кампаний в БД (секунды)
         self.campaign_cache_ttl = int(os.getenv("CACHE_TTL", "60"))
+        self.campaigns_version = None
+        self._campaigns_refresh_lock = asyncio.Lock()
+        self._campaigns_watch_task: Optional[asyncio.Task] = None
+        self._campaigns_refresh_task: Optional[asyncio.Task] = None
         
         # Кэш групп обсуждений каналов
         self.channel_discussion_groups: Dict[str, int] = {}
         
+        # Пул воркеров для параллельной обработки сработавших кампаний
+        self.trigger_pipeline = TriggerPipeline(self._process_message_for_campaign)
+        
+        # Ключи триггеров в БД: повтор сообщения после переподключения или перезапуска не получает второй ответ
+        self.trigger_queue = TriggerQueue()
+        
+        # Фоновая пакетная запись логов активности
+        self.activity_log_writer = ActivityLogWriter()
+        
+        # Лимиты частоты ответов на кампанию, чат и аккаунт
+        self.rate_limiter = ReplyRateLimiter()
+        
+        # Очередь исходящих сообщений аккаунта с учетом FloodWait
+        self.send_scheduler = SendScheduler(self.phone or "default")
+        
+        # Кэш ответов на повторяющиеся вопросы (включается в настройках кампании)
+        self.response_cache = ResponseCache()
+        
+        # Объединение всплесков триггеров в чате (окно задается в настройках кампании)
+        self.trigger_coalescer = TriggerCoalescer()
+        
+        # Недавно обработанные триггеры: повторы отбрасываются до генерации ответа
+        self.recent_triggers = RecentKeys()
+        
+        # Позиции обработки чатов для догрузки сообщений, пропущенных за время отключения
+        self.chat_cursors = ChatCursors()
+        self._catch_up_lock = asyncio.Lock()
+        
+        # Автомат ключевых слов и индекс «чат → кампании» активных кампаний
+        self.keyword_matcher = KeywordMatcher()
+        self.chat_index = ChatIndex()
+        
+        # Предвычисленные наборы для диспетчера сообщений
+        self.monitored_chat_ids: FrozenSet[int] = frozenset()
+        self.discussion_group_ids: FrozenSet[int] = frozenset()
+        self.unresolved_usernames: FrozenSet[str] = frozenset()
+        
         # Статус подключения
         self.is_connected = False
         self.is_authorized = False
@@ -204,7 +212,7 @@ class TelegramAgentAppPlatform:
             
             
             # Получаем объект канала
-            channel = await self.client.get_entity(channel_identifier)
+            channel = await entity_cache.get_entity(self.client, channel_identifier)
             
             # Получаем полную информацию о канале
             full_channel = await self.client(GetFullChannelRequest(channel))
@@ -274,11 +282,29 @@ class TelegramAgentAppPlatform:
                 me = await self.client.get_me()
                 logger.info(f"Пользователь: {me.first_name} {me.last_name or ''}, телефон: {me.phone}")
                 
-                # Настройка обработчиков событий
+                # Позиции чатов до перезапуска - граница догрузки пропущенных сообщений
+                catch_up_positions = {}
+                try:
+                    await self.chat_cursors.load()
+                    catch_up_positions = self.chat_cursors.snapshot()
+                except Exception as e:
+                    logger.warning(f"Не удалось загрузить позиции чатов: {e}")
+                self.chat_cursors.start()
+                
+                # Запуск воркеров и настройка обработчиков событий
+                self.trigger_pipeline.start()
+                self.activity_log_writer.start()
                 await self._setup_event_handlers()
+                self.client.on_reconnect(self._on_reconnect)
+                
+                # Удаление старых резервов ключей триггеров
+                try:
+                    await self.trigger_queue.purge()
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить старые ключи триггеров: {e}")
                 
                 # Загрузка активных кампаний
-                await self.update_campaigns()
+                await self.update_campaigns(force=True)
                 
                 # Определение групп обсуждений для каналов в кампаниях
                 await self.discover_discussion_groups()
@@ -286,6 +312,16 @@ class TelegramAgentAppPlatform:
                 # Принудительное подключение к группам обсуждений
                 await self.join_discussion_groups()
                 
+                # Фоновая проверка изменений кампаний, сделанных в обход API
+                self._campaigns_watch_task = asyncio.create_task(self._watch_campaigns_version())
+                
+                # Прогрев кэша сущностей чатов из списка диалогов
+                asyncio.create_task(self._warm_entity_cache())
+                
+                # Догрузка сообщений, пропущенных за время остановки (/telegram/restart, деплой)
+                if catch_up_positions:
+                    asyncio.create_task(self._catch_up_missed(catch_up_positions))
+                
                 logger.info("Telegram Agent запущен и готов к работе!")
                 return True
             else:
@@ -298,211 +334,424 @@ class TelegramAgentAppPlatform:
             self.is_authorized = False
             return False
     
+    async def _warm_entity_cache(self):
+        """Заполнение кэша сущностей из диалогов аккаунта"""
+        try:
+            count = await entity_cache.populate_from_dialogs(
+                self.client,
+                limit=int(os.getenv("ENTITY_CACHE_DIALOGS", "500"))
+            )
+            logger.info(f"Кэш чатов заполнен из диалогов: {count}")
+        except Exception as e:
+            logger.warning(f"Не удалось заполнить кэш чатов из диалогов: {e}")
+    
+    def _on_reconnect(self):
+        """Переподключение: позиции чатов на момент разрыва и догрузка пропуска"""
+        asyncio.create_task(self._catch_up_missed(self.chat_cursors.snapshot()))
+    
+    async def _catch_up_missed(self, positions: Dict[int, int]):
+        """Догрузка сообщений отслеживаемых чатов новее позиций через обычный диспетчер"""
+        if self._catch_up_lock.locked():
+            return
+        async with self._catch_up_lock:
+            try:
+                positions = {
+                    chat_id: message_id
+                    for chat_id, message_id in positions.items()
+                    if normalize_chat_id(chat_id) in self.monitored_chat_ids
+                }
+                count = await catch_up(positions, lambda chat_id: self.client, self._dispatch_message)
+                if count:
+                    logger.info(f"Догружено пропущенных сообщений: {count} (чатов: {len(positions)})")
+            except Exception as e:
+                logger.error(f"Ошибка догрузки пропущенных сообщений: {e}")
+    
     async def _setup_event_handlers(self):
         """Настройка обработчиков событий"""
-        # Собираем все ID групп обсуждений для мониторинга
-        discussion_group_ids = []
-        
-        # Получаем группы обсуждений из кампаний
-        for campaign in self.active_campaigns:
-            if campaign.telegram_chats:
-                for chat in campaign.telegram_chats:
-                    # Если это число, считаем что это ID группы обсуждений
-                    if isinstance(chat, str) and chat.isdigit():
-                        discussion_group_ids.append(int(chat))
-                    elif isinstance(chat, int):
-                        discussion_group_ids.append(chat)
-        
-        # Добавляем известную группу обсуждений
-        if 2532661483 not in discussion_group_ids:
-            discussion_group_ids.append(2532661483)
-        
-        logger.info(f"Настройка мониторинга для групп обсуждений: {discussion_group_ids}")
-        
-        # Обработчик СПЕЦИАЛЬНО для групп обсуждений
-        @self.client.on(events.NewMessage(chats=discussion_group_ids, incoming=True))
-        async def handle_discussion_message(event):
-            await self._handle_message(event)
-        
-        # Обработчик для редактирования сообщений в группах обсуждений
-        @self.client.on(events.MessageEdited(chats=discussion_group_ids, incoming=True))
-        async def handle_discussion_edited(event):
-            await self._handle_message(event)
-        
-        # Общий обработчик как fallback (но с меньшим приоритетом)
-        @self.client.on(events.NewMessage(incoming=True))
-        async def handle_general_message(event):
-            # Проверяем, не из группы обсуждений ли это (чтобы избежать дублирования)
+        # Один диспетчер для новых и отредактированных сообщений всех чатов
+        self.client.add_event_handler(self._dispatch_message, events.NewMessage(incoming=True))
+        self.client.add_event_handler(self._dispatch_message, events.MessageEdited(incoming=True))
+        
+        # Debug обработчик всех событий - только при включенном debug логировании
+        if logger.isEnabledFor(logging.DEBUG):
+            @self.client.on(events.Raw)
+            async def handle_raw_event(event):
+                # Логируем только значимые события
+                event_type = type(event).__name__
+                if event_type not in ['UpdateUserStatus', 'UpdateReadHistoryInbox', 'UpdateReadHistoryOutbox']:
+                    logger.debug("Raw event: %s", event_type)
+        
+        logger.info("Обработчики событий настроены (единый диспетчер сообщений)")
+    
+    async def _dispatch_message(self, event):
+        """Отбор сообщений отслеживаемых чатов по ID из события, без запроса чата"""
+        messages_received.inc()
+        chat_id = normalize_chat_id(event.chat_id)
+        
+        if chat_id not in self.monitored_chat_ids:
+            # Чаты, заданные username без найденного ID, проверяются по сущности чата
+            if not self.unresolved_usernames:
+                messages_rejected.inc()
+                return
             chat = await event.get_chat()
-            chat_id = getattr(chat, 'id', None)
-            if chat_id not in discussion_group_ids:
-                await self._handle_message(event)
-        
-        # Дополнительный debug обработчик для ВСЕХ событий
-        @self.client.on(events.Raw)
-        async def handle_raw_event(event):
-            # Логируем только значимые события
-            event_type = type(event).__name__
-            if event_type not in ['UpdateUserStatus', 'UpdateReadHistoryInbox', 'UpdateReadHistoryOutbox']:
-                logger.debug(f"Raw event: {event_type}")
-        
-        logger.info(f"Обработчики событий настроены (специально для {len(discussion_group_ids)} групп обсуждений + общий fallback)")
+            if normalize_username(getattr(chat, 'username', None)) not in self.unresolved_usernames:
+                messages_rejected.inc()
+                return
+        
+        # Правки сообщений обрабатываются только в группах обсуждений (комментарии)
+        if isinstance(event, events.MessageEdited.Event) and chat_id not in self.discussion_group_ids:
+            return
+        
+        await self._handle_message(event)
     
     async def _handle_message(self, event):
         """Обработка нового сообщения"""
         try:
             message = event.message
             chat = await event.get_chat()
+            entity_cache.put(chat)
             
             # Проверка является ли это комментарием
             is_comment = hasattr(message, 'reply_to_msg_id') and message.reply_to_msg_id is not None
             
-            logger.debug(f"Получено сообщение: текст='{message.text[:50] if message.text else 'None'}...', " +
-                        f"чат={getattr(chat, 'title', getattr(chat, 'username', 'Unknown'))}, " +
-                        f"от={message.sender_id}, комментарий={is_comment}")
+            hot_log.sampled(
+                "message_received",
+                chat_id=getattr(chat, 'id', None),
+                sender_id=message.sender_id,
+                reply_to=message.reply_to_msg_id if is_comment else None,
+                text=message.text
+            )
+            
+            # Неотслеживаемые чаты отклоняются одним поиском в индексе
+            match_started = time.perf_counter()
+            campaign_ids = self.chat_index.lookup(getattr(chat, 'id', None), getattr(chat, 'username', None))
+            if not campaign_ids:
+                messages_rejected.inc()
+                return
             
-            if is_comment:
-                logger.info(f"Обнаружен комментарий к сообщению ID: {message.reply_to_msg_id}")
+            # Позиция чата для догрузки после переподключения
+            self.chat_cursors.advance(event.chat_id, message.id)
+            
+            # Один проход автомата по тексту для кампаний этого чата
+            matched = self.keyword_matcher.match(message.text, campaign_ids=campaign_ids)
+            if not matched:
+                return
             
             # Проверяем, есть ли активные кампании для этого чата
             relevant_campaigns = []
             for campaign in self.active_campaigns:
-                if self._is_message_relevant(message, chat, campaign, is_comment):
+                if campaign.id not in matched:
+                    continue
+                if self._is_message_relevant(message, chat, campaign, is_comment, matched):
                     relevant_campaigns.append(campaign)
-                    logger.debug(f"Кампания {campaign.name} релевантна для сообщения")
             
             if not relevant_campaigns:
                 return
+            match_time = time.perf_counter() - match_started
             
-            # Обработка сообщения для каждой релевантной кампании
+            # Всплески триггеров чата объединяются в окне кампании (если оно задано)
             for campaign in relevant_campaigns:
-                await self._process_message_for_campaign(message, chat, campaign, is_comment, event)
+                keyword_matches_total.inc(campaign=campaign.id)
+                
+                # Повтор того же сообщения (правка, повтор обновлений) - без генерации
+                if not self.recent_triggers.add((getattr(chat, 'id', None), message.id, campaign.id)):
+                    continue
+                
+                await self.trigger_coalescer.add(
+                    (getattr(chat, 'id', None), campaign.id),
+                    coalesce_window(campaign),
+                    (message, chat, campaign, is_comment, event, matched.get(campaign.id), StageTimings(match=match_time)),
+                    self._dispatch_trigger
+                )
                 
         except Exception as e:
             print(f"❌ Ошибка обработки сообщения: {e}")
     
-    def _is_message_relevant(self, message: Message, chat, campaign: Campaign, is_comment: bool = False) -> bool:
+    def _trigger_log_context(self, message: Message, chat, is_comment: bool, trigger_keyword: Optional[str]) -> Dict:
+        """Контекст для лога триггера, который не дошел до генерации"""
+        return {
+            'message': message.text or '',
+            'message_obj': message,
+            'chat_name': getattr(chat, 'title', getattr(chat, 'username', 'Unknown')),
+            'chat_id': get_peer_id(message.peer_id),
+            'is_comment': is_comment,
+            'trigger_keyword': trigger_keyword
+        }
+    
+    async def _dispatch_trigger(self, trigger_key: Tuple, triggers: List[Tuple]):
+        """Постановка триггера (последнего из объединенных) в пул воркеров"""
+        message, chat, campaign, is_comment, event, keyword, timings = triggers[-1]
+        
+        # Более ранние триггеры всплеска получают общий ответ на последний
+        for merged_message, _, _, merged_is_comment, _, merged_keyword, _ in triggers[:-1]:
+            await self._log_activity(
+                self._trigger_log_context(merged_message, chat, merged_is_comment, merged_keyword),
+                None,
+                campaign,
+                status='coalesced',
+                error_message=f"Объединено с сообщением {message.id}"
+            )
+        
+        # Лимиты частоты ответов проверяются до генерации (без затрат токенов)
+        # Все ответы отправляются единственным клиентом агента
+        limited_scope = self.rate_limiter.acquire(campaign, trigger_key[0], self.send_scheduler.name)
+        if limited_scope:
+            await self._log_activity(
+                self._trigger_log_context(message, chat, is_comment, keyword),
+                None,
+                campaign,
+                status='rate_limited',
+                error_message=f"Превышен лимит ответов ({limited_scope})"
+            )
+            return
+        
+        # Ключ триггера резервируется в БД до генерации ответа
+        job_id = None
+        try:
+            job_id = await self.trigger_queue.publish(
+                get_peer_id(message.peer_id),
+                message.id,
+                campaign.id,
+                account=self.send_scheduler.name,
+                trigger_keyword=keyword,
+                coalesced_message_ids=[trigger[0].id for trigger in triggers[:-1]],
+                status="reserved"
+            )
+        except Exception as e:
+            print(f"⚠️ Ключ триггера не зарезервирован, обработка без проверки повторов: {e}")
+        else:
+            # Повтор уже обработанного триггера (догрузка, перезапуск) не генерирует ответ
+            if job_id is None:
+                print(f"♻️ Повтор триггера пропущен: сообщение {message.id}, кампания '{campaign.name}'")
+                return
+        
+        # Постановка в пул воркеров: порядок сохраняется внутри чата и кампании
+        await self.trigger_pipeline.submit(
+            trigger_key,
+            message, chat, campaign, is_comment, event,
+            trigger_keyword=keyword,
+            coalesced_messages=[trigger[0] for trigger in triggers[:-1]],
+            job_id=job_id,
+            timings=timings
+        )
+    
+    def _is_message_relevant(
+        self,
+        message: Message,
+        chat,
+        campaign: CampaignSnapshot,
+        is_comment: bool = False,
+        keyword_matches: Optional[Dict[int, str]] = None
+    ) -> bool:
         """Проверка релевантности сообщения для кампании"""
         try:
-            # DEBUG: Подробное логирование проверки релевантности
-            logger.debug(f"Проверка релевантности для кампании '{campaign.name}': " +
-                        f"чат_ID={getattr(chat, 'id', 'None')}, " +
-                        f"username={getattr(chat, 'username', 'None')}, " +
-                        f"комментарий={is_comment}")
-            
-            # Логика проверки чата
-            chat_matches = False
-            
-            # Получаем target_chats
-            target_chats = campaign.telegram_chats if isinstance(campaign.telegram_chats, list) else campaign.telegram_chats.split(',')
-            # Проверка по ID чата/канала и username
-            if hasattr(chat, 'id') or (hasattr(chat, 'username') and chat.username):
-                # Проверка по ID чата
-                if hasattr(chat, 'id') and str(chat.id) in target_chats:
-                    chat_matches = True
-                    
-                # Проверка по username чата (с @ и без @)
-                if hasattr(chat, 'username') and chat.username:
-                    username_variants = [chat.username.lower(), f"@{chat.username.lower()}"]
-                    for target in target_chats:
-                        if target.lower() in username_variants:
-                            chat_matches = True
-                            break
-            
-            # Дополнительная проверка для групп обсуждений
-            if not chat_matches and hasattr(chat, 'id'):
-                chat_id = getattr(chat, 'id', None)
-                # Проверяем, является ли этот чат группой обсуждений одного из каналов
-                for target_chat in target_chats:
-                    if target_chat.startswith('@'):
-                        discussion_group_id = self.channel_discussion_groups.get(target_chat)
-                        if discussion_group_id and chat_id == discussion_group_id:
-                            chat_matches = True
-                            break
-            
-            # Если чат не подходит, сразу отклоняем
-            if not chat_matches:
-                print(f"         ❌ Чат не соответствует кампании")
-                return False
+            # Проверка чата по индексу (ID, username и группы обсуждений каналов)
+            chat_matches = campaign.id in self.chat_index.lookup(
+                getattr(chat, 'id', None),
+                getattr(chat, 'username', None)
+            )
             
-            # Проверка по ключевым словам
-            if campaign.keywords and message.text:
-                # campaign.keywords уже список (JSON), не строка
-                if isinstance(campaign.keywords, list):
-                    keywords = [kw.strip().lower() for kw in campaign.keywords]
-                else:
-                    # Поддержка старого формата (строка с запятыми)
-                    keywords = [kw.strip().lower() for kw in campaign.keywords.split(',')]
-                    
-                message_text = message.text.lower()
-                print(f"            📝 Текст сообщения (lower): '{message_text}'")
-                print(f"            🔑 Keywords для поиска: {keywords}")
-                
-                for keyword in keywords:
-                    if keyword in message_text:
-                        print(f"         ✅ Найдено ключевое слово: '{keyword}' в '{message_text}'")
-                        return True
-                    else:
-                        logger.debug(f"         Ключевое слово '{keyword}' не найдено")
-            else:
-                print(f"         ⚠️ Пропускаем проверку keywords: keywords={bool(campaign.keywords)}, message.text={bool(message.text)}")
+            # Проверка по ключевым словам (результат автомата Ахо-Корасик)
+            keyword = None
+            if chat_matches and campaign.keywords and message.text:
+                if keyword_matches is None:
+                    keyword_matches = self.keyword_matcher.match(message.text, campaign_ids=[campaign.id])
+                keyword = keyword_matches.get(campaign.id)
             
-            print(f"         ❌ Сообщение не релевантно для кампании '{campaign.name}'")
+            # Структурированная debug запись с выборкой (без форматирования при выключенном debug)
+            hot_log.sampled(
+                "relevance_check",
+                campaign=campaign.name,
+                chat_id=getattr(chat, 'id', None),
+                comment=is_comment,
+                chat_matches=chat_matches,
+                keyword=keyword
+            )
             
-            return False
+            return keyword is not None
             
         except Exception as e:
             print(f"❌ Ошибка проверки релевантности: {e}")
             return False
     
-    async def _process_message_for_campaign(self, message: Message, chat, campaign: Campaign, is_comment: bool = False, event=None):
-        """Обработка сообщения для конкретной кампании"""
+    async def _process_message_for_campaign(
+        self,
+        message: Message,
+        chat,
+        campaign: CampaignSnapshot,
+        is_comment: bool = False,
+        event=None,
+        trigger_keyword: Optional[str] = None,
+        coalesced_messages: Optional[List[Message]] = None,
+        job_id: Optional[int] = None,
+        timings: Optional[StageTimings] = None
+    ):
+        """
+        Обработка сообщения для конкретной кампании.
+
+        job_id - зарезервированный ключ триггера: после обработки отмечается
+        выполненным, неудачная попытка остается доступной для повтора.
+        """
+        timings = timings or StageTimings()
+        job_status = "failed"
         try:
+            context_started = time.perf_counter()
+            
+            # Объединенные триггеры всплеска идут в промпт вместе с последним
+            message_text = "\n".join(
+                merged.text for merged in [*(coalesced_messages or []), message] if merged.text
+            )
+            
             # Подготовка контекста
             context = {
-                'message': message.text or '',
+                'message': message_text,
                 'message_obj': message,  # Добавляем объект сообщения для логирования
                 'chat_name': getattr(chat, 'title', getattr(chat, 'username', 'Unknown')),
-                'chat_id': getattr(chat, 'id', 'Unknown'),
+                'chat_id': get_peer_id(message.peer_id),
                 'sender_id': message.sender_id,
                 'date': message.date,
                 'campaign': campaign.name,
                 'is_comment': is_comment,
+                'trigger_keyword': trigger_keyword,
                 'reply_to_msg_id': getattr(message, 'reply_to_msg_id', None) if is_comment else None
             }
+            timings.add("context", time.perf_counter() - context_started)
             
-            # Генерация ответа через AI
-            response = await self._generate_ai_response(context, campaign)
-            
-            if response:
-                # Отправка автоответа с передачей event для правильного ответа на комментарии
-                await self._send_response(message, response, campaign, is_comment, event)
+            if self.streaming_responses and (self.openai_client or self.claude_client):
+                # Потоковая генерация с ранней отправкой и правками на месте
+                try:
+                    response = await self._stream_ai_response(context, campaign, message, is_comment, event, timings)
+                except StreamInterruptedError as e:
+                    # В чате осталась только часть ответа
+                    await self._log_activity(
+                        context, e.delivered, campaign, status='failed', error_message=str(e), timings=timings
+                    )
+                    # Повтор продублировал бы уже отправленную часть
+                    if e.delivered:
+                        job_status = "done"
+                    return
+            else:
+                # Генерация ответа через AI
+                response = await self._generate_ai_response(context, campaign, timings)
+                
+                if response:
+                    # Отправка автоответа с передачей event для правильного ответа на комментарии
+                    with timings.measure("send"):
+                        sent_message = await self._send_response(message, response, campaign, is_comment, event)
+                    if sent_message is None:
+                        await self._log_activity(
+                            context, response, campaign, status='failed',
+                            error_message="Ответ не доставлен в чат", timings=timings
+                        )
+                        return
             
             # Логирование активности
-            await self._log_activity(context, response, campaign)
+            await self._log_activity(context, response, campaign, timings=timings)
+            if response:
+                job_status = "done"
             
         except Exception as e:
             print(f"❌ Ошибка обработки сообщения для кампании {campaign.name}: {e}")
+        finally:
+            if job_id is not None:
+                try:
+                    await self.trigger_queue.complete(job_id, job_status)
+                except Exception as e:
+                    print(f"⚠️ Ключ триггера {job_id} не отмечен обработанным: {e}")
     
-    async def _generate_ai_response(self, context: Dict, campaign: Campaign) -> Optional[str]:
-        """Генерация ответа через AI"""
+    def _build_ai_prompt(self, context: Dict, campaign: CampaignSnapshot) -> Tuple[str, str]:
+        """
+        Формирование промпта: системный блок кампании (собран один раз в снимке
+        кампании) и переменный блок сообщения.
+        """
+        prompt = f"Контекст: {context['message']}\nЧат: {context['chat_name']}"
+        return campaign.system_prompt, prompt
+    
+    async def _stream_ai_response(
+        self,
+        context: Dict,
+        campaign: CampaignSnapshot,
+        original_message: Message,
+        is_comment: bool = False,
+        event=None,
+        timings: Optional[StageTimings] = None
+    ) -> Optional[str]:
+        """
+        Потоковая генерация: отправка после первой фразы и правки сообщения на месте.
+
+        None - ответ не сгенерирован или не доставлен; обрыв потока после
+        отправки начала ответа - StreamInterruptedError.
+        """
+        timings = timings or StageTimings()
         try:
-            # Формирование промпта
-            prompt = f"""
-            Контекст: {context['message']}
-            Чат: {context['chat_name']}
-            Кампания: {campaign.name}
-            Инструкции: {campaign.system_instruction}
+            context_key = context_hash([context['chat_name']])
+            cached_response = self.response_cache.lookup(campaign, context['message'], context_key)
+            if cached_response is not None:
+                with timings.measure("send"):
+                    sent_message = await self._send_response(
+                        original_message, cached_response, campaign, is_comment, event
+                    )
+                if sent_message is None:
+                    raise RuntimeError("ответ не доставлен в чат")
+                return cached_response
+            
+            ai_client = self.openai_client or self.claude_client
+            with timings.measure("prompt"):
+                system, prompt = self._build_ai_prompt(context, campaign)
             
-            Сгенерируй подходящий ответ согласно инструкциям кампании.
-            """
+            # Отправка и правки идут между фрагментами: ожидание LLM и Telegram замеряются раздельно
+            started = time.monotonic()
+            response = await stream_reply(
+                timings.stream(ai_client.stream_response(prompt, system=system, cache_key=campaign.id)),
+                send=timings.timed(
+                    "send", lambda text: self._send_response(original_message, text, campaign, is_comment, event)
+                ),
+                edit=timings.timed("send", lambda sent_message, text: self.send_scheduler.send(
+                    original_message.chat_id,
+                    lambda: self.client.edit_message(sent_message, text),
+                    pace=False
+                ))
+            )
+            if not is_error_response(response):
+                self.response_cache.store(
+                    campaign, context['message'], context_key, response, time.monotonic() - started
+                )
+            return response
+        except StreamInterruptedError:
+            raise
+        except Exception as e:
+            print(f"❌ Ошибка потоковой генерации AI ответа: {e}")
+            return None
+    
+    async def _generate_ai_response(
+        self,
+        context: Dict,
+        campaign: CampaignSnapshot,
+        timings: Optional[StageTimings] = None
+    ) -> Optional[str]:
+        """Генерация ответа через AI"""
+        timings = timings or StageTimings()
+        try:
+            # Формирование промпта (системный блок кэшируется провайдером)
+            with timings.measure("prompt"):
+                system, prompt = self._build_ai_prompt(context, campaign)
             
             # Использование доступного AI клиента
-            if self.openai_client:
-                response = await self.openai_client.generate_response(prompt)
-                return response
-            elif self.claude_client:
-                response = await self.claude_client.generate_response(prompt)
+            ai_client = self.openai_client or self.claude_client
+            if ai_client:
+                # Повторяющийся вопрос - ответ из кэша (если кэш включен для кампании)
+                context_key = context_hash([context['chat_name']])
+                cached_response = self.response_cache.lookup(campaign, context['message'], context_key)
+                if cached_response is not None:
+                    return cached_response
+                
+                started = time.monotonic()
+                with timings.measure_llm():
+                    response = await ai_client.generate_response(prompt, system=system, cache_key=campaign.id)
+                if not is_error_response(response):
+                    self.response_cache.store(
+                        campaign, context['message'], context_key, response, time.monotonic() - started
+                    )
                 return response
             else:
                 print("⚠️ AI клиенты недоступны, используем фоллбэк ответы")
@@ -527,21 +776,29 @@ class TelegramAgentAppPlatform:
             print(f"❌ Ошибка генерации AI ответа: {e}")
             return None
     
-    async def _send_response(self, original_message: Message, response: str, campaign: Campaign, is_comment: bool = False, event=None):
-        """Отправка ответа"""
+    async def _send_response(self, original_message: Message, response: str, campaign: CampaignSnapshot, is_comment: bool = False, event=None):
+        """Отправка ответа через очередь аккаунта (возвращает отправленное сообщение или None)"""
+        chat_key = original_message.chat_id
         try:
             if is_comment and event:
                 # Для комментариев используем event.respond() с comment_to (правильный метод по документации)
-                await event.respond(response, comment_to=original_message.id)
+                return await self.send_scheduler.send(
+                    chat_key, lambda: event.respond(response, comment_to=original_message.id)
+                )
             elif is_comment:
                 # Fallback для комментариев, если нет event
                 print(f"💬 Отправка ответа на комментарий через reply (fallback)")
-                await original_message.reply(response)
+                return await self.send_scheduler.send(chat_key, lambda: original_message.reply(response))
             else:
                 # Для обычных сообщений используем reply
-                await original_message.reply(response)
+                sent_message = await self.send_scheduler.send(chat_key, lambda: original_message.reply(response))
                 print(f"✅ Обычный ответ отправлен для кампании: {campaign.name}")
+                return sent_message
             
+        except FloodWaitError as e:
+            # Очередь уже выждала допустимые FloodWait - другой способ отправки не поможет
+            print(f"❌ Ответ не отправлен: FloodWait {e.seconds} с превышает допустимое ожидание")
+            return None
         except Exception as e:
             print(f"❌ Ошибка отправки ответа (is_comment={is_comment}): {e}")
             
@@ -550,33 +807,39 @@ class TelegramAgentAppPlatform:
                 if is_comment:
                     # Альтернативный способ для комментариев - обычный reply
                     print(f"🔄 Попытка альтернативной отправки комментария через reply")
-                    await original_message.reply(response)
+                    sent_message = await self.send_scheduler.send(chat_key, lambda: original_message.reply(response))
                     print(f"✅ Альтернативная отправка ответа на комментарий успешна")
+                    return sent_message
                 else:
                     # Альтернативный способ для обычных сообщений
                     print(f"🔄 Попытка альтернативной отправки через send_message")
-                    await self.client.send_message(
-                        entity=original_message.chat_id,
-                        message=response
+                    sent_message = await self.send_scheduler.send(
+                        chat_key,
+                        lambda: self.client.send_message(entity=original_message.chat_id, message=response)
                     )
                     print(f"✅ Альтернативная отправка обычного ответа успешна")
+                    return sent_message
             except Exception as fallback_error:
                 print(f"❌ Альтернативная отправка также не удалась: {fallback_error}")
+                return None
     
-    async def _log_activity(self, context: Dict, response: Optional[str], campaign: Campaign):
-        """Логирование активности"""
+    async def _log_activity(
+        self,
+        context: Dict,
+        response: Optional[str],
+        campaign: CampaignSnapshot,
+        status: Optional[str] = None,
+        error_message: Optional[str] = None,
+        timings: Optional[StageTimings] = None
+    ):
+        """Логирование активности (запись в БД выполняет фоновый writer)"""
+        log_started = time.perf_counter()
         try:
-            db = SessionLocal()
-            
-            # Находим какое ключевое слово сработало
-            trigger_keyword = "unknown"
-            if campaign.keywords and context.get('message'):
-                message_lower = context['message'].lower()
-                keywords = campaign.keywords if isinstance(campaign.keywords, list) else campaign.keywords.split(',')
-                for keyword in keywords:
-                    if keyword.strip().lower() in message_lower:
-                        trigger_keyword = keyword.strip()
-                        break
+            # Ключевое слово, на котором сработал автомат
+            trigger_keyword = context.get('trigger_keyword')
+            if not trigger_keyword:
+                matches = self.keyword_matcher.match(context.get('message'), campaign_ids=[campaign.id])
+                trigger_keyword = matches.get(campaign.id, "unknown")
             
             # Определяем тип сообщения для логирования
             message_type = "comment" if context.get('is_comment') else "message"
@@ -584,7 +847,11 @@ class TelegramAgentAppPlatform:
             if context.get('is_comment'):
                 chat_title += " (Discussion Group)"
             
-            log_entry = ActivityLog(
+            # Этап log - подготовка записи на горячем пути (запись в БД - метрика log_write_seconds)
+            if timings is not None:
+                timings.add("log", time.perf_counter() - log_started)
+            
+            self.activity_log_writer.write(
                 campaign_id=campaign.id,
                 chat_id=str(context['chat_id']),
                 chat_title=chat_title,
@@ -592,37 +859,86 @@ class TelegramAgentAppPlatform:
                 trigger_keyword=f"{trigger_keyword} ({message_type})",
                 original_message=context['message'][:1000] if context.get('message') else '',
                 agent_response=response[:1000] if response else 'No response',
-                status='sent' if response else 'failed'
+                status=status or ('sent' if response else 'failed'),
+                error_message=error_message,
+                stage_timings=timings.to_dict() if timings is not None else None
             )
             
-            db.add(log_entry)
-            db.commit()
-            db.close()
-            
         except Exception as e:
             print(f"❌ Ошибка логирования: {e}")
     
-    async def update_campaigns(self):
-        """Обновление списка активных кампаний"""
+    async def update_campaigns(self, force: bool = False):
+        """Обновление списка активных кампаний, если их версия в БД изменилась"""
+        async with self._campaigns_refresh_lock:
+            db = None
+            try:
+                db = SessionLocal()
+                version = get_campaigns_version(db)
+                
+                # Индексы перестраиваются только при реальных изменениях
+                if not force and version == self.campaigns_version:
+                    return
+                
+                campaigns = load_active_campaigns(db)
+                
+                self.active_campaigns = campaigns
+                await self._rebuild_indexes()
+                self.campaigns_version = version
+                self.last_campaign_update = time.time()
+                
+                print(f"✅ Загружено активных кампаний: {len(campaigns)}, "
+                      f"ключевых слов: {self.keyword_matcher.keywords_count}")
+                
+            except Exception as e:
+                print(f"❌ Ошибка обновления кампаний: {e}")
+            finally:
+                if db is not None:
+                    db.close()
+    
+    async def _watch_campaigns_version(self):
+        """Фоновая проверка версии кампаний (изменения, сделанные в обход API)"""
+        while True:
+            await asyncio.sleep(self.campaign_cache_ttl)
+            await self.update_campaigns()
+    
+    def force_campaigns_refresh(self):
+        """Немедленное обновление кэша после изменения кампаний через API"""
         try:
-            current_time = time.time()
-            
-            # Проверяем, нужно ли обновлять кэш
-            if current_time - self.last_campaign_update < self.campaign_cache_ttl:
-                return
-            
-            db = SessionLocal()
-            campaigns = db.query(Campaign).filter(Campaign.active == True).all()
-            
-            self.active_campaigns = campaigns
-            self.last_campaign_update = current_time
-            
-            print(f"✅ Загружено активных кампаний: {len(campaigns)}")
-            
-            db.close()
-            
-        except Exception as e:
-            print(f"❌ Ошибка обновления кампаний: {e}")
+            loop = asyncio.get_running_loop()
+            self._campaigns_refresh_task = loop.create_task(self.update_campaigns(force=True))
+            logger.info("Запущено обновление кэша кампаний")
+        except RuntimeError:
+            # Нет запущенного event loop - обновится при следующей фоновой проверке
+            self.campaigns_version = None
+            logger.info("Запланировано принудительное обновление кэша кампаний")
+    
+    async def _rebuild_indexes(self):
+        """Перестроение автомата ключевых слов и индекса чатов по активным кампаниям"""
+        chat_index = ChatIndex(self.active_campaigns, self.channel_discussion_groups)
+        
+        # Чаты, заданные username, привязываются к ID, чтобы отбирать сообщения без запроса чата
+        unresolved = set()
+        for username in chat_index.usernames:
+            try:
+                entity = await entity_cache.get_entity(self.client, f"@{username}")
+                chat_index.add_alias(entity.id, chat_index.lookup(username=username))
+            except Exception as e:
+                logger.warning(f"Не удалось определить ID чата @{username}: {e}")
+                unresolved.add(username)
+        
+        self.keyword_matcher = KeywordMatcher(self.active_campaigns)
+        self.chat_index = chat_index
+        self.monitored_chat_ids = chat_index.chat_ids
+        # Группы обсуждений: найденные для каналов и заданные в кампаниях числовым ID
+        self.discussion_group_ids = frozenset(
+            normalize_chat_id(group_id) for group_id in self.channel_discussion_groups.values()
+        ) | frozenset(
+            chat_id
+            for campaign in self.active_campaigns
+            for chat_id in map(normalize_chat_id, campaign.telegram_chats)
+            if chat_id is not None
+        )
+        self.unresolved_usernames = frozenset(unresolved)
     
     async def discover_discussion_groups(self):
         """Обнаружение групп обсуждений для всех каналов в кампаниях"""
@@ -650,6 +966,9 @@ class TelegramAgentAppPlatform:
             
             print(f"📊 Всего найдено групп обсуждений: {len(self.channel_discussion_groups)}")
             
+            # Группы обсуждений попадают в индекс чатов
+            await self._rebuild_indexes()
+            
         except Exception as e:
             print(f"❌ Ошибка обнаружения групп обсуждений: {e}")
     
@@ -734,17 +1053,42 @@ class TelegramAgentAppPlatform:
             "connected": self.is_connected,
             "authorized": self.is_authorized,
             "active_campaigns": len(self.active_campaigns),
+            "trigger_pipeline": self.trigger_pipeline.stats(),
+            "activity_log_writer": self.activity_log_writer.stats(),
+            "entity_cache": entity_cache.stats(),
+            "rate_limiter": self.rate_limiter.stats(),
+            "send_scheduler": self.send_scheduler.stats(),
+            "response_cache": self.response_cache.stats(),
+            "trigger_coalescer": self.trigger_coalescer.stats(),
+            "recent_triggers": self.recent_triggers.stats(),
+            "catch_up": self.chat_cursors.stats(),
             "session_type": "StringSession" if self.session_string else "FileSession",
             "ai_clients": {
                 "openai": self.openai_client is not None,
                 "openai_working": openai_working,
                 "claude": self.claude_client is not None
-            }
+            },
+            "prompt_cache": prompt_cache_stats.to_dict()
         }
     
     async def stop(self):
         """Остановка агента"""
         try:
+            if self._campaigns_watch_task:
+                self._campaigns_watch_task.cancel()
+                self._campaigns_watch_task = None
+            
+            # Дожидаемся уже принятых триггеров, пока клиент подключен
+            await self.trigger_coalescer.stop()
+            await self.trigger_pipeline.stop()
+            
+            # Записываем оставшиеся логи активности и позиции чатов
+            await self.activity_log_writer.stop()
+            await self.chat_cursors.stop()
+            
+            # Закрываем общий пул HTTP соединений AI провайдеров
+            await close_http_client()
+            
             if self.is_connected:
                 await self.client.disconnect()
                 self.is_connected = False
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from backend.core.metrics import pipeline_pending
+
+
+class TriggerPipeline:
+    """
+    Ограниченный пул воркеров для обработки сработавших кампаний.
+
+    - concurrency воркеров обрабатывают триггеры параллельно;
+    - триггеры с одинаковым ключом (обычно чат + кампания) выполняются строго
+      по очереди, поэтому ответы кампании в чате не перемешиваются, а медленный
+      ответ одной кампании не задерживает другие;
+    - не более max_pending триггеров в очереди: submit() ждет освобождения места
+      (back-pressure вместо неограниченного роста памяти).
+    """
+
+    def __init__(
+        self,
+        handler: Callable[..., Awaitable[Any]],
+        concurrency: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        name: str = "trigger-pipeline"
+    ):
+        self.handler = handler
+        self.concurrency = concurrency or int(os.getenv("TRIGGER_CONCURRENCY", "8"))
+        self.max_pending = max_pending or int(os.getenv("TRIGGER_QUEUE_SIZE", "500"))
+        self.name = name
+
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._chat_queues: Dict[Hashable, Deque[Tuple[tuple, dict]]] = {}
+        self._ready: "asyncio.Queue[Hashable]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._pending = 0
+        self._in_progress = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        pipeline_pending.set_function(lambda: self._pending, pipeline=self.name)
+
+    @property
+    def pending(self) -> int:
+        """Количество триггеров в очереди и в обработке"""
+        return self._pending
+
+    @property
+    def in_progress(self) -> int:
+        """Количество триггеров, обрабатываемых прямо сейчас"""
+        return self._in_progress
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Запуск воркеров"""
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"{self.name}-{index}")
+            for index in range(self.concurrency)
+        ]
+
+    async def submit(self, chat_key: Hashable, *args, **kwargs):
+        """Постановка триггера в очередь чата (ждет, если очередь заполнена)"""
+        await self._slots.acquire()
+        self._pending += 1
+        self._idle.clear()
+
+        queue = self._chat_queues.get(chat_key)
+        if queue is None:
+            # Чат не обрабатывается и не ждет - ставим его в очередь готовых
+            self._chat_queues[chat_key] = deque([(args, kwargs)])
+            self._ready.put_nowait(chat_key)
+        else:
+            queue.append((args, kwargs))
+
+    async def _worker(self):
+        while True:
+            chat_key = await self._ready.get()
+            queue = self._chat_queues[chat_key]
+            args, kwargs = queue.popleft()
+
+            self._in_progress += 1
+            try:
+                await self.handler(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка обработки триггера в {self.name}: {e}")
+            finally:
+                self._in_progress -= 1
+                self._pending -= 1
+                self._slots.release()
+
+                # Следующий триггер этого чата - только после завершения текущего
+                if queue:
+                    self._ready.put_nowait(chat_key)
+                else:
+                    del self._chat_queues[chat_key]
+                if not self._pending:
+                    self._idle.set()
+
+    async def join(self):
+        """Ожидание обработки всех поставленных триггеров"""
+        await self._idle.wait()
+
+    async def stop(self, drain: bool = True, timeout: Optional[float] = 30):
+        """Остановка воркеров (по умолчанию после обработки очереди)"""
+        if drain and self._workers:
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"⚠️ {self.name}: не обработано {self._pending} триггеров при остановке")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние очереди для статуса агента"""
+        return {
+            "concurrency": self.concurrency,
+            "max_pending": self.max_pending,
+            "pending": self._pending,
+            "in_progress": self._in_progress,
+            "chats_waiting": len(self._chat_queues),
+        }
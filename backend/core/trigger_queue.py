@@ -0,0 +1,266 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+
+from database.models.base import SessionLocal
+from database.models.trigger_job import TriggerJob
+
+
+def trigger_max_age(campaign) -> float:
+    """Предельный возраст триггера кампании (settings.max_trigger_age или TRIGGER_MAX_AGE), секунды"""
+    max_age = (getattr(campaign, "settings", None) or {}).get("max_trigger_age")
+    if max_age is None:
+        max_age = os.getenv("TRIGGER_MAX_AGE", "600")
+    try:
+        return float(max_age)
+    except (TypeError, ValueError):
+        return 600.0
+
+
+def worker_partitions(partitions: int, worker_index: int, worker_count: int) -> List[int]:
+    """Разделы очереди, которыми владеет воркер (раздел p - воркеру p % worker_count)"""
+    return [partition for partition in range(partitions) if partition % worker_count == worker_index]
+
+
+class TriggerQueue:
+    """
+    Разделенная по чатам очередь триггеров в основной БД (SQLite/PostgreSQL).
+
+    - процесс приема публикует сработавшие кампании; раздел определяется ID
+      чата, поэтому триггеры одного чата всегда попадают к одному воркеру и
+      обрабатываются по порядку;
+    - уникальный ключ (chat_id, message_id, campaign_id) отбрасывает повторную
+      публикацию того же триггера;
+    - воркер забирает триггеры своих разделов с арендой на lease секунд и
+      отмечает выполненными после обработки; триггеры упавшего воркера
+      возвращаются в очередь по истечении аренды (at-least-once);
+    - в режиме all очередь служит журналом: триггер записывается до
+      обработки, а после перезапуска незавершенные триггеры досылаются
+      (recover) или снимаются как устаревшие;
+    - ключ резервируется до генерации ответа: повтор сообщения (правка,
+      досылка после переподключения или перезапуска) не проходит, а
+      неудачная попытка (status="failed") резервируется заново, пока не
+      исчерпано max_attempts. Резерв без журнала (status="reserved") воркеры
+      не забирают: его обрабатывает сам зарезервировавший процесс.
+
+    Все обращения к БД выполняются в отдельном потоке.
+    """
+
+    def __init__(
+        self,
+        partitions: Optional[int] = None,
+        lease: Optional[float] = None,
+        max_attempts: Optional[int] = None
+    ):
+        self.partitions = partitions or int(os.getenv("TRIGGER_PARTITIONS", "16"))
+        self.lease = lease or float(os.getenv("TRIGGER_LEASE", "120"))
+        self.max_attempts = max_attempts or int(os.getenv("TRIGGER_MAX_ATTEMPTS", "3"))
+        self.retention = float(os.getenv("TRIGGER_RETENTION", "86400"))
+        self._stats = {
+            "published": 0,
+            "duplicates": 0,
+            "claimed": 0,
+            "completed": 0,
+            "failed": 0,
+            "expired": 0,
+            "abandoned": 0,
+        }
+
+    def partition_for(self, chat_id: int) -> int:
+        return abs(int(chat_id)) % self.partitions
+
+    async def publish(
+        self,
+        chat_id: int,
+        message_id: int,
+        campaign_id: int,
+        account: Optional[str] = None,
+        trigger_keyword: Optional[str] = None,
+        coalesced_message_ids: Optional[List[int]] = None,
+        status: str = "queued"
+    ) -> Optional[int]:
+        """
+        Публикация триггера (ID записи, None - такой триггер уже в очереди).
+
+        status="reserved" - только резерв ключа для обработки в этом процессе.
+        """
+        job = dict(
+            chat_id=chat_id,
+            message_id=message_id,
+            campaign_id=campaign_id,
+            account=account,
+            trigger_keyword=trigger_keyword,
+            coalesced_message_ids=coalesced_message_ids or None,
+            partition=self.partition_for(chat_id),
+            status=status,
+            # Резерв обрабатывается сразу; триггеру очереди попытку засчитывает claim
+            attempts=1 if status == "reserved" else 0,
+        )
+        job_id = await asyncio.to_thread(self._insert, job, self.max_attempts)
+        self._stats["published" if job_id else "duplicates"] += 1
+        return job_id
+
+    @staticmethod
+    def _insert(job: Dict, max_attempts: int) -> Optional[int]:
+        db = SessionLocal()
+        try:
+            trigger_job = TriggerJob(**job)
+            db.add(trigger_job)
+            db.commit()
+            return trigger_job.id
+        except IntegrityError:
+            db.rollback()
+        finally:
+            db.close()
+
+        # Ключ уже записан: повторно резервируется только неудачная попытка
+        db = SessionLocal()
+        try:
+            key = (
+                TriggerJob.chat_id == job["chat_id"],
+                TriggerJob.message_id == job["message_id"],
+                TriggerJob.campaign_id == job["campaign_id"],
+            )
+            existing = db.query(TriggerJob).filter(*key).first()
+            if existing is None or existing.status != "failed" or existing.attempts >= max_attempts:
+                return None
+            # Условное обновление: неудачную попытку забирает только один процесс
+            updated = db.query(TriggerJob).filter(
+                *key,
+                TriggerJob.status == "failed",
+                TriggerJob.attempts == existing.attempts
+            ).update({
+                TriggerJob.status: job["status"],
+                TriggerJob.attempts: existing.attempts + job["attempts"],
+                TriggerJob.trigger_keyword: job["trigger_keyword"],
+                TriggerJob.coalesced_message_ids: job["coalesced_message_ids"],
+                TriggerJob.lease_owner: None,
+                TriggerJob.lease_expires_at: None,
+            }, synchronize_session=False)
+            db.commit()
+            return existing.id if updated else None
+        finally:
+            db.close()
+
+    async def claim(
+        self,
+        worker_id: str,
+        partitions: Iterable[int],
+        limit: int,
+        max_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Аренда до limit триггеров из разделов воркера (новых и с истекшей арендой).
+
+        max_id ограничивает выборку триггерами, записанными до перезапуска.
+        В словаре триггера age - его возраст в секундах.
+        """
+        if limit <= 0:
+            return []
+        jobs = await asyncio.to_thread(self._claim, worker_id, list(partitions), limit, max_id)
+        self._stats["claimed"] += len(jobs)
+        return jobs
+
+    async def last_id(self) -> int:
+        """ID последнего записанного триггера"""
+        return await asyncio.to_thread(self._last_id)
+
+    @staticmethod
+    def _last_id() -> int:
+        db = SessionLocal()
+        try:
+            return db.query(func.max(TriggerJob.id)).scalar() or 0
+        finally:
+            db.close()
+
+    def _claim(self, worker_id: str, partitions: List[int], limit: int, max_id: Optional[int]) -> List[Dict]:
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            query = db.query(TriggerJob).filter(
+                TriggerJob.partition.in_(partitions),
+                or_(
+                    TriggerJob.status == "queued",
+                    (TriggerJob.status == "processing") & (TriggerJob.lease_expires_at < now)
+                )
+            )
+            if max_id is not None:
+                query = query.filter(TriggerJob.id <= max_id)
+            candidates = query.order_by(TriggerJob.id).limit(limit).all()
+
+            claimed = []
+            for job in candidates:
+                if job.attempts >= self.max_attempts:
+                    # Триггер, на котором воркеры падают раз за разом, снимается с очереди
+                    job.status = "abandoned"
+                    self._stats["abandoned"] += 1
+                    continue
+                # Условное обновление: триггер получает только один воркер
+                updated = db.query(TriggerJob).filter(
+                    TriggerJob.id == job.id,
+                    TriggerJob.status == job.status,
+                    TriggerJob.attempts == job.attempts
+                ).update({
+                    TriggerJob.status: "processing",
+                    TriggerJob.attempts: job.attempts + 1,
+                    TriggerJob.lease_owner: worker_id,
+                    TriggerJob.lease_expires_at: now + timedelta(seconds=self.lease),
+                }, synchronize_session=False)
+                if updated:
+                    created_at = job.created_at or now
+                    if created_at.tzinfo is None:
+                        # SQLite возвращает время без часового пояса (UTC)
+                        created_at = created_at.replace(tzinfo=timezone.utc)
+                    claimed.append({**job.to_dict(), "age": (now - created_at).total_seconds()})
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    async def complete(self, job_id: int, status: str = "done"):
+        """
+        Отметка триггера выполненным (или устаревшим - status="expired").
+
+        status="failed" - ответ не отправлен, ключ можно зарезервировать повторно.
+        """
+        await asyncio.to_thread(self._complete, job_id, status)
+        self._stats[{"expired": "expired", "failed": "failed"}.get(status, "completed")] += 1
+
+    @staticmethod
+    def _complete(job_id: int, status: str):
+        db = SessionLocal()
+        try:
+            db.query(TriggerJob).filter(TriggerJob.id == job_id).update(
+                {TriggerJob.status: status, TriggerJob.lease_expires_at: None},
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def purge(self) -> int:
+        """Удаление завершенных триггеров и резервов старше TRIGGER_RETENTION секунд"""
+        return await asyncio.to_thread(self._purge)
+
+    def _purge(self) -> int:
+        db = SessionLocal()
+        try:
+            deleted = db.query(TriggerJob).filter(
+                TriggerJob.status.in_(["done", "expired", "abandoned", "failed", "reserved"]),
+                TriggerJob.updated_at < datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        """Публикации, дубликаты и обработанные триггеры очереди"""
+        return {
+            "partitions": self.partitions,
+            **self._stats,
+        }
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 import os
 from dotenv import load_dotenv
@@ -14,6 +15,8 @@ from database.seed_data import initialize_demo_data
 from database.models.campaign import Campaign
 from database.models.log import ActivityLog
 from database.models.company import CompanySettings
+from database.models.trigger_job import TriggerJob
+from database.models.chat_cursor import ChatCursor
 from backend.api.campaigns import router as campaigns_router
 from backend.api.logs import router as logs_router
 from backend.api.chats import router as chats_router, set_telegram_agent
@@ -23,6 +26,7 @@ from backend.api.analytics import router as analytics_router
 from backend.services.analytics_service import analytics_service
 # Statistics router removed during cleanup
 from backend.core.telegram_agent import TelegramAgent
+from backend.core.metrics import CONTENT_TYPE, metrics
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -110,6 +114,12 @@ async def root():
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики агента в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/health")
 async def health_check():
     """Проверка состояния системы"""
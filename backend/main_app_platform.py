@@ -6,6 +6,7 @@
 
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from sqlalchemy.orm import Session
 import os
 import asyncio
@@ -20,10 +21,12 @@ from database.seed_data import initialize_demo_data
 from backend.api.campaigns import router as campaigns_router
 from backend.api.logs import router as logs_router
 from backend.api.chats import router as chats_router, set_telegram_agent
+from backend.api.campaigns import set_telegram_agent as set_campaigns_agent
 from backend.api.company import router as company_router
 from backend.api.analytics import router as analytics_router
 from backend.services.analytics_service import analytics_service
 from backend.core.telegram_agent_app_platform import get_telegram_agent, stop_telegram_agent
+from backend.core.metrics import CONTENT_TYPE, metrics
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -70,9 +73,10 @@ async def startup_event():
     try:
         telegram_agent = await get_telegram_agent()
         
-        # Передаем агента в роутер чатов
+        # Передаем агента в роутеры (кампании уведомляют агента об изменениях)
         if telegram_agent:
             set_telegram_agent(telegram_agent)
+            set_campaigns_agent(telegram_agent)
         
         if telegram_agent and telegram_agent.is_authorized:
             print("🚀 Telegram Claude Agent запущен в App Platform режиме!")
@@ -179,6 +183,11 @@ async def health_check():
     
     return health_status
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики агента в текстовом формате Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.get("/telegram/status")
 async def telegram_status():
     """Детальный статус Telegram агента"""
@@ -210,6 +219,8 @@ async def restart_telegram_agent():
         
         # Запуск нового агента
         telegram_agent = await get_telegram_agent()
+        set_telegram_agent(telegram_agent)
+        set_campaigns_agent(telegram_agent)
         
         if telegram_agent and telegram_agent.is_authorized:
             return {
@@ -0,0 +1,49 @@
+"""
+Воркер обработки триггеров.
+
+Забирает из очереди в БД триггеры, опубликованные процессом приема
+(backend.main с AGENT_MODE=ingest), генерирует и отправляет ответы.
+Воркеров можно запустить несколько: каждый обрабатывает свои разделы
+очереди (WORKER_INDEX из WORKER_COUNT) со своей файловой сессией Telegram
+(TELEGRAM_SESSION_NAME).
+
+Запуск: python -m backend.worker
+"""
+
+import asyncio
+import signal
+import sys
+import os
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database.models.base import create_tables  # noqa: E402
+from backend.core.telegram_agent import TelegramAgent  # noqa: E402
+
+# Загрузка переменных окружения
+load_dotenv()
+
+
+async def main():
+    """Запуск воркера до получения сигнала остановки"""
+    create_tables()
+
+    agent = TelegramAgent(mode="worker")
+    if not await agent.initialize():
+        sys.exit(1)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    print("🚀 Воркер триггеров запущен!")
+    await stop_event.wait()
+
+    await agent.disconnect()
+    print("👋 Воркер триггеров остановлен!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
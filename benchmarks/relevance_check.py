@@ -0,0 +1,128 @@
+"""
+Бенчмарк проверки релевантности сообщения (TelegramAgentAppPlatform._is_message_relevant).
+
+Сравнивает стоимость одной проверки до и после переноса print/f-string логов
+в HotPathLogger. Прежняя реализация воспроизведена ниже; stdout перенаправлен
+в /dev/null, поэтому в консоли или в логах контейнера разница будет больше.
+
+Запуск: python benchmarks/relevance_check.py [--messages 20000] [--campaigns 20]
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.core.campaign_snapshot import CampaignSnapshot  # noqa: E402
+from backend.core.chat_index import ChatIndex  # noqa: E402
+from backend.core.keyword_matcher import KeywordMatcher  # noqa: E402
+from backend.core.telegram_agent_app_platform import TelegramAgentAppPlatform, logger  # noqa: E402
+
+CHAT_ID = 1987654321
+
+
+def legacy_is_message_relevant(agent, message, chat, campaign, is_comment=False, keyword_matches=None):
+    """Проверка релевантности до переноса логирования (print и f-string на каждый вызов)"""
+    logger.debug(f"Проверка релевантности для кампании '{campaign.name}': " +
+                 f"чат_ID={getattr(chat, 'id', 'None')}, " +
+                 f"username={getattr(chat, 'username', 'None')}, " +
+                 f"комментарий={is_comment}")
+
+    chat_matches = campaign.id in agent.chat_index.lookup(
+        getattr(chat, 'id', None),
+        getattr(chat, 'username', None)
+    )
+    if not chat_matches:
+        print("         ❌ Чат не соответствует кампании")
+        return False
+
+    if campaign.keywords and message.text:
+        if keyword_matches is None:
+            keyword_matches = agent.keyword_matcher.match(message.text, campaign_ids=[campaign.id])
+
+        message_text = message.text.lower()
+        print(f"            📝 Текст сообщения (lower): '{message_text}'")
+
+        keyword = keyword_matches.get(campaign.id)
+        if keyword is not None:
+            print(f"         ✅ Найдено ключевое слово: '{keyword}' в '{message_text}'")
+            return True
+        logger.debug(f"         Ключевые слова кампании '{campaign.name}' не найдены")
+    else:
+        print(
+            f"         ⚠️ Пропускаем проверку keywords: "
+            f"keywords={bool(campaign.keywords)}, message.text={bool(message.text)}"
+        )
+
+    print(f"         ❌ Сообщение не релевантно для кампании '{campaign.name}'")
+    return False
+
+
+def build_agent(campaigns_count: int):
+    campaigns = [
+        CampaignSnapshot.from_campaign(SimpleNamespace(
+            id=campaign_id,
+            name=f"Кампания {campaign_id}",
+            telegram_chats=[str(CHAT_ID)],
+            keywords=[f"товар{campaign_id}", "доставка", "цена"],
+            telegram_account=None,
+            ai_provider="claude",
+            claude_agent_id=None,
+            openai_model=None,
+            context_messages_count=3,
+            system_instruction="",
+            example_replies={},
+        ))
+        for campaign_id in range(1, campaigns_count + 1)
+    ]
+    agent = TelegramAgentAppPlatform.__new__(TelegramAgentAppPlatform)
+    agent.active_campaigns = campaigns
+    agent.keyword_matcher = KeywordMatcher(campaigns)
+    agent.chat_index = ChatIndex(campaigns)
+    return agent
+
+
+def run(check, agent, messages, chat) -> float:
+    """Среднее время обработки одного сообщения всеми кампаниями (мкс)"""
+    started = time.perf_counter()
+    for message in messages:
+        keyword_matches = agent.keyword_matcher.match(message.text)
+        for campaign in agent.active_campaigns:
+            check(message, chat, campaign, False, keyword_matches)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--campaigns", type=int, default=20)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    agent = build_agent(args.campaigns)
+    chat = SimpleNamespace(id=CHAT_ID, username="benchmark_chat", title="Benchmark")
+    texts = [
+        "Подскажите, какая цена доставки в регион? " * 3,
+        "Всем привет, кто был на встрече вчера?",
+        "Есть товар3 в наличии? Нужна быстрая доставка",
+    ]
+    messages = [
+        SimpleNamespace(id=index, text=texts[index % len(texts)], reply_to_msg_id=None)
+        for index in range(args.messages)
+    ]
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        before = run(lambda *check_args: legacy_is_message_relevant(agent, *check_args), agent, messages, chat)
+        after = run(agent._is_message_relevant, agent, messages, chat)
+
+    print(f"Сообщений: {args.messages}, кампаний в чате: {args.campaigns}")
+    print(f"До:    {before:8.1f} мкс/сообщение")
+    print(f"После: {after:8.1f} мкс/сообщение ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+-- Миграция: Происхождение триггера в логах активности
+-- Дата: 2026-10-17
+
+-- auto - триггер по ключевому слову, manual - принудительный запуск из API
+ALTER TABLE activity_logs ADD COLUMN IF NOT EXISTS source VARCHAR(20) NOT NULL DEFAULT 'auto';
+
+-- Уникальность только для автоматических триггеров: повторный ручной запуск
+-- того же сообщения записывается отдельной строкой
+-- (таблицы, созданные create_all, держат ключ как ограничение)
+ALTER TABLE activity_logs DROP CONSTRAINT IF EXISTS uq_activity_logs_message_campaign;
+DROP INDEX IF EXISTS uq_activity_logs_message_campaign;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_activity_logs_message_campaign
+    ON activity_logs (chat_id, message_id, campaign_id)
+    WHERE source = 'auto';
@@ -0,0 +1,5 @@
+-- Миграция: Длительности этапов обработки триггера в логах активности
+-- Дата: 2026-10-17
+
+-- Словарь «этап → мс»: match, context, prompt, llm_ttft, llm_total, send, log
+ALTER TABLE activity_logs ADD COLUMN IF NOT EXISTS stage_timings JSON;
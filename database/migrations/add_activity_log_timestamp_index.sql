@@ -0,0 +1,4 @@
+-- Миграция: Индекс времени логов активности (статистика за последние 24 часа)
+-- Дата: 2026-10-17
+
+CREATE INDEX IF NOT EXISTS ix_activity_logs_timestamp ON activity_logs (timestamp);
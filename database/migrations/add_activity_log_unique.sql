@@ -0,0 +1,13 @@
+-- Миграция: Идемпотентная обработка триггеров (одна запись лога на сообщение и кампанию)
+-- Дата: 2026-10-17
+
+-- Удаление накопившихся повторов (остается самая ранняя запись)
+DELETE FROM activity_logs a
+USING activity_logs b
+WHERE a.id > b.id
+  AND a.chat_id = b.chat_id
+  AND a.message_id = b.message_id
+  AND a.campaign_id = b.campaign_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_activity_logs_message_campaign
+    ON activity_logs (chat_id, message_id, campaign_id);
@@ -0,0 +1,16 @@
+-- Миграция: Дополнительные настройки кампании (лимиты частоты ответов и др.)
+-- Дата: 2026-10-17
+
+ALTER TABLE campaigns ADD COLUMN IF NOT EXISTS settings JSON;
+
+-- Пример: не более 1 ответа в чат за 30 секунд и 10 ответов кампании в минуту
+-- UPDATE campaigns SET settings = '{"rate_limits": {"chat": "1/30", "campaign": "10/60"}}' WHERE id = 1;
+
+-- Пример: кэш ответов на повторяющиеся вопросы с поиском похожих (сходство >= 0.8), 10 минут
+-- UPDATE campaigns SET settings = '{"response_cache": {"similarity": 0.8, "ttl": 600}}' WHERE id = 1;
+
+-- Пример: объединять триггеры из одного чата, пришедшие в течение 5 секунд, в один ответ
+-- UPDATE campaigns SET settings = '{"coalesce_window": 5}' WHERE id = 1;
+
+-- Пример: триггеры, не обработанные до перезапуска, досылаются только в течение 2 минут
+-- UPDATE campaigns SET settings = '{"max_trigger_age": 120}' WHERE id = 1;
@@ -0,0 +1,8 @@
+-- Миграция: Позиции обработки чатов (догрузка пропущенных сообщений после переподключения)
+-- Дата: 2026-10-17
+
+CREATE TABLE IF NOT EXISTS chat_cursors (
+    chat_id BIGINT PRIMARY KEY,
+    last_message_id INTEGER NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
@@ -0,0 +1,23 @@
+-- Миграция: Очередь триггеров между процессом приема и воркерами
+-- Дата: 2026-10-17
+
+CREATE TABLE IF NOT EXISTS trigger_jobs (
+    id SERIAL PRIMARY KEY,
+    campaign_id INTEGER NOT NULL,
+    chat_id BIGINT NOT NULL,
+    message_id INTEGER NOT NULL,
+    account VARCHAR(255),
+    trigger_keyword VARCHAR(255),
+    coalesced_message_ids JSON,
+    partition INTEGER NOT NULL,
+    status VARCHAR(50) DEFAULT 'queued',
+    attempts INTEGER DEFAULT 0,
+    lease_owner VARCHAR(255),
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    CONSTRAINT uq_trigger_jobs_message_campaign UNIQUE (chat_id, message_id, campaign_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_trigger_jobs_claim ON trigger_jobs (partition, status, id);
+CREATE INDEX IF NOT EXISTS ix_trigger_jobs_status ON trigger_jobs (status);
@@ -0,0 +1,35 @@
+-- Миграция: Маркированный ID чата в логах активности, повтор неудачных попыток
+-- Дата: 2026-10-17
+
+DROP INDEX IF EXISTS uq_activity_logs_message_campaign;
+
+-- Записи Telegram агента хранили repr Peer вместо маркированного ID (get_peer_id)
+UPDATE activity_logs
+SET chat_id = CAST(-(1000000000000 + CAST(substring(chat_id from 'channel_id=(\d+)') AS BIGINT)) AS VARCHAR)
+WHERE chat_id LIKE 'PeerChannel(%';
+
+UPDATE activity_logs
+SET chat_id = '-' || substring(chat_id from 'chat_id=(\d+)')
+WHERE chat_id LIKE 'PeerChat(%';
+
+UPDATE activity_logs
+SET chat_id = substring(chat_id from 'user_id=(\d+)')
+WHERE chat_id LIKE 'PeerUser(%';
+
+-- Записи App Platform агента (ID без маркировки) однозначно не восстанавливаются
+-- и остаются как есть; новые записи обоих агентов пишут маркированный ID
+
+-- После нормализации могут совпасть отправленные ответы (остается самый ранний)
+DELETE FROM activity_logs a
+USING activity_logs b
+WHERE a.id > b.id
+  AND a.chat_id = b.chat_id
+  AND a.message_id = b.message_id
+  AND a.campaign_id = b.campaign_id
+  AND a.source = 'auto' AND b.source = 'auto'
+  AND a.status = 'sent' AND b.status = 'sent';
+
+-- Уникален только отправленный ответ: неудачная попытка не блокирует повтор
+CREATE UNIQUE INDEX IF NOT EXISTS uq_activity_logs_message_campaign
+    ON activity_logs (chat_id, message_id, campaign_id)
+    WHERE source = 'auto' AND status = 'sent';
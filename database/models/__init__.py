@@ -1,9 +1,11 @@
 from .campaign import Campaign
 from .log import ActivityLog  
 from .company import CompanySettings
+from .trigger_job import TriggerJob
+from .chat_cursor import ChatCursor
 # Statistics models removed during cleanup
 from .base import Base
 
 __all__ = [
-    "Campaign", "ActivityLog", "CompanySettings", "Base"
+    "Campaign", "ActivityLog", "CompanySettings", "TriggerJob", "ChatCursor", "Base"
 ]
\ No newline at end of file
@@ -30,6 +30,9 @@ class Campaign(Base):
     system_instruction = Column(Text, nullable=False)      # Системная подсказка
     example_replies = Column(JSON, nullable=True)          # Примеры ответов по ключевым словам
     
+    # Дополнительные настройки (например, лимиты частоты ответов)
+    settings = Column(JSON, nullable=True)
+    
     # Метаданные
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -55,6 +58,7 @@ class Campaign(Base):
             "context_messages_count": self.context_messages_count,
             "system_instruction": self.system_instruction,
             "example_replies": self.example_replies,
+            "settings": self.settings,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
\ No newline at end of file
@@ -0,0 +1,18 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime
+from sqlalchemy.sql import func
+from .base import Base
+
+
+class ChatCursor(Base):
+    """
+    Модель позиции обработки чата - последнее обработанное сообщение
+    (для догрузки пропущенных сообщений после переподключения)
+    """
+    __tablename__ = "chat_cursors"
+
+    chat_id = Column(BigInteger, primary_key=True)   # Маркированный ID чата
+    last_message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<ChatCursor(chat_id={self.chat_id}, last_message_id={self.last_message_id})>"
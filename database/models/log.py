@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Index, text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .base import Base
@@ -9,6 +9,18 @@ class ActivityLog(Base):
     Модель логов активности агента - история всех действий
     """
     __tablename__ = "activity_logs"
+    __table_args__ = (
+        # Один отправленный ответ на сообщение и кампанию (chat_id - маркированный ID чата).
+        # Неудачные попытки и принудительные запуски из API (source = 'manual')
+        # пишутся отдельными записями
+        Index(
+            "uq_activity_logs_message_campaign",
+            "chat_id", "message_id", "campaign_id",
+            unique=True,
+            postgresql_where=text("source = 'auto' AND status = 'sent'"),
+            sqlite_where=text("source = 'auto' AND status = 'sent'"),
+        ),
+    )
 
     # Основные поля
     id = Column(Integer, primary_key=True, index=True)
@@ -26,12 +38,14 @@ class ActivityLog(Base):
     agent_response = Column(Text, nullable=False)    # Ответ агента
     
     # Статус и результат
-    status = Column(String(50), default="sent", index=True)  # sent, failed, pending
+    status = Column(String(50), default="sent", index=True)  # sent, failed, pending, rate_limited, coalesced
     error_message = Column(Text, nullable=True)
     processing_time_ms = Column(Integer, nullable=True)  # Время обработки в мс
+    stage_timings = Column(JSON(none_as_null=True), nullable=True)  # Время этапов обработки в мс (match, context, prompt, llm_ttft, llm_total, send, log)
     
     # Метаданные
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    source = Column(String(20), nullable=False, default="auto", server_default="auto")  # auto, manual
+    timestamp = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     
     # Связи
     campaign = relationship("Campaign", backref="activity_logs")
@@ -54,5 +68,7 @@ class ActivityLog(Base):
             "status": self.status,
             "error_message": self.error_message,
             "processing_time_ms": self.processing_time_ms,
+            "stage_timings": self.stage_timings,
+            "source": self.source,
             "timestamp": self.timestamp.isoformat() if self.timestamp else None,
         }
\ No newline at end of file
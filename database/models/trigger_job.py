@@ -0,0 +1,59 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, JSON, UniqueConstraint, Index
+from sqlalchemy.sql import func
+from .base import Base
+
+
+class TriggerJob(Base):
+    """
+    Модель очереди триггеров - сработавшие кампании между приемом сообщений
+    и их обработкой воркерами
+    """
+    __tablename__ = "trigger_jobs"
+    __table_args__ = (
+        # Один триггер на сообщение и кампанию (повторная публикация отбрасывается)
+        UniqueConstraint("chat_id", "message_id", "campaign_id", name="uq_trigger_jobs_message_campaign"),
+        Index("ix_trigger_jobs_claim", "partition", "status", "id"),
+    )
+
+    # Основные поля
+    id = Column(Integer, primary_key=True, index=True)
+    campaign_id = Column(Integer, nullable=False)
+    
+    # Telegram данные
+    chat_id = Column(BigInteger, nullable=False)     # Маркированный ID чата
+    message_id = Column(Integer, nullable=False)
+    account = Column(String(255), nullable=True)     # Аккаунт, получивший сообщение
+    trigger_keyword = Column(String(255), nullable=True)
+    coalesced_message_ids = Column(JSON, nullable=True)  # Объединенные с триггером сообщения
+    
+    # Очередь
+    partition = Column(Integer, nullable=False)       # Раздел очереди (по ID чата)
+    # queued, reserved, processing, done, failed, expired, abandoned
+    status = Column(String(50), default="queued", index=True)
+    attempts = Column(Integer, default=0)
+    lease_owner = Column(String(255), nullable=True)  # Воркер, взявший триггер
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    
+    # Метаданные
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<TriggerJob(id={self.id}, chat_id={self.chat_id}, message_id={self.message_id}, status='{self.status}')>"
+    
+    def to_dict(self):
+        """Преобразование объекта в словарь для API"""
+        return {
+            "id": self.id,
+            "campaign_id": self.campaign_id,
+            "chat_id": self.chat_id,
+            "message_id": self.message_id,
+            "account": self.account,
+            "trigger_keyword": self.trigger_keyword,
+            "coalesced_message_ids": self.coalesced_message_ids or [],
+            "partition": self.partition,
+            "status": self.status,
+            "attempts": self.attempts,
+            "lease_owner": self.lease_owner,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Окружение до импорта модулей backend: фиктивный Telegram API и отдельная SQLite БД
+os.environ.setdefault("TELEGRAM_API_ID", "12345")
+os.environ.setdefault("TELEGRAM_API_HASH", "test-hash")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+os.environ.setdefault("ACTIVITY_LOG_SPILL_PATH", os.path.join(tempfile.mkdtemp(), "spill.jsonl"))
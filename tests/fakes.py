@@ -0,0 +1,128 @@
+"""Локальные заменители Telegram клиента, сообщений и событий для тестов без сети"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from telethon.tl.types import PeerChannel, PeerUser
+
+from backend.core.campaign_snapshot import CampaignSnapshot
+from backend.core.catch_up import ReconnectAwareClient
+
+
+class FakeDialog:
+    def __init__(self, entity):
+        self.entity = entity
+
+
+class FakeClient:
+    """
+    Клиент с интерфейсом TelegramClient, который ничего не отправляет в сеть.
+
+    dialogs - сущности для iter_dialogs, sent - отправленные сообщения.
+    """
+
+    def __init__(self, session=None, api_id=None, api_hash=None, dialogs: Iterable = (), authorized: bool = True):
+        self.session = session
+        self.dialogs = list(dialogs)
+        self.authorized = authorized
+        self.connected = False
+        self.handlers: List = []
+        self.sent: List = []
+        self._reconnect_callbacks: List = []
+
+    # Регистрация колбэков переподключения как у ReconnectAwareClient
+    on_reconnect = ReconnectAwareClient.on_reconnect
+
+    async def start(self, phone=None):
+        self.connected = True
+        return self
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def is_user_authorized(self) -> bool:
+        return self.authorized
+
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, event))
+
+    async def iter_dialogs(self, limit: Optional[int] = None):
+        for entity in self.dialogs[:limit]:
+            yield FakeDialog(entity)
+
+    async def send_message(self, entity, message, reply_to=None):
+        sent = FakeMessage(len(self.sent) + 1, message, chat_id=entity, client=self, out=True)
+        self.sent.append(sent)
+        return sent
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        message_id: int,
+        text: str,
+        chat_id: int = 100,
+        client=None,
+        out: bool = False,
+        reply_to_msg_id: Optional[int] = None,
+        sender_id: int = 1
+    ):
+        self.id = message_id
+        self.text = text
+        self.message = text
+        self.peer_id = PeerChannel(chat_id) if chat_id > 0 else PeerUser(-chat_id)
+        self.chat_id = chat_id
+        self.client = client
+        self.out = out
+        self.reply_to_msg_id = reply_to_msg_id
+        self.sender_id = sender_id
+        self.date = datetime.now(timezone.utc)
+
+    async def reply(self, text):
+        return FakeMessage(self.id + 1000, text, chat_id=self.chat_id, client=self.client, out=True)
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, title: str = "Test chat", username: Optional[str] = None):
+        self.id = chat_id
+        self.title = title
+        self.username = username
+
+
+class FakeEvent:
+    """Событие NewMessage: сообщение, чат и клиент, получивший событие"""
+
+    def __init__(self, message: FakeMessage, chat: FakeChat, client=None):
+        self.message = message
+        self.chat = chat
+        self.chat_id = chat.id
+        self.client = client
+
+    async def get_chat(self):
+        return self.chat
+
+
+def make_campaign(campaign_id: int = 1, **overrides) -> CampaignSnapshot:
+    """Снимок кампании с разумными значениями по умолчанию"""
+    fields: Dict = dict(
+        id=campaign_id,
+        name=f"campaign-{campaign_id}",
+        telegram_chats=("100",),
+        keywords=("цена",),
+        telegram_account="default",
+        ai_provider="openai",
+        claude_agent_id=None,
+        openai_model="gpt-4",
+        context_messages_count=3,
+        system_instruction="Отвечай кратко",
+        example_replies={},
+        settings={},
+        system_prompt="system",
+    )
+    fields.update(overrides)
+    return CampaignSnapshot(**fields)
@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy.exc import OperationalError
+
+from backend.core import telegram_agent as telegram_agent_module
+from backend.core.activity_log_writer import ActivityLogWriter
+from backend.core.entity_cache import entity_cache
+from database.models.base import SessionLocal, create_tables
+from database.models.log import ActivityLog
+from tests.fakes import FakeChat, FakeClient, FakeMessage, make_campaign
+
+
+def log_row(message_id, source="auto", status="sent"):
+    return {
+        "campaign_id": 1,
+        "chat_id": "-1000000000100",
+        "chat_title": "Test chat",
+        "message_id": message_id,
+        "trigger_keyword": "цена",
+        "context_messages": [],
+        "original_message": "Какая цена?",
+        "agent_response": "Ответ",
+        "status": status,
+        "timestamp": datetime.now(timezone.utc),
+        "source": source,
+    }
+
+
+def count_rows(message_id):
+    db = SessionLocal()
+    try:
+        return db.query(ActivityLog).filter(ActivityLog.message_id == message_id).count()
+    finally:
+        db.close()
+
+
+def test_repeated_auto_trigger_is_dropped_but_manual_rerun_is_kept():
+    create_tables()
+    writer = ActivityLogWriter()
+
+    assert writer._insert([log_row(501)]) == 0
+    assert writer._insert([log_row(501)]) == 1
+    assert writer._insert([log_row(501, "manual"), log_row(501, "manual")]) == 0
+    assert count_rows(501) == 3
+
+
+def test_failed_attempt_does_not_block_sent_retry():
+    create_tables()
+    writer = ActivityLogWriter()
+
+    assert writer._insert([log_row(502, status="failed")]) == 0
+    assert writer._insert([log_row(502)]) == 0
+    assert count_rows(502) == 2
+
+
+def test_rows_spill_to_disk_while_db_is_down_and_replay_later(tmp_path, monkeypatch):
+    create_tables()
+    spill_path = tmp_path / "spill.jsonl"
+    writer = ActivityLogWriter(batch_size=2, spill_path=str(spill_path))
+
+    def db_down(rows):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    async def scenario():
+        monkeypatch.setattr(writer, "_insert", db_down)
+        for message_id in (601, 602, 603):
+            writer.write(**log_row(message_id))
+        await writer.flush()
+
+        # Пакет и остаток буфера ушли на диск, в памяти ничего не держится
+        assert writer.stats()["buffered"] == 0
+        assert len(spill_path.read_text(encoding="utf-8").splitlines()) == 3
+        assert count_rows(601) == 0
+
+        # БД снова доступна: следующий сброс догружает файл
+        monkeypatch.undo()
+        writer.write(**log_row(604))
+        await writer.flush()
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+    assert [count_rows(message_id) for message_id in (601, 602, 603, 604)] == [1, 1, 1, 1]
+    assert not spill_path.exists()
+    stats = writer.stats()
+    assert stats["spilled"] == 3 and stats["replayed"] == 3 and stats["failed_batches"] == 1
+
+
+def test_log_activity_resolves_chat_with_owning_account(monkeypatch):
+    monkeypatch.setattr(telegram_agent_module, "ReconnectAwareClient", FakeClient)
+    agent = telegram_agent_module.TelegramAgent()
+    second = agent.client_pool.add_account("second", 1, "hash")
+    second.started = True
+
+    resolved_with = []
+
+    async def get_entity(client, peer, store=True):
+        resolved_with.append((client, store))
+        return FakeChat(100)
+
+    monkeypatch.setattr(entity_cache, "get_entity", get_entity)
+
+    async def scenario():
+        message = FakeMessage(10, "Какая цена?", client=second.client)
+        await agent.log_activity(make_campaign(1), message, [], "Ответ", "sent", source="manual")
+
+    asyncio.run(scenario())
+    # Сущность чужого аккаунта не попадает в общий кэш
+    assert resolved_with == [(second.client, False)]
+    row = agent.activity_log_writer._buffer[-1]
+    assert row["source"] == "manual" and row["chat_title"] == "Test chat"
+    # Маркированный ID чата, как у App Platform агента
+    assert row["chat_id"] == "-1000000000100"
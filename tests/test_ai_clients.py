@@ -0,0 +1,160 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.core import ai_clients
+from backend.core.ai_clients import SimpleClaudeClient, SimpleOpenAIClient, close_http_client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Ответы в формате OpenAI и Anthropic с задержкой и учетом одновременных запросов"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with stub.lock:
+            stub.in_flight += 1
+            stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+            stub.client_ports.add(self.client_address[1])
+        try:
+            time.sleep(stub.delay)
+            if self.path.endswith("/messages"):
+                payload = json.dumps({
+                    "id": "msg_1",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": body["model"],
+                    "content": [{"type": "text", "text": "Ответ Claude"}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {"input_tokens": 10, "output_tokens": 3},
+                })
+                content_type = "application/json"
+            elif body.get("stream"):
+                events = [
+                    {"choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+                    for text in ("Отв", "ет")
+                ]
+                payload = "".join(
+                    "data: " + json.dumps({
+                        "id": "chunk", "object": "chat.completion.chunk", "created": 0,
+                        "model": body["model"], **event,
+                    }) + "\n\n"
+                    for event in events
+                ) + "data: [DONE]\n\n"
+                content_type = "text/event-stream"
+            else:
+                payload = json.dumps({
+                    "id": "chatcmpl-1",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "Ответ OpenAI"},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+                })
+                content_type = "application/json"
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+        data = payload.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class Stub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.delay = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.client_ports = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    stub = Stub()
+    thread = threading.Thread(target=stub.server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{stub.url}/v1")
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", stub.url)
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    ai_clients._http_clients.clear()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def test_clients_share_connection_pool(stub):
+    async def scenario():
+        first, second = SimpleOpenAIClient(), SimpleOpenAIClient()
+        assert first.client._client is second.client._client
+        assert SimpleClaudeClient().client._client is not first.client._client
+
+        for client in (first, second, first):
+            assert await client.generate_response("Привет") == "Ответ OpenAI"
+        await close_http_client()
+
+    asyncio.run(scenario())
+    # Последовательные запросы обоих клиентов идут через одно keep-alive соединение
+    assert len(stub.client_ports) == 1
+
+
+def test_concurrency_is_capped_per_provider(stub, monkeypatch):
+    monkeypatch.setenv("OPENAI_MAX_CONCURRENCY", "2")
+    monkeypatch.setenv("CLAUDE_MAX_CONCURRENCY", "2")
+    stub.delay = 0.1
+
+    async def scenario():
+        openai_client = SimpleOpenAIClient()
+        responses = await asyncio.gather(*(openai_client.generate_response("Привет") for _ in range(6)))
+        assert responses == ["Ответ OpenAI"] * 6
+        assert stub.max_in_flight == 2
+
+        stub.max_in_flight = 0
+        claude_client = SimpleClaudeClient()
+        responses = await asyncio.gather(*(claude_client.generate_response("Привет") for _ in range(6)))
+        assert responses == ["Ответ Claude"] * 6
+        assert stub.max_in_flight == 2
+        await close_http_client()
+
+    asyncio.run(scenario())
+
+
+def test_stream_does_not_hold_slot_while_consumer_works(stub, monkeypatch):
+    monkeypatch.setenv("OPENAI_MAX_CONCURRENCY", "1")
+
+    async def scenario():
+        client = SimpleOpenAIClient()
+        chunks = []
+        async for text in client.stream_response("Привет"):
+            if not chunks:
+                # Пока потребитель обрабатывает фрагмент, слот провайдера свободен
+                response = await asyncio.wait_for(client.generate_response("Привет"), timeout=5)
+                assert response == "Ответ OpenAI"
+            chunks.append(text)
+        assert "".join(chunks) == "Ответ"
+        await close_http_client()
+
+    asyncio.run(scenario())
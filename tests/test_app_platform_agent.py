@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from backend.core import telegram_agent_app_platform as app_platform
+from backend.core.metrics import keyword_matches_total
+from database.models.base import create_tables
+from tests.fakes import FakeChat, FakeClient, FakeEvent, FakeMessage, make_campaign
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setattr(app_platform, "ReconnectAwareClient", FakeClient)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    return app_platform.TelegramAgentAppPlatform()
+
+
+def test_handle_message_dispatches_matching_trigger(agent):
+    async def scenario():
+        agent.active_campaigns = [make_campaign(1, telegram_chats=("100",), keywords=("цена",))]
+        await agent._rebuild_indexes()
+
+        matches_before = keyword_matches_total._values.get(("1",), 0)
+        event = FakeEvent(FakeMessage(10, "Какая цена доставки?"), FakeChat(100), agent.client)
+        await agent._handle_message(event)
+
+        assert agent.trigger_pipeline.pending == 1
+        assert keyword_matches_total._values[("1",)] == matches_before + 1
+
+    asyncio.run(scenario())
+
+
+def test_handle_message_ignores_text_without_keywords(agent):
+    async def scenario():
+        agent.active_campaigns = [make_campaign(1, telegram_chats=("100",), keywords=("цена",))]
+        await agent._rebuild_indexes()
+
+        await agent._handle_message(FakeEvent(FakeMessage(11, "Привет всем"), FakeChat(100), agent.client))
+
+        assert agent.trigger_pipeline.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_build_ai_prompt_reuses_snapshot_system_prompt(agent):
+    campaign = make_campaign(1, system_prompt="Готовый системный промпт")
+    system, prompt = agent._build_ai_prompt({"message": "Какая цена?", "chat_name": "Test chat"}, campaign)
+
+    assert system is campaign.system_prompt
+    assert "Какая цена?" in prompt and "Test chat" in prompt
+
+
+def test_undelivered_reply_is_logged_failed(agent, monkeypatch):
+    logged = []
+
+    async def generate(context, campaign, timings=None):
+        return "Ответ"
+
+    async def send(*args, **kwargs):
+        return None
+
+    async def log_activity(context, response, campaign, status=None, error_message=None, timings=None):
+        logged.append((response, status))
+
+    monkeypatch.setattr(agent, "_generate_ai_response", generate)
+    monkeypatch.setattr(agent, "_send_response", send)
+    monkeypatch.setattr(agent, "_log_activity", log_activity)
+
+    message = FakeMessage(10, "Какая цена?")
+    asyncio.run(agent._process_message_for_campaign(message, FakeChat(100), make_campaign(1)))
+
+    assert logged == [("Ответ", "failed")]
+
+
+def test_replay_after_restart_is_not_answered_twice(monkeypatch):
+    monkeypatch.setattr(app_platform, "ReconnectAwareClient", FakeClient)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("ANTHROPIC_API_KEY", raising=False)
+    create_tables()
+
+    async def scenario():
+        pending = []
+        # Второй агент - процесс после перезапуска: недавние триггеры в памяти потеряны,
+        # догрузка передает то же сообщение обычному диспетчеру
+        for _ in range(2):
+            agent = app_platform.TelegramAgentAppPlatform()
+            agent.active_campaigns = [make_campaign(72, telegram_chats=("720",), keywords=("цена",))]
+            await agent._rebuild_indexes()
+            message = FakeMessage(12, "Какая цена доставки?", chat_id=720)
+            await agent._handle_message(FakeEvent(message, FakeChat(720), agent.client))
+            pending.append(agent.trigger_pipeline.pending)
+
+        assert pending == [1, 0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+from backend.core.chat_index import ChatIndex
+from backend.core.client_pool import ClientPool
+from tests.fakes import FakeClient, make_campaign
+
+
+def channel(channel_id, username=None):
+    entity = PeerChannel(channel_id)
+    entity.username = username
+    return entity
+
+
+def make_pool(*accounts):
+    """Пул из аккаунтов (имя, телефон, сущности диалогов); первый - основной"""
+    pool = ClientPool(client_factory=FakeClient)
+    for name, phone, dialogs in accounts:
+        pool.add_account(name, 1, "hash", phone=phone).client.dialogs = list(dialogs)
+    asyncio.run(pool.start([]))
+    return pool
+
+
+def test_assign_chats_balances_monitored_chats_only():
+    pool = make_pool(
+        ("main", "+79000000001", [channel(1), channel(2), channel(3, "shop"), channel(9)]),
+        ("second", "+79000000002", [channel(1), channel(2), channel(3, "shop")]),
+    )
+    chat_index = ChatIndex([
+        make_campaign(1, telegram_chats=("1", "2")),
+        make_campaign(2, telegram_chats=("@shop",)),
+    ])
+
+    assert asyncio.run(pool.assign_chats(chat_index)) == 3
+
+    owners = {chat: pool._chat_owners[get_peer_id(channel(chat))] for chat in (1, 2, 3)}
+    assert owners == {1: "main", 2: "second", 3: "main"}
+    # Неотслеживаемый чат не распределяется
+    assert get_peer_id(channel(9)) not in pool._chat_owners
+    assert pool.accounts["main"].owned_chats + pool.accounts["second"].owned_chats == 3
+
+
+def test_assign_chats_without_index_takes_all_dialogs():
+    pool = make_pool(("main", None, [channel(1), channel(2)]))
+    assert asyncio.run(pool.assign_chats()) == 2
+
+
+def test_owns_chat_follows_assignment_and_claims_new_chats():
+    pool = make_pool(
+        ("main", None, [channel(1)]),
+        ("second", None, [channel(2)]),
+    )
+    asyncio.run(pool.assign_chats())
+    main, second = pool.accounts["main"].client, pool.accounts["second"].client
+    first_chat, second_chat, new_chat = (get_peer_id(channel(chat)) for chat in (1, 2, 3))
+
+    assert pool.owns_chat(main, first_chat) and not pool.owns_chat(second, first_chat)
+    assert pool.owns_chat(second, second_chat) and not pool.owns_chat(main, second_chat)
+
+    # Новый чат закрепляется за первым аккаунтом, получившим из него событие
+    assert pool.owns_chat(second, new_chat)
+    assert not pool.owns_chat(main, new_chat)
+    assert pool.accounts["second"].owned_chats == 2
+
+
+def test_owns_chat_single_account_handles_everything():
+    pool = make_pool(("main", None, []))
+    assert pool.owns_chat(pool.primary.client, 12345)
+
+
+def test_account_for_campaign_resolves_name_and_phone():
+    pool = make_pool(
+        ("main", "+79000000001", []),
+        ("Sales", "+79000000002", []),
+    )
+    sales = pool.accounts["Sales"]
+
+    assert pool.account_for_campaign(SimpleNamespace(telegram_account="sales")) is sales
+    assert pool.account_for_campaign(SimpleNamespace(telegram_account="+7 900 000 00 02")) is sales
+    assert pool.account_for_campaign(make_campaign(telegram_account="unknown")) is pool.primary
+    assert pool.account_for_campaign(SimpleNamespace(telegram_account=None)) is pool.primary
+
+
+def test_account_for_campaign_falls_back_when_account_is_not_started():
+    pool = ClientPool(client_factory=FakeClient)
+    pool.add_account("main", 1, "hash")
+    pool.add_account("offline", 1, "hash").client.authorized = False
+    asyncio.run(pool.start([]))
+
+    assert not pool.accounts["offline"].started
+    assert pool.account_for_campaign(make_campaign(telegram_account="offline")) is pool.primary
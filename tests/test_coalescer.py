@@ -0,0 +1,88 @@
+import asyncio
+
+from backend.core import telegram_agent as telegram_agent_module
+from backend.core.coalescer import TriggerCoalescer, coalesce_window
+from backend.core.stage_timings import StageTimings
+from database.models.base import create_tables
+from tests.fakes import FakeClient, FakeMessage, make_campaign
+
+
+def test_window_flushes_burst_once_on_timeout():
+    async def scenario():
+        coalescer = TriggerCoalescer()
+        flushed = []
+
+        async def flush(key, items):
+            flushed.append((key, items))
+
+        for item in ("first", "second", "third"):
+            await coalescer.add("chat", 0.05, item, flush)
+        assert flushed == [] and coalescer.stats()["open_windows"] == 1
+
+        await asyncio.sleep(0.1)
+        assert flushed == [("chat", ["first", "second", "third"])]
+        assert coalescer.stats() == {"open_windows": 0, "batches": 1, "merged": 2}
+
+    asyncio.run(scenario())
+
+
+def test_zero_window_flushes_immediately_and_stop_flushes_open_windows():
+    async def scenario():
+        coalescer = TriggerCoalescer()
+        flushed = []
+
+        async def flush(key, items):
+            flushed.append((key, items))
+
+        await coalescer.add("direct", 0, "now", flush)
+        await coalescer.add("open", 60, "pending", flush)
+        await coalescer.stop()
+
+        assert flushed == [("direct", ["now"]), ("open", ["pending"])]
+
+    asyncio.run(scenario())
+
+
+def test_coalesce_window_reads_campaign_setting(monkeypatch):
+    monkeypatch.setenv("COALESCE_WINDOW", "2")
+    assert coalesce_window(make_campaign(1, settings={"coalesce_window": 5})) == 5.0
+    assert coalesce_window(make_campaign(1)) == 2.0
+    assert coalesce_window(make_campaign(1, settings={"coalesce_window": "bad"})) == 0.0
+
+
+def test_burst_produces_one_generation_for_latest_message(monkeypatch):
+    monkeypatch.setattr(telegram_agent_module, "ReconnectAwareClient", FakeClient)
+    create_tables()
+    agent = telegram_agent_module.TelegramAgent()
+    # Только резерв ключа: в очереди не остается триггеров для других тестов
+    agent.durable_triggers = False
+    campaign = make_campaign(73, settings={"coalesce_window": 0.05})
+    chat_id = -1000000000730
+    submitted = []
+    logged = []
+
+    async def submit(key, campaign, message, trigger_keyword=None, coalesced_messages=None, **kwargs):
+        submitted.append((message.id, [merged.id for merged in coalesced_messages]))
+
+    async def log_activity(campaign, message, context_messages, response, status, **kwargs):
+        logged.append((message.id, status))
+
+    agent.trigger_pipeline.submit = submit
+    monkeypatch.setattr(agent, "log_activity", log_activity)
+
+    async def scenario():
+        for message_id in (21, 22, 23):
+            message = FakeMessage(message_id, "Какая цена?", chat_id=730)
+            await agent.trigger_coalescer.add(
+                (chat_id, campaign.id),
+                coalesce_window(campaign),
+                (campaign, message, "цена", StageTimings()),
+                agent._dispatch_trigger
+            )
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+
+    # Один ответ на последнее сообщение, ранние сообщения всплеска идут в его контекст
+    assert submitted == [(23, [21, 22])]
+    assert logged == [(21, "coalesced"), (22, "coalesced")]
@@ -0,0 +1,37 @@
+import asyncio
+
+from telethon.tl.types import PeerChannel
+
+from backend.core.entity_cache import EntityCache
+
+
+class EntityClient:
+    def __init__(self):
+        self.requests = []
+
+    async def get_entity(self, peer):
+        self.requests.append(peer)
+        entity = PeerChannel(100)
+        entity.username = "shop"
+        return entity
+
+
+def test_get_entity_caches_by_id_and_username():
+    cache = EntityCache(max_size=10, ttl=60)
+    client = EntityClient()
+
+    entity = asyncio.run(cache.get_entity(client, "-1000000000100"))
+    assert client.requests == [-1000000000100]
+    assert cache.get("@shop") is entity
+    assert asyncio.run(cache.get_entity(client, -1000000000100)) is entity
+    assert len(client.requests) == 1
+
+
+def test_get_entity_without_store_leaves_cache_untouched():
+    cache = EntityCache(max_size=10, ttl=60)
+    client = EntityClient()
+
+    asyncio.run(cache.get_entity(client, -1000000000100, store=False))
+    assert cache.get(-1000000000100) is None
+    asyncio.run(cache.get_entity(client, -1000000000100, store=False))
+    assert len(client.requests) == 2
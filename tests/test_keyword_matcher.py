@@ -0,0 +1,62 @@
+from backend.core.keyword_matcher import KeywordMatcher, normalize_keywords
+from tests.fakes import make_campaign
+
+
+def matcher(**campaign_keywords):
+    return KeywordMatcher([
+        make_campaign(int(campaign_id.lstrip("c")), keywords=tuple(keywords))
+        for campaign_id, keywords in campaign_keywords.items()
+    ])
+
+
+def test_keywords_at_text_boundaries():
+    keywords = matcher(c1=["цена"])
+
+    assert keywords.match("цена") == {1: "цена"}
+    assert keywords.match("цена?") == {1: "цена"}
+    assert keywords.match("Какая ЦЕНА") == {1: "цена"}
+    assert keywords.match("це на") == {}
+    assert keywords.match("цен") == {}
+    assert keywords.match("") == {}
+    assert keywords.match(None) == {}
+
+
+def test_substring_semantics_match_inside_words():
+    # Как и прежняя проверка «keyword in text»: совпадение без учета границ слов
+    assert matcher(c1=["цен"]).match("Бесценно") == {1: "цен"}
+
+
+def test_overlapping_keywords_of_different_campaigns():
+    keywords = matcher(c1=["he"], c2=["she"], c3=["hers"])
+
+    assert keywords.match("ushers") == {1: "he", 2: "she", 3: "hers"}
+    assert keywords.match("usher") == {1: "he", 2: "she"}
+
+
+def test_keyword_found_through_failure_link():
+    # После неудачи на «цены» автомат переходит по суффиксной ссылке к «ценник»
+    keywords = matcher(c1=["цены"], c2=["ценник"])
+
+    assert keywords.match("ценник") == {2: "ценник"}
+    assert keywords.match("ценыценник") == {1: "цены", 2: "ценник"}
+
+
+def test_first_keyword_in_text_wins_per_campaign():
+    keywords = matcher(c1=["доставка", "цена"])
+
+    assert keywords.match("цена и доставка") == {1: "цена"}
+    assert keywords.match("доставка и цена") == {1: "доставка"}
+
+
+def test_campaign_filter_and_empty_matcher():
+    keywords = matcher(c1=["цена"], c2=["цена"])
+
+    assert keywords.match("цена", campaign_ids=[2]) == {2: "цена"}
+    assert not KeywordMatcher()
+    assert KeywordMatcher().match("цена") == {}
+
+
+def test_normalize_keywords_formats():
+    assert normalize_keywords(" Цена, доставка ,цена,") == ["цена", "доставка"]
+    assert normalize_keywords(["Цена", "", "ЦЕНА"]) == ["цена"]
+    assert normalize_keywords(None) == []
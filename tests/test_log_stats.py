@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from backend.api.logs import get_campaign_stats, get_system_overview
+from database.models.base import SessionLocal, create_tables
+from database.models.campaign import Campaign
+from database.models.log import ActivityLog
+
+
+def test_stats_split_totals_and_last_24h():
+    create_tables()
+    db = SessionLocal()
+    try:
+        campaign = Campaign(
+            id=9001,
+            name="Статистика",
+            telegram_chats=["100"],
+            keywords=["цена"],
+            telegram_account="default",
+            system_instruction="Отвечай кратко",
+        )
+        db.add(campaign)
+        db.commit()
+
+        now = datetime.utcnow()
+        for message_id, status, processing_time, age in (
+            (1, "sent", 100, timedelta(hours=1)),
+            (2, "sent", 300, timedelta(hours=2)),
+            (3, "failed", None, timedelta(hours=3)),
+            (4, "sent", 200, timedelta(days=3)),
+        ):
+            db.add(ActivityLog(
+                campaign_id=campaign.id,
+                chat_id="-1000000000100",
+                message_id=message_id,
+                trigger_keyword="цена",
+                original_message="Какая цена?",
+                agent_response="Ответ",
+                status=status,
+                processing_time_ms=processing_time,
+                timestamp=now - age,
+            ))
+        db.commit()
+        overview_before = asyncio.run(get_system_overview(db))
+
+        stats = asyncio.run(get_campaign_stats(campaign.id, db))
+        assert stats["total_responses"] == 4
+        assert stats["responses_24h"] == 3
+        assert stats["status_breakdown"]["sent"] == 3
+        assert stats["status_breakdown"]["failed"] == 1
+        assert stats["avg_processing_time_ms"] == 200
+        # В SQLite нет percentile_cont
+        assert stats["processing_time_percentiles_ms"] is None
+
+        assert overview_before["responses"]["last_24h"] >= 3
+        assert overview_before["responses"]["status_24h"]["sent"] >= 2
+        assert overview_before["responses"]["total"] >= overview_before["responses"]["last_24h"] + 1
+    finally:
+        db.close()
@@ -0,0 +1,42 @@
+from backend.core.message_buffer import MessageBuffer
+from tests.fakes import FakeMessage
+
+
+class BufferedMessage(FakeMessage):
+    from_id = None
+
+
+def fill(buffer, chat_key, message_ids):
+    for message_id in message_ids:
+        buffer.add(chat_key, BufferedMessage(message_id, f"text {message_id}"))
+
+
+def test_context_survives_newer_messages_while_trigger_waits():
+    buffer = MessageBuffer(slack=5)
+    buffer.resize(3)
+    fill(buffer, 1, range(1, 5))
+
+    # Пока триггер 4 ждал в очереди, в чат пришли новые сообщения
+    fill(buffer, 1, range(5, 9))
+
+    context = buffer.get_context(1, 4, 3)
+    assert [record["id"] for record in context] == [3, 2, 1]
+
+
+def test_context_miss_when_history_is_incomplete():
+    buffer = MessageBuffer(slack=0)
+    buffer.resize(3)
+    fill(buffer, 1, range(1, 5))
+    fill(buffer, 1, range(5, 7))
+
+    assert buffer.get_context(1, 4, 3) is None
+    assert buffer.get_context(1, 6, 3) is not None
+
+
+def test_context_miss_when_trigger_is_beyond_buffer():
+    buffer = MessageBuffer(slack=5)
+    buffer.resize(2)
+    fill(buffer, 1, range(1, 4))
+
+    # Сообщения между 3 и 10 могли быть пропущены - буфер их не покрывает
+    assert buffer.get_context(1, 10, 2) is None
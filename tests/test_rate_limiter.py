@@ -0,0 +1,47 @@
+import logging
+
+from backend.core.rate_limiter import ReplyRateLimiter, parse_limit
+from tests.fakes import make_campaign
+
+
+def test_limits_are_disabled_by_default(monkeypatch):
+    for scope in ("CAMPAIGN", "CHAT", "ACCOUNT"):
+        monkeypatch.delenv(f"RATE_LIMIT_{scope}", raising=False)
+    limiter = ReplyRateLimiter()
+    campaign = make_campaign(1)
+
+    assert all(limiter.acquire(campaign, 100) is None for _ in range(100))
+
+
+def test_invalid_env_limit_logs_warning_and_falls_back(monkeypatch, caplog):
+    monkeypatch.setenv("RATE_LIMIT_CHAT", "three per minute")
+    monkeypatch.setenv("RATE_LIMIT_CAMPAIGN", "1/60")
+    with caplog.at_level(logging.WARNING, logger="backend.core.rate_limiter"):
+        limiter = ReplyRateLimiter()
+
+    assert "three per minute" in caplog.text
+    assert limiter.defaults["chat"] is None
+    assert limiter.defaults["campaign"] == parse_limit("1/60")
+
+
+def test_account_bucket_is_keyed_by_sending_account():
+    limiter = ReplyRateLimiter({"account": "1/60"})
+    # Разные написания одного аккаунта в кампаниях разрешаются в один аккаунт
+    first = make_campaign(1, telegram_account="Sales")
+    second = make_campaign(2, telegram_account="+79000000002")
+
+    assert limiter.acquire(first, 100, "sales") is None
+    assert limiter.acquire(second, 200, "sales") == "account"
+    assert limiter.acquire(second, 200, "support") is None
+    assert limiter.suppressed["account"] == 1
+
+
+def test_campaign_override_and_chat_scope():
+    limiter = ReplyRateLimiter({"chat": "1/60"})
+    campaign = make_campaign(1, settings={"rate_limits": {"chat": "2/60"}})
+
+    assert limiter.acquire(campaign, 100) is None
+    assert limiter.acquire(campaign, 100) is None
+    assert limiter.acquire(campaign, 100) == "chat"
+    # Лимит чата не задевает другие чаты кампании
+    assert limiter.acquire(campaign, 200) is None
@@ -0,0 +1,100 @@
+import asyncio
+
+from backend.core import response_cache as response_cache_module
+from backend.core import telegram_agent as telegram_agent_module
+from backend.core.response_cache import ResponseCache
+from tests.fakes import FakeClient, FakeMessage, make_campaign
+
+CACHED = {"response_cache": True}
+
+
+def test_repeated_question_is_served_from_cache():
+    cache = ResponseCache(max_size=10, ttl=60)
+    campaign = make_campaign(1, settings=CACHED)
+
+    assert cache.lookup(campaign, "Какая цена?", "ctx") is None
+    cache.store(campaign, "Какая цена?", "ctx", "100 рублей", latency=1.5)
+
+    # Регистр и пунктуация не влияют на ключ, контекст - влияет
+    assert cache.lookup(campaign, "какая ЦЕНА!!", "ctx") == "100 рублей"
+    assert cache.lookup(campaign, "Какая цена?", "other") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2 and stats["saved_latency_ms"] == 1500
+
+
+def test_similar_question_hits_when_similarity_is_set():
+    cache = ResponseCache(max_size=10, ttl=60)
+    campaign = make_campaign(1, settings={"response_cache": {"similarity": 0.5}})
+    cache.store(campaign, "Какая цена доставки в Москву?", "", "300 рублей", latency=1.0)
+
+    assert cache.lookup(campaign, "Какая цена доставки по Москве?", "") == "300 рублей"
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_cache_is_off_without_campaign_setting():
+    cache = ResponseCache(max_size=10, ttl=60)
+    campaign = make_campaign(1)
+    cache.store(campaign, "Какая цена?", "", "100 рублей", latency=1.0)
+
+    assert cache.lookup(campaign, "Какая цена?", "") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache_module.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(max_size=10, ttl=60)
+    campaign = make_campaign(1, settings={"response_cache": {"ttl": 30}})
+    cache.store(campaign, "Какая цена?", "", "100 рублей", latency=1.0)
+
+    now[0] += 29
+    assert cache.lookup(campaign, "Какая цена?", "") == "100 рублей"
+    now[0] += 2
+    assert cache.lookup(campaign, "Какая цена?", "") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResponseCache(max_size=2, ttl=60)
+    campaign = make_campaign(1, settings=CACHED)
+    cache.store(campaign, "первый вопрос", "", "первый", latency=1.0)
+    cache.store(campaign, "второй вопрос", "", "второй", latency=1.0)
+
+    # Обращение продлевает жизнь записи - вытесняется второй вопрос
+    assert cache.lookup(campaign, "первый вопрос", "") == "первый"
+    cache.store(campaign, "третий вопрос", "", "третий", latency=1.0)
+
+    assert cache.lookup(campaign, "второй вопрос", "") is None
+    assert cache.lookup(campaign, "первый вопрос", "") == "первый"
+    assert cache.lookup(campaign, "третий вопрос", "") == "третий"
+
+
+def test_error_responses_are_never_cached(monkeypatch):
+    monkeypatch.setattr(telegram_agent_module, "ReconnectAwareClient", FakeClient)
+    agent = telegram_agent_module.TelegramAgent()
+    campaign = make_campaign(1, settings=CACHED)
+    replies = ["Ошибка OpenAI: timeout", RuntimeError("сбой"), "100 рублей"]
+    calls = []
+
+    async def generate(campaign, trigger_message, context_messages, timings):
+        calls.append(trigger_message.id)
+        reply = replies[len(calls) - 1]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(agent, "_select_ai_provider", lambda campaign: "openai")
+    monkeypatch.setattr(agent, "_generate_with_openai", generate)
+
+    async def scenario():
+        return [
+            await agent.generate_response(campaign, FakeMessage(message_id, "Какая цена?"), [])
+            for message_id in range(1, 5)
+        ]
+
+    responses = asyncio.run(scenario())
+
+    # Текст ошибки и заглушка после исключения не попадают в кэш: AI вызывается снова
+    assert calls == [1, 2, 3]
+    assert responses[2:] == ["100 рублей", "100 рублей"]
+    assert agent.response_cache.stats()["stored"] == 1
@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from backend.core.send_scheduler import SendScheduler
+
+
+def flood_wait(seconds: float) -> FloodWaitError:
+    error = FloodWaitError(request=None, capture=0)
+    # Дробное ожидание, чтобы тест не ждал целые секунды
+    error.seconds = seconds
+    return error
+
+
+def make_scheduler(**overrides) -> SendScheduler:
+    options = {"chat_interval": 0, "global_interval": 0, "max_retries": 3, "max_flood_wait": 1}
+    options.update(overrides)
+    return SendScheduler("test", **options)
+
+
+def flaky_send(errors, result="sent"):
+    """send(), который сначала выбрасывает ошибки из errors, затем возвращает result"""
+    attempts = []
+
+    async def send():
+        attempts.append(time.monotonic())
+        if len(attempts) <= len(errors):
+            raise errors[len(attempts) - 1]
+        return result
+
+    return send, attempts
+
+
+def test_flood_wait_is_retried_after_waiting():
+    scheduler = make_scheduler()
+    send, attempts = flaky_send([flood_wait(0.1)])
+
+    assert asyncio.run(scheduler.send(1, send)) == "sent"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+    stats = scheduler.stats()
+    assert stats["flood_waits"] == 1 and stats["sent"] == 1 and stats["failed"] == 0
+
+
+def test_flood_wait_pauses_other_chats_of_the_account():
+    async def scenario():
+        scheduler = make_scheduler()
+        send, attempts = flaky_send([flood_wait(0.1)])
+        first = asyncio.create_task(scheduler.send(1, send))
+        while not attempts:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        other_chat_sent_at = []
+
+        async def other_send():
+            other_chat_sent_at.append(time.monotonic())
+
+        await scheduler.send(2, other_send)
+        await first
+        return attempts[0], other_chat_sent_at[0]
+
+    flood_started, other_chat_sent = asyncio.run(scenario())
+    assert other_chat_sent - flood_started >= 0.09
+
+
+def test_flood_wait_longer_than_limit_is_raised():
+    scheduler = make_scheduler(max_flood_wait=0.5)
+    send, attempts = flaky_send([flood_wait(5)])
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(scheduler.send(1, send))
+    assert len(attempts) == 1
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_flood_wait_gives_up_after_max_retries():
+    scheduler = make_scheduler(max_retries=2)
+    send, attempts = flaky_send([flood_wait(0.01)] * 5)
+
+    with pytest.raises(FloodWaitError):
+        asyncio.run(scheduler.send(1, send))
+    assert len(attempts) == 3
+    assert scheduler.stats()["flood_waits"] == 3
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from backend.core.streaming_reply import StreamInterruptedError, stream_reply
+
+
+async def chunks(*parts, error=None):
+    for part in parts:
+        yield part
+    if error is not None:
+        raise error
+
+
+class Chat:
+    """Отправленные и отредактированные сообщения одного чата"""
+
+    def __init__(self, deliver=True):
+        self.deliver = deliver
+        self.text = None
+
+    async def send(self, text):
+        if not self.deliver:
+            return None
+        self.text = text
+        return self
+
+    async def edit(self, message, text):
+        self.text = text
+        return message
+
+
+def test_full_stream_ends_with_complete_text():
+    chat = Chat()
+    text = asyncio.run(stream_reply(chunks("Первая фраза. ", "Вторая"), chat.send, chat.edit, edit_interval=0))
+
+    assert text == "Первая фраза. Вторая"
+    assert chat.text == "Первая фраза. Вторая"
+
+
+def test_interrupted_stream_reports_delivered_text():
+    chat = Chat()
+    stream = chunks("Первая фраза. ", "Вторая фраза. ", "Обрыв", error=ConnectionError("сеть"))
+
+    with pytest.raises(StreamInterruptedError) as error:
+        asyncio.run(stream_reply(stream, chat.send, chat.edit, edit_interval=60))
+
+    # В чате остаются все законченные фразы, в ошибке - тот же текст
+    assert chat.text == "Первая фраза. Вторая фраза."
+    assert error.value.delivered == chat.text
+
+
+def test_error_before_first_send_is_raised_as_is():
+    chat = Chat()
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(stream_reply(chunks("Без точки", error=ConnectionError("сеть")), chat.send, chat.edit))
+    assert chat.text is None
+
+
+def test_undelivered_send_is_an_error():
+    chat = Chat(deliver=False)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(stream_reply(chunks("Первая фраза. ", "Вторая"), chat.send, chat.edit))
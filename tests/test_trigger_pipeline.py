@@ -0,0 +1,84 @@
+import asyncio
+
+from backend.core.trigger_pipeline import TriggerPipeline
+
+
+def test_triggers_of_one_key_run_in_order_and_keys_run_in_parallel():
+    async def scenario():
+        events = []
+        running = {}
+
+        async def handler(key, index):
+            running[key] = running.get(key, 0) + 1
+            assert running[key] == 1, "триггеры одного ключа выполняются по очереди"
+            events.append(("start", key, index))
+            await asyncio.sleep(0.01 if key == "slow" else 0)
+            events.append(("end", key, index))
+            running[key] -= 1
+
+        pipeline = TriggerPipeline(handler, concurrency=4, max_pending=100, name="test-order")
+        pipeline.start()
+        for index in range(5):
+            await pipeline.submit("slow", "slow", index)
+            await pipeline.submit("fast", "fast", index)
+        await pipeline.join()
+        await pipeline.stop()
+        return events
+
+    events = asyncio.run(scenario())
+    for key in ("slow", "fast"):
+        assert [index for kind, event_key, index in events if kind == "end" and event_key == key] == list(range(5))
+    # Медленный ключ не задерживает быстрый: все быстрые триггеры завершаются раньше медленных
+    last_fast = max(position for position, event in enumerate(events) if event[:2] == ("end", "fast"))
+    last_slow = max(position for position, event in enumerate(events) if event[:2] == ("end", "slow"))
+    assert last_fast < last_slow
+
+
+def test_submit_waits_when_queue_is_full():
+    async def scenario():
+        release = asyncio.Event()
+        handled = []
+
+        async def handler(index):
+            await release.wait()
+            handled.append(index)
+
+        pipeline = TriggerPipeline(handler, concurrency=1, max_pending=2, name="test-backpressure")
+        pipeline.start()
+        await pipeline.submit("chat", 0)
+        await pipeline.submit("chat", 1)
+
+        blocked = asyncio.create_task(pipeline.submit("chat", 2))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        assert pipeline.pending == 2
+
+        release.set()
+        await asyncio.wait_for(blocked, timeout=1)
+        await pipeline.join()
+        await pipeline.stop()
+        assert handled == [0, 1, 2]
+        assert pipeline.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_handler_error_does_not_stop_the_key_queue():
+    async def scenario():
+        handled = []
+
+        async def handler(index):
+            if index == 0:
+                raise RuntimeError("ошибка генерации")
+            handled.append(index)
+
+        pipeline = TriggerPipeline(handler, concurrency=2, max_pending=10, name="test-errors")
+        pipeline.start()
+        for index in range(3):
+            await pipeline.submit("chat", index)
+        await pipeline.join()
+        await pipeline.stop()
+        assert handled == [1, 2]
+        assert pipeline.stats()["chats_waiting"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+import asyncio
+
+from backend.core.trigger_queue import TriggerQueue
+from database.models.base import create_tables
+
+
+def test_reserved_key_skips_repeat_and_reopens_after_failure():
+    create_tables()
+    queue = TriggerQueue(max_attempts=2)
+
+    async def scenario():
+        job_id = await queue.publish(-100700, 1, 70, status="reserved")
+        assert job_id is not None
+        # Повтор сообщения, пока попытка идет или уже удалась, не резервируется
+        assert await queue.publish(-100700, 1, 70, status="reserved") is None
+
+        await queue.complete(job_id, "failed")
+        assert await queue.publish(-100700, 1, 70, status="reserved") == job_id
+
+        # Попытки исчерпаны
+        await queue.complete(job_id, "failed")
+        assert await queue.publish(-100700, 1, 70, status="reserved") is None
+
+        # Резерв без журнала воркеры не забирают
+        claimed = await queue.claim("worker", [queue.partition_for(-100700)], 10)
+        assert job_id not in [job["id"] for job in claimed]
+
+    asyncio.run(scenario())
+
@@ -0,0 +1,138 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from backend.core import telegram_agent as telegram_agent_module
+from database.models.base import SessionLocal, create_tables
+from database.models.trigger_job import TriggerJob
+from tests.fakes import FakeClient, FakeMessage, make_campaign
+
+CHAT_ID = -1000000000740
+
+
+def age_job(job_id, seconds, **fields):
+    """Запись триггера, сделанная seconds секунд назад (до перезапуска)"""
+    db = SessionLocal()
+    try:
+        db.query(TriggerJob).filter(TriggerJob.id == job_id).update(
+            {TriggerJob.created_at: datetime.now(timezone.utc) - timedelta(seconds=seconds), **fields},
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def job_status(job_id):
+    db = SessionLocal()
+    try:
+        return db.query(TriggerJob).get(job_id).status
+    finally:
+        db.close()
+
+
+def restarted_agent(monkeypatch, campaigns):
+    """Агент после перезапуска: кампании загружены, сообщения читаются из фейкового клиента"""
+    monkeypatch.setattr(telegram_agent_module, "ReconnectAwareClient", FakeClient)
+    agent = telegram_agent_module.TelegramAgent()
+    agent.campaigns_by_id = {campaign.id: campaign for campaign in campaigns}
+
+    async def get_messages(entity, ids):
+        return [FakeMessage(message_id, "Какая цена?", chat_id=740) for message_id in ids]
+
+    agent.client_pool.primary.client.get_messages = get_messages
+    submitted = []
+
+    async def submit(key, campaign, message, trigger_keyword=None, coalesced_messages=None, job_id=None, **kwargs):
+        submitted.append((campaign.id, message.id, [merged.id for merged in coalesced_messages], job_id))
+
+    agent.trigger_pipeline.submit = submit
+    return agent, submitted
+
+
+def test_recover_expires_stale_jobs_per_campaign_and_resumes_the_rest(monkeypatch):
+    create_tables()
+    strict = make_campaign(74, settings={"max_trigger_age": 30})
+    lenient = make_campaign(75, settings={"max_trigger_age": 300})
+    agent, submitted = restarted_agent(monkeypatch, [strict, lenient])
+    queue = agent.trigger_queue
+
+    async def scenario():
+        # Оба триггера записаны за минуту до перезапуска и не обработаны
+        stale_id = await queue.publish(CHAT_ID, 31, strict.id)
+        resumed_id = await queue.publish(CHAT_ID, 32, lenient.id, coalesced_message_ids=[30])
+        age_job(stale_id, 60)
+        age_job(resumed_id, 60)
+        max_id = await queue.last_id()
+
+        # Триггер, записанный уже после перезапуска, обрабатывается обычным путем
+        fresh_id = await queue.publish(CHAT_ID, 33, lenient.id)
+
+        await agent._recover_triggers(max_id)
+        return stale_id, resumed_id, fresh_id
+
+    stale_id, resumed_id, fresh_id = asyncio.run(scenario())
+
+    assert job_status(stale_id) == "expired"
+    assert submitted == [(lenient.id, 32, [30], resumed_id)]
+    assert job_status(resumed_id) == "processing"
+    assert job_status(fresh_id) == "queued"
+
+
+def test_recover_resumes_job_of_crashed_worker_once_lease_expires(monkeypatch):
+    create_tables()
+    campaign = make_campaign(76)
+    agent, submitted = restarted_agent(monkeypatch, [campaign])
+    queue = agent.trigger_queue
+
+    async def scenario():
+        job_id = await queue.publish(CHAT_ID, 41, campaign.id)
+        # Процесс взял триггер в обработку и упал до отметки о выполнении
+        age_job(
+            job_id, 10,
+            status="processing",
+            attempts=1,
+            lease_expires_at=datetime.now(timezone.utc) + timedelta(seconds=60)
+        )
+        await agent._recover_triggers(await queue.last_id())
+        assert submitted == []
+
+        # Аренда истекла - триггер досылается
+        age_job(job_id, 10, lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        await agent._recover_triggers(await queue.last_id())
+        return job_id
+
+    job_id = asyncio.run(scenario())
+
+    assert submitted == [(campaign.id, 41, [], job_id)]
+
+
+def test_load_trigger_job_completes_deleted_and_already_handled_messages(monkeypatch):
+    create_tables()
+    campaign = make_campaign(77)
+    agent, _ = restarted_agent(monkeypatch, [campaign])
+    completed = []
+
+    async def complete(job_id, status="done"):
+        completed.append((job_id, status))
+
+    async def deleted(entity, ids):
+        return [None for _ in ids]
+
+    agent.trigger_queue.complete = complete
+    job = {
+        "id": 1, "chat_id": CHAT_ID, "message_id": 51, "campaign_id": campaign.id,
+        "account": None, "trigger_keyword": "цена", "coalesced_message_ids": [], "age": 1.0,
+    }
+
+    async def scenario():
+        agent.client_pool.primary.client.get_messages = deleted
+        assert await agent._load_trigger_job(job) is None
+        # Триггер, уже обработанный этим процессом, не загружается повторно
+        agent.recent_triggers.add((CHAT_ID, 52, campaign.id))
+        assert await agent._load_trigger_job({**job, "id": 2, "message_id": 52}) is None
+        # Кампания выключена после записи триггера
+        assert await agent._load_trigger_job({**job, "id": 3, "campaign_id": 999}) is None
+
+    asyncio.run(scenario())
+
+    assert completed == [(1, "done"), (2, "done"), (3, "done")]